@@ -0,0 +1,281 @@
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from time import perf_counter
+
+
+#Shape of the synthetic history at each size (number of stock transactions)
+BROKERS: list = ['Rico', 'Xp', 'Clear', 'Inter', 'Nuinvest']
+YIELD_TYPES: list = ['dividend', 'jcp', 'rendimentos_de_clientes', 'fracoes_de_acoes']
+DEFAULT_SIZES: list = [1000, 10000, 100000]
+#Storages each size runs on: the embedded SQLite backend, and database.Database on an in-memory mongomock client
+BACKENDS: tuple = ('sqlite', 'mongomock')
+
+
+def tickers(count: int = 500) -> list:
+    '''Deterministic B3 like tickers (ex: TAAB3)'''
+    from itertools import product
+    from string import ascii_uppercase
+
+    return [f'T{"".join(letters)}3' for letters, _ in zip(product(ascii_uppercase, repeat=3), range(count))]
+
+
+def generate_history(stocks: int, yields: int = None, n_tickers: int = 500, n_brokers: int = 5, seed: int = 42) -> tuple:
+    '''Builds a synthetic, deterministic history in date order, as add_transaction would store it.
+    Sells never exceed the position and carry their performance against the running average price
+
+    :param stocks: number of stock transactions (about 1 in 5 is a Sell)
+    :param yields: number of yields (default: half of stocks)
+    :return : (stock transactions, yields, last price of each ticker)'''
+    rnd = random.Random(seed)
+    names = tickers(n_tickers)
+    brokers = BROKERS[:n_brokers]
+    prices = {name: round(rnd.uniform(5, 120), 2) for name in names}
+    yields = stocks // 2 if yields is None else yields
+    start = datetime(2019, 1, 1)
+    days = 5*365
+
+    positions: dict = {}
+    stock_rows = []
+    for day in sorted(rnd.randrange(days) for _ in range(stocks)):
+        broker, stock = rnd.choice(brokers), rnd.choice(names)
+        date = start + timedelta(days=day)
+        price = round(prices[stock]*rnd.uniform(0.7, 1.3), 2)
+        position = positions.setdefault((broker, stock), [0, 0.0])
+        if position[0] and rnd.random() < 0.2:
+            quantity = rnd.randint(1, position[0])
+            average_price = position[1]/position[0]
+            row = {'broker': broker, 'transaction_type': 'Sell', 'stock': stock, 'date': date,
+                   'quantity': -quantity, 'price': -price, 'total_price': -round(quantity*price, 2),
+                   'performance': float(quantity*price - average_price*quantity)}
+        else:
+            quantity = rnd.randint(1, 200)
+            row = {'broker': broker, 'transaction_type': 'Buy', 'stock': stock, 'date': date,
+                   'quantity': quantity, 'price': price, 'total_price': round(quantity*price, 2)}
+        position[0] += row['quantity']
+        position[1] += row['total_price']
+        stock_rows.append(row)
+
+    yield_rows = [{'broker': rnd.choice(brokers), 'yield_type': rnd.choice(YIELD_TYPES), 'stock': rnd.choice(names),
+                   'date': start + timedelta(days=day), 'value': round(rnd.uniform(0.5, 500), 2)}
+                  for day in sorted(rnd.randrange(days) for _ in range(yields))]
+    return stock_rows, yield_rows, prices
+
+
+def generate_closes(prices: dict, seed: int = 42) -> dict:
+    '''Deterministic daily closes (weekdays, 2019 to 2023) of each ticker: a random walk ending near its last price
+
+    :return : dict ticker -> (day numbers, closes), as PriceHistory stores them'''
+    import numpy as np
+
+    from price_history import to_day
+
+    first = to_day(datetime(2019, 1, 1))
+    days = np.arange(first, first + 5*365, dtype='<i4')
+    days = days[(days + 3) % 7 < 5]
+    generator = np.random.default_rng(seed)
+    closes = {}
+    for name, price in prices.items():
+        walk = np.exp(np.cumsum(generator.normal(0, 0.015, len(days))))
+        closes[name] = (days, np.round(price*walk/walk[-1], 2))
+    return closes
+
+
+def _timed(function, repeat: int = 1) -> float:
+    '''Best time of repeat runs, in seconds (printed output is discarded)'''
+    best = None
+    for _ in range(repeat):
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            start = perf_counter()
+            function()
+            elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def open_storage(backend: str, directory: str):
+    '''Storage of a benchmark run: SQLiteDatabase on a file of the directory, or Database on a fresh
+    in-memory mongomock client (the shared client of database.py) with a report cache that never hits,
+    so every report runs its queries'''
+    if backend == 'sqlite':
+        from sqlite_database import SQLiteDatabase
+
+        return SQLiteDatabase(os.path.join(directory, 'investments.db'))
+    if backend == 'mongomock':
+        import mongomock
+
+        import database
+        from report_cache import ReportCache
+
+        database.close_client()
+        database._client = mongomock.MongoClient()
+        return database.Database(cache=ReportCache(os.path.join(directory, 'report_cache.db'), max_entries=0, memory_entries=0))
+    raise KeyError (f'Benchmark backend "{backend}" not Found. Choose one of {list(BACKENDS)}')
+
+
+def close_storage(db) -> None:
+    if hasattr(db, 'connection'):
+        db.connection.close()
+    else:
+        db.cache.close()
+        sys.modules['database'].close_client()
+
+
+def run_size(size: int, workdir: str, repeat: int = 1, seed: int = 42, backend: str = 'sqlite') -> list:
+    '''Times every operation, without prompts, on a synthetic history of size stock transactions.
+    Storage is the embedded SQLite backend or Database on mongomock (see open_storage; both are local
+    stand-ins for a MongoDB server) and prices come from a stub provider
+
+    :return : list of dicts with backend, operation, size, seconds and rows'''
+    from create_table import Table
+    from journal import append_transaction
+    from price_history import PriceHistory, StubHistoryProvider
+    from quotes import QuoteService, StubProvider
+    from statistics import Statistics
+
+    stock_rows, yield_rows, prices = generate_history(size, seed=seed)
+    directory = os.path.join(workdir, backend, str(size))
+    os.makedirs(directory)
+    db = open_storage(backend, directory)
+    quotes = QuoteService(StubProvider(prices))
+    broker = BROKERS[0]
+    results = []
+
+    def record(operation: str, function, rows: int) -> None:
+        try:
+            seconds = _timed(function, repeat)
+        except Exception as e:
+            if backend != 'mongomock':
+                raise
+            #Some server features (ex: the $round expression) are not emulated by mongomock
+            print(f'{backend:<10} {operation:<28} {size:>8}    skipped: {str(e)}')
+            return
+        results.append({'backend': backend, 'operation': operation, 'size': size, 'seconds': round(seconds, 6), 'rows': rows})
+        print(f'{backend:<10} {operation:<28} {size:>8} {seconds:>10.4f} s')
+
+    #Input files, as update_from_csv receives them
+    files = {}
+    for collection, rows in (('stocks', stock_rows), ('yields', yield_rows)):
+        files[collection] = os.path.join(directory, f'{collection}_input.csv')
+        Table.stream_csv(rows, files[collection], Table.COLUMNS[collection])
+
+    record('update_from_csv_stocks', lambda: db.bulk_load('stocks', Table.iter_csv(files['stocks'])), len(stock_rows))
+    record('update_from_csv_yields', lambda: db.bulk_load('yields', Table.iter_csv(files['yields'])), len(yield_rows))
+    record('update_from_csv_sync', lambda: db.sync('stocks', Table.iter_csv(files['stocks'])), len(stock_rows))
+
+    def get_csv() -> None:
+        filename = os.path.join(directory, 'stocks_export.csv')
+        if os.path.exists(filename):
+            os.remove(filename)
+        Table.stream_csv(db.iter_collection('stocks', fields=Table.COLUMNS['stocks']), filename, Table.COLUMNS['stocks'])
+    record('get_csv', get_csv, len(stock_rows))
+
+    def statistics(data) -> Statistics:
+        return Statistics(data, quote_service=quotes, export_to='csv', output_dir=directory)
+    record('get_report_stocks', lambda: (statistics(db.genreport_stocks('', broker)).getreport_stocks(broker),
+                                         statistics(db.genreport_sold_stocks('2019-01-01', '2024-12-31', broker)).getreport_sell(broker)),
+           len(stock_rows))
+    record('get_report_yields', lambda: statistics(db.genreport_yield('2019-01-01', '2024-12-31', broker)).getreport_yield(broker),
+           len(yield_rows))
+    record('get_statistics_stocks', lambda: statistics(db.genreport_stocks('2022-06-30', broker)).generate_stocks_summaries(),
+           len(stock_rows))
+    record('get_statistics_yields',
+           lambda: statistics(db.genreport_yield_summary('2019-01-01', '2024-12-31', broker)).generate_yields_summaries(),
+           len(yield_rows))
+
+    #get_performance: the price history is stored once (as a first update would), then every run reads it
+    history = PriceHistory(os.path.join(directory, 'price_history'), provider=StubHistoryProvider(generate_closes(prices, seed)))
+    history.update(prices, start=datetime(2019, 1, 1), end=datetime(2023, 12, 31))
+    transactions = [row for row in stock_rows if row['broker'] == broker]
+    record('get_performance', lambda: statistics(history.portfolio_series(transactions, datetime(2019, 1, 1), datetime(2023, 12, 31)))
+           .getreport_performance(broker), len(transactions))
+
+    #add_transaction: one journal append and one insert per transaction (as typed by the user)
+    new_rows = generate_history(100, 100, seed=seed + 1)
+    def add_transactions() -> None:
+        for row in new_rows[0] + new_rows[1]:
+            append_transaction(dict(row))
+            db.insert_data(dict(row))
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        record('add_transaction', add_transactions, len(new_rows[0]) + len(new_rows[1]))
+    finally:
+        os.chdir(cwd)
+    close_storage(db)
+    return results
+
+
+def compare(results: list, baseline: list, tolerance: float = 0.2, min_seconds: float = 0.005) -> list:
+    '''Operations slower than the baseline by more than tolerance (and min_seconds).
+    Results without a backend (older runs) are sqlite ones
+
+    :return : list of dicts with backend, operation, size, baseline and current seconds'''
+    previous = {(result.get('backend', 'sqlite'), result['operation'], result['size']): result['seconds'] for result in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get((result.get('backend', 'sqlite'), result['operation'], result['size']))
+        if before is not None and result['seconds'] > before*(1 + tolerance) and result['seconds'] - before > min_seconds:
+            regressions.append({'backend': result.get('backend', 'sqlite'), 'operation': result['operation'], 'size': result['size'],
+                                'baseline': before, 'seconds': result['seconds']})
+    return regressions
+
+
+def mongomock_installed() -> bool:
+    '''True if the mongomock backend can run'''
+    try:
+        import mongomock
+    except ImportError:
+        return False
+    return True
+
+
+def __parse_arguments__():
+    parser = argparse.ArgumentParser(description='Times every operation on synthetic histories')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='Comma separated numbers of stock transactions (yields are half of it)')
+    parser.add_argument('--backends', default=','.join(BACKENDS),
+                        help=f'Comma separated storages to run on (default: {",".join(BACKENDS)}). '
+                             'mongomock is skipped if the mongomock package is not installed')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs of each operation; the best time is kept')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the synthetic history generator')
+    parser.add_argument('--output', default='benchmark.json', help='JSON file where results are saved')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Slowdown over the baseline flagged as regression (0.2 = 20%%)')
+    return parser.parse_args()
+
+
+def main() -> int:
+    logging.basicConfig(level=logging.WARNING)
+    args = __parse_arguments__()
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for backend in args.backends.split(','):
+            if backend == 'mongomock' and not mongomock_installed():
+                print('Skipping the mongomock backend: the mongomock package is not installed (pip install mongomock)')
+                continue
+            for size in (int(size) for size in args.sizes.split(',')):
+                results += run_size(size, workdir, repeat=args.repeat, seed=args.seed, backend=backend)
+    with open(args.output, 'w', encoding='utf-8') as jsonf:
+        json.dump({'created_at': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+                   'platform': platform.platform(), 'seed': args.seed, 'results': results}, jsonf, indent=2)
+    print(f'Results saved to {args.output}')
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as jsonf:
+            regressions = compare(results, json.load(jsonf)['results'], args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression["backend"]} {regression["operation"]} ({regression["size"]}): '
+                  f'{regression["baseline"]:.4f} s -> {regression["seconds"]:.4f} s')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -10,4 +10,100 @@ portfolios = { 'All': ['*'],
 #Currency used
 #The first item is prefix, the second item is the sufix 
 
-currency = ['R$', 'reais']
\ No newline at end of file
+currency = ['R$', 'reais']
+
+#Market quotes settings
+# ttl: seconds a fetched price is reused before asking the provider again
+# max_workers: maximum number of parallel requests sent to the provider
+# suffix: appended to each stock to build the provider ticker (B3 stocks use .SA)
+# store_path: local SQLite file where last prices are kept between runs
+# max_age: seconds after which a stored price is considered stale and refreshed
+
+quotes = {'ttl': 300,
+          'max_workers': 8,
+          'suffix': '.SA',
+          'store_path': 'quotes.db',
+          'max_age': 12*60*60
+          }
+
+#Daily price history (see price_history.py), used by get_performance
+# path: directory with one pair of memory mapped files (days and closes) per stock
+# start_date: first day fetched for a stock without history (when it has no transactions before)
+
+price_history = {'path': 'price_history',
+                 'start_date': '2018-01-01'
+                 }
+
+#Storage backend (see storage.open_database)
+# backend: mongodb (MongoDB, connection at .env) or sqlite (embedded local file, for single user deployments)
+# sqlite_path: file used by the sqlite backend
+
+storage = {'backend': 'mongodb',
+           'sqlite_path': 'investments.db'
+           }
+
+#MongoDB connection pool settings
+# A single client is shared by the whole process (see database.get_client)
+# Timeouts are in milliseconds
+# transactions: write each added stock transaction and its position in one multi-document transaction
+#  (needs a replica set, as Atlas clusters are; on a standalone server both are written without it)
+
+mongo = {'max_pool_size': 10,
+         'min_pool_size': 0,
+         'max_idle_time_ms': 60000,
+         'connect_timeout_ms': 10000,
+         'server_selection_timeout_ms': 10000,
+         'transactions': True
+         }
+
+#Bulk import settings
+# chunk_size: number of rows read from the file and sent in each insert_many
+#  (also the number of documents fetched per round trip when exporting)
+
+bulk = {'chunk_size': 5000}
+
+#Report results cache (see report_cache.py)
+# enabled: if False, every report query goes to the database
+# path: local SQLite file where results are kept between runs
+# max_entries: number of results kept; the least recently used ones are evicted beyond it
+# memory_entries: most recently used results also kept in memory (serves the daemon without reading the file)
+# touch_batch: number of hits whose use times are written to the file together
+# versions_ttl_seconds: how long a process reuses the collection versions it read (0: read on every report).
+#                       Writes of other processes (main.py runs, ingest, the daemon) are not seen until then,
+#                       so only raise it when a single process writes the database (ex: every write goes through the daemon)
+
+report_cache = {'enabled': True,
+                'path': 'report_cache.db',
+                'max_entries': 256,
+                'memory_entries': 32,
+                'touch_batch': 64,
+                'versions_ttl_seconds': 0
+                }
+
+#Metrics of each run (see metrics.py): time without prompt waits, rows and bytes
+#of the database queries, quote fetches, file reads/writes and statistics
+# json_path: file where the summary of the last run is written (None to only log it)
+# prometheus_path: optional Prometheus text file (ex: for node_exporter's textfile collector)
+
+metrics = {'json_path': 'metrics.json',
+           'prometheus_path': None
+           }
+
+#Resident service (see daemon.py): keeps the database connection, quotes and recent
+#reports warm and serves operations to a thin client over local HTTP
+# host: address the service listens on. Keep it on localhost, requests are not authenticated
+# port: TCP port of the service
+# timeout: seconds the client waits for an answer
+
+daemon = {'host': '127.0.0.1',
+          'port': 8765,
+          'timeout': 300
+          }
+
+#Startup budget (checked by main.py --profile-startup)
+# budget_seconds: maximum time spent importing the modules of a lightweight operation
+
+startup = {'budget_seconds': 1.0,
+           'lightweight_operations': ['get_csv', 'ensure_indexes', 'explain_reports',
+                                      'rebuild_positions', 'build_checkpoints']
+           }
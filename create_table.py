@@ -1,22 +1,30 @@
 
-import pandas as pd
+import logging
 from datetime import datetime
+from time import perf_counter
+
+from metrics import metrics, span
 
 
 
 class Table():
     '''Class to handle methods related to csv table'''
+
+    #Columns of each collection, in the order they are written to files
+    COLUMNS: dict = {
+                    'stocks': ['broker', 'transaction_type', 'stock', 'date', 'quantity', 'price', 'total_price', 'performance'],
+                    'yields': ['broker', 'yield_type', 'stock', 'date', 'value']
+                    }
+
     def __init__(self, data ) -> None:
         self.data = data
 
     def create_csv(self) -> None:
-        '''Creates a csv filename specific for yields or specific for stocks
-            Calls export_csv() to create and export the file'''
-        if  'yield_type' in self.data.keys():
-            filename: str = 'yields.csv'
-        elif 'Sell' in self.data['transaction_type'] or 'Buy' in self.data['transaction_type']:
-                filename: str = 'stocks.csv' 
-        self.export_csv(filename)
+        '''Appends self.data (one transaction) to the csv file specific for yields or specific for stocks
+            through the locked append journal (see journal.py)'''
+        from journal import append_transaction
+
+        append_transaction(self.data)
         
      
     def export_csv(self, filename: str) -> None:
@@ -24,6 +32,8 @@ class Table():
         
         :param filename: The desired name of the file'''
         from os.path import exists
+
+        import pandas as pd
         try:
             file_exists: bool = exists(filename)
             if type(self.data) == dict:
@@ -37,21 +47,272 @@ class Table():
         except Exception as e:
             raise Exception('Erro exporting csv, reason: ', str(e))
 
+    @staticmethod
+    def format_value(value) -> str:
+        '''Formats a value as pandas does in export_csv, so every CSV writer of this program
+            (stream_csv, the journal, the csv report sink) writes the same text:
+            dates at midnight as %Y-%m-%d, other dates with their time, None as an empty field'''
+        if value is None:
+            return ''
+        if isinstance(value, datetime):
+            if value.hour == 0 and value.minute == 0 and value.second == 0 and value.microsecond == 0:
+                return value.strftime('%Y-%m-%d')
+            return value.isoformat(sep=' ')
+        return str(value)
+
+    @staticmethod
+    def stream_csv(rows, filename: str, columns: list, buffer_size: int = 1024*1024) -> int:
+        '''Writes rows to a CSV file as they arrive, through a buffered writer,
+            so memory does not grow with the number of rows.
+            As export_csv, appends (without header) if the file already exists.
+            Values are written through format_value
+
+        :param rows: iterable of dicts (ex: a database cursor)
+        :param filename: The desired name of the file
+        :param columns: columns written, in order. Missing fields are left empty, others ignored
+        :return : number of written rows'''
+        from csv import writer as csv_writer
+        from os.path import exists
+
+        logger = logging.getLogger(Table.stream_csv.__qualname__)
+        written = 0
+        start = perf_counter()
+        try:
+            file_exists: bool = exists(filename)
+            with span('table.write_csv') as current, \
+                 open(filename, 'a' if file_exists else 'w', encoding='utf-8', newline='', buffering=buffer_size) as csvf:
+                start_position = csvf.tell()
+                writer = csv_writer(csvf, delimiter=';')
+                if not file_exists:
+                    writer.writerow(columns)
+                format_value = Table.format_value
+                for row in rows:
+                    writer.writerow([format_value(row.get(column)) for column in columns])
+                    written += 1
+                current.rows = written
+                current.bytes = csvf.tell() - start_position
+        except Exception as e:
+            raise Exception('Erro exporting csv, reason: ', str(e))
+        elapsed = perf_counter() - start
+        logger.info(f'{written} rows written to {filename} in {elapsed:.2f} seconds '
+                    f'({written/elapsed if elapsed else 0:.0f} rows/sec)')
+        return written
+
+    #Type of each known column when reading files. Other columns are kept as text
+    COLUMN_TYPES: dict = {
+                            'quantity': 'int',
+                            'price': 'float',
+                            'total_price': 'float',
+                            'date': 'date',
+                            'value': 'float',
+                            'performance': 'float'
+                        }
+
+    @staticmethod
+    def count_fields(csv_path) -> tuple:
+        '''Checks the number of fields of every record of a CSV file (";" separated), before pandas reads it:
+            its C parser drops lines with too many fields (and silently truncates one that starts a chunk)
+            and pads lines with too few
+
+        :return : (number of fields of the header, {record number: number of fields} of the records
+                   to skip: blank ones (0 fields) and those with a wrong number of fields). The header is record 0'''
+        from csv import reader as csv_reader
+
+        skipped: dict = {}
+        #Separators are counted on each line, unless a line with a wrong count holds a quote
+        #(quoted fields may hold separators and line breaks): then the csv module reads the records
+        with open(csv_path, 'rb') as csvf:
+            header_fields = csvf.readline().count(b';') + 1
+            for number, line in enumerate(csvf, start=1):
+                fields = line.count(b';') + 1
+                if fields != header_fields:
+                    if b'"' in line:
+                        break
+                    skipped[number] = fields if line.strip() else 0
+            else:
+                return header_fields, skipped
+        skipped = {}
+        with open(csv_path, encoding='utf-8', newline='') as csvf:
+            records = csv_reader(csvf, delimiter=';')
+            header_fields = len(next(records, []))
+            for number, fields in enumerate(records, start=1):
+                if len(fields) != header_fields:
+                    skipped[number] = len(fields)
+        return header_fields, skipped
+
+    @staticmethod
+    def iter_csv(csv_path, chunksize: int = 5000, bad_rows: list = None, line_numbers: bool = False):
+        '''From a CSV File, yields its rows in lists of up to chunksize rows,
+            translating some of its content to be standart with row's type used in this program.
+            Each chunk is converted column by column (not row by row), so memory is bounded by chunksize.
+            Rows with invalid values or a wrong number of fields are skipped and reported with their line number.
+            Line numbers count physical lines (the header is line 1), except that a quoted field spanning
+            several lines counts as one: after such a field they are approximate.
+            Records with a wrong number of fields are found by count_fields and skipped by pandas' C parser
+
+        :param csv_path: path of the CSV file (";" separated)
+        :param chunksize: maximum number of rows in each yielded list
+        :param bad_rows: if given, receives (line number, column, value) of each skipped row
+                         (column None and the parser message as value for a wrong number of fields)
+        :param line_numbers: if True, yields lists of (line number, row) instead'''
+        from bisect import bisect_right
+        from os.path import getsize
+
+        import pandas as pd
+
+        logger = logging.getLogger(Table.iter_csv.__qualname__)
+        header_fields, skipped = Table.count_fields(csv_path)
+        for number, fields in skipped.items():
+            if fields:
+                reason = f'expected {header_fields} fields, saw {fields}'
+                logger.warning(f'{csv_path} line {number + 1}: {reason}, row skipped')
+                if bad_rows is not None:
+                    bad_rows.append((number + 1, None, reason))
+        skipped_numbers: list = sorted(skipped)
+
+        def line_of(index: int) -> int:
+            '''Line of the row at index (rows count from 0, skipped records left out)'''
+            number = index + 1
+            while index + 1 + bisect_right(skipped_numbers, number) != number:
+                number = index + 1 + bisect_right(skipped_numbers, number)
+            return number + 1
+
+        #format='ISO8601' (fast, one format per column) exists since pandas 2.0; older versions infer each date
+        date_options: dict = {'format': 'ISO8601'} if int(pd.__version__.split('.')[0]) >= 2 else {}
+        #The file size is counted once, on the first chunk
+        unread_bytes = getsize(csv_path)
+        #Time of each chunk, without the time the consumer spends on it
+        start = perf_counter()
+        #Fields are read as python strings (object): converting them is faster than from pandas' string dtype
+        reader = pd.read_csv(csv_path, sep=';', dtype=object, keep_default_na=False, encoding='utf-8', engine='c',
+                             chunksize=chunksize, skiprows=set(skipped), on_bad_lines='warn')
+        for chunk in reader:
+            valid = pd.Series(True, index=chunk.index)
+            for column, column_type in Table.COLUMN_TYPES.items():
+                if column not in chunk.columns:
+                    continue
+                raw = chunk[column]
+                filled = raw != ''
+                if column_type == 'date':
+                    parsed = pd.to_datetime(raw.where(filled), errors='coerce', **date_options)
+                else:
+                    try:
+                        #Parsing every field as float at once is several times faster than to_numeric,
+                        #which is only needed (to find them) when some field is invalid
+                        parsed = pd.Series(raw.where(filled, 'nan').to_numpy().astype('float64'), index=chunk.index)
+                    except ValueError:
+                        parsed = pd.to_numeric(raw.where(filled), errors='coerce')
+                invalid = filled & parsed.isna()
+                if column_type == 'int':
+                    invalid |= filled & (parsed % 1 != 0)
+                for index in chunk.index[invalid & valid]:
+                    line = line_of(index)
+                    logger.warning(f'{csv_path} line {line}: invalid {column} "{raw[index]}", row skipped')
+                    if bad_rows is not None:
+                        bad_rows.append((line, column, raw[index]))
+                valid &= ~invalid
+                if column_type == 'date':
+                    values = pd.Series(parsed.array.to_pydatetime(), index=chunk.index, dtype=object)
+                elif column_type == 'int':
+                    values = parsed.fillna(0).astype('int64').astype(object)
+                else:
+                    values = parsed.astype('float64').astype(object)
+                #Empty fields are kept as empty strings, as in the file
+                chunk[column] = values.where(filled, '')
+            #Rows are built from plain column lists: DataFrame.to_dict boxes every value through pandas
+            chunk = chunk[valid]
+            names: list = list(chunk.columns)
+            rows: list = [dict(zip(names, values)) for values in zip(*(chunk[name].tolist() for name in names))]
+            if line_numbers:
+                rows = list(zip(map(line_of, chunk.index), rows))
+            metrics.record('table.read_csv', perf_counter() - start, len(rows), unread_bytes)
+            unread_bytes = 0
+            if rows:
+                yield rows
+            start = perf_counter()
+
+    @staticmethod
+    def is_parquet(path: str) -> bool:
+        '''True if the file name has a Parquet extension (.parquet or .pq)'''
+        return path.lower().endswith(('.parquet', '.pq'))
+
+    @staticmethod
+    def arrow_schema(columns: list):
+        '''Arrow schema of the columns: typed as COLUMN_TYPES (dates as timestamps),
+            other columns as dictionary encoded text (category)'''
+        import pyarrow as pa
+
+        arrow_types = {'int': pa.int64(), 'float': pa.float64(), 'date': pa.timestamp('ms')}
+        return pa.schema([(column, arrow_types[Table.COLUMN_TYPES[column]] if column in Table.COLUMN_TYPES
+                                    else pa.dictionary(pa.int32(), pa.string())) for column in columns])
+
+    @staticmethod
+    def export_parquet(rows, filename: str, columns: list, row_group_size: int = 5000) -> int:
+        '''Writes rows to a Parquet file with typed columns, one row group per row_group_size rows,
+            so memory does not grow with the number of rows. Unlike CSV, an existing file is replaced
+
+        :param rows: iterable of dicts (ex: a database cursor)
+        :param filename: The desired name of the file
+        :param columns: columns written, in order. Missing or empty fields are written as nulls
+        :return : number of written rows'''
+        from os.path import getsize
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        logger = logging.getLogger(Table.export_parquet.__qualname__)
+        schema = Table.arrow_schema(columns)
+        written = 0
+        start = perf_counter()
+        try:
+            with pq.ParquetWriter(filename, schema, compression='zstd') as writer:
+                batch: list = []
+                for row in rows:
+                    batch.append({column: None if row.get(column) == '' else row.get(column) for column in columns})
+                    if len(batch) >= row_group_size:
+                        writer.write_table(pa.Table.from_pylist(batch, schema=schema), row_group_size=row_group_size)
+                        written += len(batch)
+                        batch = []
+                if batch:
+                    writer.write_table(pa.Table.from_pylist(batch, schema=schema), row_group_size=row_group_size)
+                    written += len(batch)
+        except Exception as e:
+            raise Exception('Erro exporting parquet, reason: ', str(e))
+        elapsed = perf_counter() - start
+        metrics.record('table.write_parquet', elapsed, written, getsize(filename))
+        logger.info(f'{written} rows written to {filename} in {elapsed:.2f} seconds '
+                    f'({written/elapsed if elapsed else 0:.0f} rows/sec)')
+        return written
+
+    @staticmethod
+    def iter_parquet(path: str, chunksize: int = None):
+        '''From a Parquet File, yields its rows in lists, one row group at a time
+            (or up to chunksize rows, if given). Columns are already typed, so nothing is parsed.
+            Null fields are left out of each row
+
+        :param path: path of the Parquet file
+        :param chunksize: maximum number of rows in each yielded list (default: a row group)'''
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(path)
+        if chunksize:
+            batches = parquet_file.iter_batches(batch_size=chunksize)
+        else:
+            batches = (parquet_file.read_row_group(index) for index in range(parquet_file.num_row_groups))
+        #Time of each chunk, without the time the consumer spends on it
+        start = perf_counter()
+        for batch in batches:
+            rows: list = [{column: value for column, value in row.items() if value is not None} for row in batch.to_pylist()]
+            metrics.record('table.read_parquet', perf_counter() - start, len(rows), batch.nbytes)
+            if rows:
+                yield rows
+            start = perf_counter()
+
     @staticmethod
     def import_csv(csv_path) -> list:
         '''From a CSV File, import its data translating some of its content
             to be standart with row's type used in this program'''
-        from csv import DictReader
-
         data: list = []
-        with open(csv_path , encoding='utf-8') as csvf: 
-            csvReader = DictReader(csvf, delimiter = ';') 
-            for row in csvReader: 
-                if row.get('quantity'): row['quantity'] = int(row['quantity'])
-                if row.get('price') : row['price'] = float(row['price'])
-                if row.get('total_price'): row['total_price'] = float(row['total_price'])
-                if row.get('date') : row['date'] = datetime.strptime(row['date'], '%Y-%m-%d')
-                if row.get('value') : row['value'] = float(row['value'])
-                if row.get('performance') : row['performance'] = float(row['performance'])
-                data.append(row)
-        return data
\ No newline at end of file
+        for chunk in Table.iter_csv(csv_path):
+            data.extend(chunk)
+        return data
@@ -0,0 +1,264 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import time
+from urllib import error, request
+
+from config import daemon as daemon_config
+
+
+#Operations served by the daemon and the request fields each one reads
+#(reports follow the job format of runner.py)
+SERVED_OPERATIONS: dict = {
+                    'get_report'      : ('product_type', 'broker', 'threshold_date', 'from_date', 'to_date'),
+                    'get_statistics'  : ('product_type', 'broker', 'portfolio', 'threshold_date', 'from_date', 'to_date'),
+                    'add_transaction' : ('records',),
+                    'ingest'          : ('path',),
+                    'update_from_csv' : ('product_type', 'path', 'mode'),
+                    'get_csv'         : ('product_type', 'path'),
+                    'rebuild_positions': (),
+                    'build_checkpoints': ('broker',)
+                }
+
+
+class Service:
+    '''State kept warm between requests: the storage (with its connection pool), the quote
+    service (with its fetched prices) and the report cache (with its recent results in memory).
+    Requests may run in parallel threads'''
+
+    def __init__(self, offline: bool = False) -> None:
+        from quotes import get_quote_service
+        from report_cache import get_report_cache
+        from storage import open_database
+
+        self.database = open_database()
+        self.quotes = get_quote_service()
+        self.quotes.offline = offline
+        self.cache = get_report_cache()
+        self.started_at = time()
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def health(self) -> dict:
+        '''Uptime, served requests and report cache usage'''
+        from config import storage
+
+        return {'status': 'ok', 'backend': storage['backend'], 'uptime_seconds': round(time() - self.started_at, 3),
+                'requests': self.requests, 'report_cache': self.cache.stats() if self.cache else None}
+
+    def run(self, payload: dict) -> dict:
+        '''Runs one request: a dict with the operation and its fields (see SERVED_OPERATIONS)
+
+        :return : the result of the operation'''
+        from metrics import span
+
+        logger = logging.getLogger(Service.run.__qualname__)
+        operation = payload.get('operation')
+        if operation not in SERVED_OPERATIONS:
+            raise ValueError(f'Operation "{operation}" not served. Choose one of {list(SERVED_OPERATIONS)}')
+        with self._lock:
+            self.requests += 1
+        logger.info(f'Request: {payload if operation != "add_transaction" else operation}')
+        with span(f'daemon.{operation}'):
+            return getattr(self, f'_{operation}')(**{field: payload.get(field) for field in SERVED_OPERATIONS[operation]})
+
+    def _report(self, operation: str, product_type: str, broker: str, **options) -> dict:
+        '''Runs a report job, returning the rows of each report instead of rendering them'''
+        from runner import _queries, compute_job
+
+        job = dict(options, operation=operation, product_type=product_type, broker=broker, export_to='api')
+        reports = [getattr(self.database, name)(**dict(parameters)) for name, parameters in _queries(job)]
+        results = {}
+        compute_job(job, reports, self.quotes, results=results)
+        return {'reports': results}
+
+    def _get_report(self, **fields) -> dict:
+        return self._report('get_report', **fields)
+
+    def _get_statistics(self, **fields) -> dict:
+        return self._report('get_statistics', **fields)
+
+    def _add_transaction(self, records: list) -> dict:
+        '''Adds transactions (Buy/Sell/yield records, as ingest reads them) given in the request'''
+        from ingest import ingest_records
+
+        if not records:
+            raise ValueError('add_transaction needs records')
+        return ingest_records(records, self.database)
+
+    def _ingest(self, path: str) -> dict:
+        from ingest import ingest
+
+        return ingest(path, self.database)
+
+    def _update_from_csv(self, product_type: str, path: str, mode: str = None) -> dict:
+        from config import bulk
+        from create_table import Table
+
+        if Table.is_parquet(path):
+            batches = Table.iter_parquet(path, chunksize=bulk['chunk_size'])
+        else:
+            batches = Table.iter_csv(path, chunksize=bulk['chunk_size'])
+        mode = (mode or 'reload').lower()
+        if mode in ('sync', 'dry-run'):
+            return {'summary': self.database.sync(product_type, batches, dry_run=(mode == 'dry-run'))}
+        if mode == 'reload':
+            return {'inserted': self.database.bulk_load(product_type, batches)}
+        raise ValueError(f'Invalid "{mode}" import mode. '
+                         'Please choose either reload, sync or dry-run')
+
+    def _get_csv(self, product_type: str, path: str) -> dict:
+        from config import bulk
+        from create_table import Table
+
+        if product_type not in Table.COLUMNS:
+            raise ValueError(f'Invalid "{product_type}" Selection. '
+                             'Please choose either stocks or yields')
+        columns: list = Table.COLUMNS[product_type]
+        rows = self.database.iter_collection(product_type, fields=columns, batch_size=bulk['chunk_size'])
+        if Table.is_parquet(path):
+            return {'written': Table.export_parquet(rows, path, columns, row_group_size=bulk['chunk_size'])}
+        return {'written': Table.stream_csv(rows, path, columns)}
+
+    def _rebuild_positions(self) -> dict:
+        self.database.rebuild_positions()
+        return {'status': 'rebuilt'}
+
+    def _build_checkpoints(self, broker: str = None) -> dict:
+        return {'stored': self.database.build_checkpoints(broker or '')}
+
+
+class Handler(BaseHTTPRequestHandler):
+    '''GET /health, GET /metrics (Prometheus text) and POST /run (a JSON request)'''
+    service: Service = None
+
+    def _send(self, status: int, body: str, content_type: str = 'application/json') -> None:
+        content = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _send_json(self, status: int, payload: dict) -> None:
+        self._send(status, json.dumps(payload, default=str, ensure_ascii=False))
+
+    def do_GET(self) -> None:
+        from metrics import metrics
+
+        if self.path == '/health':
+            self._send_json(200, self.service.health())
+        elif self.path == '/metrics':
+            self._send(200, metrics.prometheus(), content_type='text/plain; version=0.0.4')
+        else:
+            self._send_json(404, {'error': f'Not found: {self.path}'})
+
+    def do_POST(self) -> None:
+        logger = logging.getLogger(Handler.do_POST.__qualname__)
+        if self.path != '/run':
+            self._send_json(404, {'error': f'Not found: {self.path}'})
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            result = self.service.run(payload)
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f'Invalid request: {str(e)}')
+            self._send_json(400, {'error': str(e)})
+            return
+        except Exception as e:
+            logger.error(f'Request failed: {str(e)}')
+            self._send_json(500, {'error': str(e)})
+            return
+        self._send_json(200, result)
+
+    def log_message(self, format: str, *args) -> None:
+        logging.getLogger(Handler.__qualname__).debug(format % args)
+
+
+def serve(host: str = daemon_config['host'], port: int = daemon_config['port'], offline: bool = False) -> None:
+    '''Runs the service until interrupted (Ctrl+C)'''
+    logger = logging.getLogger(serve.__qualname__)
+    Handler.service = Service(offline=offline)
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    logger.info(f'Serving on http://{host}:{port}')
+    print(f'Serving on http://{host}:{port} (Ctrl+C to stop)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info('Stopped')
+    finally:
+        server.server_close()
+
+
+def call(payload: dict = None, path: str = '/run', host: str = daemon_config['host'], port: int = daemon_config['port'],
+         timeout: float = daemon_config['timeout']):
+    '''Sends a request to a running service
+
+    :param payload: request of POST /run (None for GET paths)
+    :return : the decoded JSON answer (text for /metrics)'''
+    data = json.dumps(payload, default=str).encode('utf-8') if payload is not None else None
+    http_request = request.Request(f'http://{host}:{port}{path}', data=data,
+                                   headers={'Content-Type': 'application/json'})
+    try:
+        with request.urlopen(http_request, timeout=timeout) as answer:
+            body = answer.read().decode('utf-8')
+    except error.HTTPError as e:
+        raise Exception('Could not run the request: ', json.loads(e.read() or b'{}').get('error', str(e)))
+    except error.URLError as e:
+        raise Exception(f'Could not reach the service at {host}:{port}: ', str(e.reason))
+    return body if path == '/metrics' else json.loads(body)
+
+
+def __parse_arguments__():
+    parser = argparse.ArgumentParser(description='Thin client of the resident service (start it with main.py -o serve)')
+    parser.add_argument('operation', choices=('health', 'metrics') + tuple(SERVED_OPERATIONS))
+    parser.add_argument('-p', '--product_type', dest='product_type', choices=('yields', 'stocks'))
+    parser.add_argument('--broker', help='Broker platform')
+    parser.add_argument('--portfolio', help='Portfolio of config.py (get_statistics, default: all portfolios)')
+    parser.add_argument('--threshold-date', dest='threshold_date', help='[Buy] Threshold date (format %%Y-%%m-%%d)')
+    parser.add_argument('--from-date', dest='from_date', help='From date (format %%Y-%%m-%%d)')
+    parser.add_argument('--to-date', dest='to_date', help='To date (format %%Y-%%m-%%d)')
+    parser.add_argument('--path', help='File read or written by ingest, update_from_csv and get_csv; '
+                                       'JSONL file of records for add_transaction')
+    parser.add_argument('--mode', help='update_from_csv mode: reload, sync or dry-run')
+    parser.add_argument('--json', action='store_true', help='Print the raw JSON answer')
+    return parser.parse_args()
+
+
+def main() -> int:
+    from render import SINKS
+
+    args = __parse_arguments__()
+    try:
+        if args.operation in ('health', 'metrics'):
+            answer = call(path=f'/{args.operation}')
+            print(answer if args.operation == 'metrics' else json.dumps(answer, indent=2))
+            return 0
+        payload = {field: getattr(args, field) for field in SERVED_OPERATIONS[args.operation] if field != 'records'}
+        payload['operation'] = args.operation
+        if payload.get('path'):
+            #The service may run from another directory
+            payload['path'] = os.path.abspath(payload['path'])
+        if args.operation == 'add_transaction':
+            with open(args.path, encoding='utf-8') as jsonf:
+                payload['records'] = [json.loads(line) for line in jsonf if line.strip()]
+        answer = call(payload)
+    except Exception as e:
+        print(*e.args)
+        return 1
+    if args.json or 'reports' not in answer:
+        print(json.dumps(answer, indent=2, ensure_ascii=False))
+    else:
+        for name, rows in answer['reports'].items():
+            print(f'\n==== {name} ====')
+            SINKS['print'].write(rows)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,23 +1,76 @@
-from pymongo import MongoClient
-from dotenv import load_dotenv, find_dotenv
-
 import os
+import threading
 from urllib.parse import quote_plus 
 from datetime import datetime 
 import logging
 
+from config import mongo as mongo_config
+from config import report_cache as cache_config
+from metrics import timed
+from report_cache import get_report_cache
+from storage import Storage
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> 'MongoClient':
+    '''Returns the MongoClient shared by the whole process.
+    It is created on the first call, with the pool size and timeouts from config.py
+    (pymongo is imported only then, so operations start without loading it)'''
+    global _client
+    with _client_lock:
+        if _client is None:
+            from dotenv import load_dotenv, find_dotenv
+            from pymongo import MongoClient
+
+            logger = logging.getLogger(get_client.__qualname__)
+            load_dotenv(find_dotenv())
+            password: str = quote_plus(os.environ.get('MONGODB_PWD'))
+            DB_CONNECTION = ''
+
+            _client = MongoClient(DB_CONNECTION,
+                                  maxPoolSize=mongo_config['max_pool_size'],
+                                  minPoolSize=mongo_config['min_pool_size'],
+                                  maxIdleTimeMS=mongo_config['max_idle_time_ms'],
+                                  connectTimeoutMS=mongo_config['connect_timeout_ms'],
+                                  serverSelectionTimeoutMS=mongo_config['server_selection_timeout_ms'])
+            logger.info('MongoDB client created')
+    return _client
+
 
-class Database:
+def close_client() -> None:
+    '''Closes the shared MongoClient, if it has been created'''
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+            logging.getLogger(close_client.__qualname__).info('MongoDB client closed')
 
-    def __init__(self):
-        load_dotenv(find_dotenv())
-        password: str = quote_plus(os.environ.get('MONGODB_PWD'))
-        DB_CONNECTION = ''
 
-        self.client = MongoClient(DB_CONNECTION)
+class Database(Storage):
+
+    #False once the server has refused a transaction (standalone server): writes go without it
+    _transactions_supported: bool = True
+
+    def __init__(self, cache=None):
+        '''
+        :param cache: ReportCache for report results (default: the process-wide one, None if disabled)'''
+        self.client = get_client()
         self.investment_database = self.client["investment"]
         self.stocks = self.investment_database["stocks"]
         self.yields = self.investment_database["yields"]
+        self.positions = self.investment_database["positions"]
+        self.checkpoints = self.investment_database["position_checkpoints"]
+        #Version of each collection, bumped on every write (keys of the report cache)
+        self.versions = self.investment_database["collection_versions"]
+        #Versions as this process knows them (see _version)
+        self._versions: dict = {}
+        self._versions_read_at = None
+        self.cache = cache if cache is not None else get_report_cache()
+        self._positions_ready = False
 
 
     def _get_databases (self):
@@ -25,6 +78,7 @@ class Database:
         return self.client.list_database_names()
 
 
+    @timed('database.insert_data', rows=lambda result: 1)
     def insert_data ( self, data: dict) -> None:
         '''Inserts data (one row) to yields or stocks collection. 
         If yield_type in data.keys(), redirects to yields collection.
@@ -36,13 +90,61 @@ class Database:
         try:
             if 'yield_type' in data.keys():
                 inserted = self.yields.insert_one(data)
+                self._bump_version('yields')
             elif 'Sell' in data['transaction_type'] or 'Buy' in data['transaction_type']:
-                inserted = self.stocks.insert_one(data)
+                def write(session) -> None:
+                    self.stocks.insert_one(data, session=session)
+                    self._update_position(data, session=session)
+                self._in_transaction(write)
+                inserted = data.get('_id')
+                self._invalidate_checkpoints(data['broker'], data['date'])
+                self._bump_version('stocks')
             logger.info(f'{inserted} data has been successfully inserted')
         except Exception as e:
             raise Exception('Could not insert data: ', str(e))
 
 
+    @timed('database.bulk_insert', rows=int)
+    def bulk_insert(self, collection: str, rows: list) -> int:
+        '''Inserts many rows to yields or stocks collection with a single unordered insert_many.
+        For stocks, positions are updated with one bulk_write and checkpoints from
+        the earliest date of each broker are invalidated
+
+        :param collection: refers to yields or stocks
+        :param rows: list of dicts to be inserted
+        :return : number of inserted rows'''
+        logger = logging.getLogger(Database.bulk_insert.__qualname__)
+        from pymongo import UpdateOne
+
+        if not rows:
+            return 0
+        try:
+            inserted = len(self._get_collection(collection).insert_many(rows, ordered=False).inserted_ids)
+            self._bump_version(collection)
+            if collection == 'stocks':
+                changes: dict = {}
+                first_dates: dict = {}
+                for row in rows:
+                    change = changes.setdefault((row['broker'], row['stock']), [0, 0.0])
+                    change[0] += int(row['quantity'])
+                    change[1] += float(row['total_price'])
+                    self._track_first_date(first_dates, row['broker'], row.get('date'))
+                try:
+                    self.positions.bulk_write([UpdateOne({'broker': broker, 'stock': stock},
+                                                         self._position_update(quantity, total), upsert=True)
+                                               for (broker, stock), (quantity, total) in changes.items()], ordered=False)
+                except Exception as e:
+                    #The rows are already stored: positions are recomputed from them
+                    logger.error(f'Could not update positions ({str(e)}), rebuilding them')
+                    self.rebuild_positions()
+                for broker, first_date in first_dates.items():
+                    self._invalidate_checkpoints(broker, first_date)
+        except Exception as e:
+            raise Exception('Could not insert data: ', str(e))
+        logger.info(f'{inserted} rows inserted into {collection}')
+        return inserted
+
+
     def drop_collection(self, collection: str) -> bool:
         '''Drops yields or stocks collection
 
@@ -55,6 +157,10 @@ class Database:
             raise KeyError (f'{collection} not Found.')
 
         dropped = col.drop()
+        self._bump_version(collection)
+        if collection == 'stocks':
+            self.positions.delete_many({})
+            self.checkpoints.delete_many({})
         if dropped:
             logger.info(f'Collection {col} succesully dropped')
         else:
@@ -62,28 +168,490 @@ class Database:
         return dropped
 
 
+    def _get_collection(self, collection: str):
+        '''Returns yields or stocks collection object from its name'''
+        if collection == 'yields': return self.yields
+        elif collection == 'stocks': return self.stocks
+        elif collection == 'positions': return self.positions
+        elif collection == 'position_checkpoints': return self.checkpoints
+        raise KeyError (f'{collection} not Found.')
+
+
+    @timed('database.bulk_load', rows=int)
+    def bulk_load(self, collection: str, batches, allow_empty: bool = False) -> int:
+        '''Loads batches of rows into a staging collection with unordered insert_many.
+        Only after every batch has been inserted, the staging collection is renamed
+        over the live one, so reports never read an empty or half-filled collection.
+        A load without rows (ex: an empty or unreadable file) is refused unless allow_empty
+
+        :param collection: refers to yields or stocks
+        :param batches: iterable of lists of dicts (ex: Table.iter_csv)
+        :param allow_empty: if True, a load without rows empties the collection
+        :return : number of inserted rows'''
+        logger = logging.getLogger(Database.bulk_load.__qualname__)
+        from time import perf_counter
+
+        target = self._get_collection(collection)
+        staging = self.investment_database[f'{collection}_staging']
+        staging.drop()
+        inserted = 0
+        start = perf_counter()
+        try:
+            for batch in batches:
+                if not batch:
+                    continue
+                staging.insert_many(batch, ordered=False)
+                inserted += len(batch)
+                elapsed = perf_counter() - start
+                logger.info(f'{inserted} rows loaded into {staging.name} '
+                            f'({inserted/elapsed if elapsed else 0:.0f} rows/sec)')
+        except Exception as e:
+            staging.drop()
+            raise Exception('Could not load data, live collection kept untouched: ', str(e))
+        if not inserted and not allow_empty:
+            staging.drop()
+            raise Exception('Could not load data, live collection kept untouched: ', 'no rows to load')
+
+        if inserted:
+            self.ensure_indexes(collection, target=staging)
+            staging.rename(target.name, dropTarget=True)
+        else:
+            target.drop()
+        self._bump_version(collection)
+        if collection == 'stocks':
+            self.rebuild_positions()
+            self.build_checkpoints()
+        elapsed = perf_counter() - start
+        logger.info(f'{inserted} rows swapped into {target.name} in {elapsed:.2f} seconds')
+        return inserted
+
+
+    @timed('database.sync', rows=lambda summary: sum(summary.values()))
+    def sync(self, collection: str, batches, dry_run: bool = False) -> dict:
+        '''Makes a collection match the rows of a file touching only what changed.
+        Each record is identified by SYNC_KEYS (plus its occurrence, for repeated records) and
+        fingerprinted over SYNC_FIELDS. New records are inserted, changed ones replaced and
+        records missing from the file deleted, all with a single unordered bulk_write.
+        The collection and its indexes are never dropped.
+
+        :param collection: refers to yields or stocks
+        :param batches: iterable of lists of dicts (ex: Table.iter_csv)
+        :param dry_run: if True, nothing is written
+        :return : dict with the number of inserted, updated, deleted and unchanged records'''
+        logger = logging.getLogger(Database.sync.__qualname__)
+        from pymongo import DeleteOne, InsertOne, ReplaceOne
+        from time import perf_counter
+
+        target = self._get_collection(collection)
+        start = perf_counter()
+        projection = dict.fromkeys(Database.SYNC_KEYS[collection] + Database.SYNC_FIELDS[collection], 1)
+        stored = ((doc['_id'], doc) for doc in target.find({}, projection, sort=[('_id', 1)], batch_size=5000))
+        changes: dict = self._sync_changes(collection, stored, batches)
+        summary: dict = changes['summary']
+        operations: list = [InsertOne(row) for row in changes['inserts']] + \
+                           [ReplaceOne({'_id': _id}, row) for _id, row in changes['updates']] + \
+                           [DeleteOne({'_id': _id}) for _id in changes['deletes']]
+
+        if dry_run or not operations:
+            logger.info(f'Sync of {collection} {"(dry run) " if dry_run else ""}in {perf_counter() - start:.2f} seconds: {summary}')
+            return summary
+        try:
+            target.bulk_write(operations, ordered=False)
+        except Exception as e:
+            raise Exception('Could not sync data: ', str(e))
+        self._bump_version(collection)
+        if collection == 'stocks':
+            self.rebuild_positions()
+            for broker, first_date in changes['first_dates'].items():
+                self._invalidate_checkpoints(broker, first_date)
+        logger.info(f'Sync of {collection} in {perf_counter() - start:.2f} seconds: {summary}')
+        return summary
+
+
+    #Compound indexes backing the report queries (equality fields first, then date range)
+    INDEXES: dict = {
+                    'stocks': [
+                                [('broker', 1), ('date', 1)],
+                                [('broker', 1), ('transaction_type', 1), ('date', 1)]
+                            ],
+                    'yields': [
+                                [('broker', 1), ('date', 1)]
+                            ],
+                    'positions': [
+                                [('broker', 1), ('stock', 1)]
+                            ],
+                    'position_checkpoints': [
+                                [('broker', 1), ('date', -1)]
+                            ]
+                    }
+
+
+    def ensure_indexes(self, collection: str, target=None) -> list:
+        '''Creates the indexes declared at INDEXES for a collection.
+        It is idempotent: already existing indexes are kept as they are.
+
+        :param collection: refers to yields or stocks
+        :param target: collection object to create the indexes on (default: the live collection)
+        :return : list of index names'''
+        logger = logging.getLogger(Database.ensure_indexes.__qualname__)
+        if target is None:
+            target = self._get_collection(collection)
+        #There is only one position per broker and stock
+        unique: bool = collection == 'positions'
+        names = [target.create_index(keys, unique=unique) for keys in Database.INDEXES[collection]]
+        logger.info(f'Indexes ensured on {target.name}: {names}')
+        return names
+
+
+    #Average price of a position, computed by the database from its running totals
+    _AVERAGE_PRICE: dict = {'$cond': [{'$eq': ['$quantity', 0]}, 0.0, {'$divide': ['$total', '$quantity']}]}
+
+
+    @staticmethod
+    def _position_update(quantity: int, total: float) -> list:
+        '''Update pipeline adding quantity and total to a position and recomputing its average price'''
+        return [{'$set': {'quantity': {'$add': [{'$ifNull': ['$quantity', 0]}, int(quantity)]},
+                          'total': {'$add': [{'$ifNull': ['$total', 0.0]}, float(total)]}}},
+                {'$set': {'average_price': Database._AVERAGE_PRICE}}]
+
+
+    def _update_position(self, data: dict, session=None) -> None:
+        '''Adds a stock transaction to its (broker, stock) position.
+        The whole update runs on the server as a single document operation'''
+        self.positions.update_one({'broker': data['broker'], 'stock': data['stock']},
+                                  self._position_update(data['quantity'], data['total_price']),
+                                  upsert=True, session=session)
+
+
+    def _in_transaction(self, write) -> None:
+        '''Runs write(session) in a multi-document transaction (config.py's mongo transactions).
+        Without transactions (disabled, standalone server or in-memory client) it runs write(None):
+        a crash between its writes may leave positions behind the stocks, and rebuild_positions repairs them'''
+        from pymongo.errors import ConfigurationError, OperationFailure
+
+        logger = logging.getLogger(Database._in_transaction.__qualname__)
+        if mongo_config['transactions'] and Database._transactions_supported:
+            try:
+                with self.client.start_session() as session:
+                    session.with_transaction(write)
+                return
+            except (NotImplementedError, ConfigurationError) as e:
+                reason = str(e)
+            except OperationFailure as e:
+                #IllegalOperation: transactions need a replica set. Nothing was written
+                if e.code != 20:
+                    raise
+                reason = str(e)
+            Database._transactions_supported = False
+            logger.warning(f'Transactions not available ({reason}), writing without them')
+        write(None)
+
+
+    def _ensure_positions(self) -> None:
+        '''Builds the positions on first use of a history stored before they existed
+        (stocks but no positions), so reports and Sells work right after upgrading'''
+        logger = logging.getLogger(Database._ensure_positions.__qualname__)
+        if self._positions_ready:
+            return
+        if self.positions.find_one({}, {'_id': 1}) is None and self.stocks.find_one({}, {'_id': 1}) is not None:
+            logger.info('No positions stored yet, building them from the stocks history')
+            self.rebuild_positions()
+        self._positions_ready = True
+
+
+    def _future_moves(self, brokers: list, stock: str = None) -> dict:
+        '''Totals of the transactions dated after today (positions include them, current reports do not)
+
+        :return : dict (broker, stock) -> (quantity, total)'''
+        match = {'broker': {'$in': list(brokers)}, 'date': {'$gt': self._today()}}
+        if stock is not None:
+            match['stock'] = stock
+        moves = self.stocks.aggregate([{'$match': match},
+                                       {'$group': {'_id': {'broker': '$broker', 'stock': '$stock'},
+                                                   'quantity': {'$sum': '$quantity'}, 'total': {'$sum': '$total_price'}}}])
+        return {(row['_id']['broker'], row['_id']['stock']): (row['quantity'], row['total']) for row in moves}
+
+
+    def rebuild_positions(self) -> None:
+        '''Recomputes the positions collection from the whole stocks history.
+        The result replaces the collection at once ($out), keeping its indexes'''
+        logger = logging.getLogger(Database.rebuild_positions.__qualname__)
+        self.stocks.aggregate([ { '$group': { '_id': {'broker': '$broker', 'stock': '$stock'},
+                                              'total': { '$sum': "$total_price"}, 'quantity': { '$sum': "$quantity"} } },
+                                { '$project': { '_id': 0, 'broker': '$_id.broker', 'stock': '$_id.stock',
+                                                'total': 1, 'quantity': 1, 'average_price': Database._AVERAGE_PRICE} },
+                                { '$out': self.positions.name } ])
+        self.ensure_indexes('positions')
+        #Current positions are part of the stocks reports
+        self._bump_version('stocks')
+        logger.info(f'{self.positions.count_documents({})} positions rebuilt')
+
+
+    def get_positions(self, brokers: list) -> list:
+        '''Returns the current positions (transactions up to today) of every stock at these brokers'''
+        brokers = list(brokers)
+        self._ensure_positions()
+        return self._remove_moves(list(self.positions.find({'broker': {'$in': brokers}}, {'_id': 0})),
+                                  self._future_moves(brokers))
+
+
+    def get_position(self, broker: str, stock: str) -> dict:
+        '''Returns the current position (transactions up to today) of a stock at a broker
+
+        :return : dict with stock, total, quantity and average_price, None if never bought'''
+        self._ensure_positions()
+        position = self.positions.find_one({'broker': broker, 'stock': stock}, {'_id': 0})
+        if position is None:
+            return None
+        return self._remove_moves([position], self._future_moves([broker], stock))[0]
+
+
+    def build_checkpoints(self, broker: str = None) -> int:
+        '''Stores month-end snapshots of the positions of each broker, so reports
+        for a past threshold date only replay transactions after the nearest snapshot.
+        A snapshot is stored only for months with transactions and only for closed months.
+        Each one is keyed at the first instant of the next month and holds the transactions before it
+
+        :param broker: rebuilds only this broker's checkpoints (default: all brokers)
+        :return : number of stored checkpoints'''
+        logger = logging.getLogger(Database.build_checkpoints.__qualname__)
+        now = datetime.now()
+        match = {'date': {'$lt': datetime(now.year, now.month, 1)}}
+        if broker:
+            match['broker'] = broker
+        monthly = self.stocks.aggregate([ {'$match': match},
+                                          { '$group': { '_id': {'broker': '$broker', 'stock': '$stock',
+                                                                'year': {'$year': '$date'}, 'month': {'$month': '$date'}},
+                                                        'total': { '$sum': "$total_price"}, 'quantity': { '$sum': "$quantity"} } },
+                                          { '$sort': {'_id.broker': 1, '_id.year': 1, '_id.month': 1} } ])
+        checkpoints = []
+        running: dict = {}
+        current = None
+        for row in monthly:
+            key = (row['_id']['broker'], row['_id']['year'], row['_id']['month'])
+            if current is not None and key != current:
+                checkpoints.append(self._checkpoint(current, running[current[0]]))
+            current = key
+            position = running.setdefault(key[0], {}).setdefault(row['_id']['stock'], {'total': 0.0, 'quantity': 0})
+            position['total'] += row['total']
+            position['quantity'] += row['quantity']
+        if current is not None:
+            checkpoints.append(self._checkpoint(current, running[current[0]]))
+
+        self.checkpoints.delete_many({'broker': broker} if broker else {})
+        if checkpoints:
+            self.checkpoints.insert_many(checkpoints, ordered=False)
+        self.versions.update_one({'_id': 'position_checkpoints'},
+                                 {'$pull': {'stale': broker}} if broker else {'$set': {'stale': []}}, upsert=True)
+        self.ensure_indexes('position_checkpoints')
+        logger.info(f'{len(checkpoints)} position checkpoints stored')
+        return len(checkpoints)
+
+
+    @staticmethod
+    def _checkpoint(key: tuple, positions: dict) -> dict:
+        '''Builds a checkpoint document for (broker, year, month) from running positions,
+        keyed at the first instant of the next month'''
+        broker, year, month = key
+        return {'broker': broker,
+                'date': datetime(year + month//12, month%12 + 1, 1),
+                'positions': [{'stock': stock, 'total': float(position['total']), 'quantity': int(position['quantity'])}
+                              for stock, position in positions.items()]}
+
+
+    def _invalidate_checkpoints(self, broker: str, date: datetime) -> None:
+        '''Removes checkpoints that should include a transaction at this date (back-dated insert).
+        The broker is marked as stale, so its checkpoints are rebuilt on its next past threshold report'''
+        logger = logging.getLogger(Database._invalidate_checkpoints.__qualname__)
+        deleted = self.checkpoints.delete_many({'broker': broker, 'date': {'$gt': date}}).deleted_count
+        if deleted:
+            self.versions.update_one({'_id': 'position_checkpoints'}, {'$addToSet': {'stale': broker}}, upsert=True)
+            logger.info(f'{deleted} position checkpoints of "{broker}" invalidated')
+
+
+    def _checkpoint_before(self, broker: str, threshold_date: datetime) -> dict:
+        '''Nearest checkpoint of a broker holding only transactions up to threshold_date.
+        Stale checkpoints (invalidated, or keyed at the month's last day by older versions) are rebuilt first'''
+        logger = logging.getLogger(Database._checkpoint_before.__qualname__)
+        query = {'broker': broker, 'date': {'$lte': threshold_date}}
+        checkpoint = self.checkpoints.find_one(query, sort=[('date', -1)])
+        stale = self.versions.find_one({'_id': 'position_checkpoints', 'stale': broker})
+        if stale or (checkpoint and checkpoint['date'].day != 1):
+            logger.info(f'Rebuilding the position checkpoints of "{broker}"')
+            self.build_checkpoints(broker)
+            checkpoint = self.checkpoints.find_one(query, sort=[('date', -1)])
+        return checkpoint
+
+
+    @staticmethod
+    def _stocks_report_pipeline(threshold_date: datetime, broker: str, after_date: datetime = None) -> list:
+        '''Aggregation pipeline used by genreport_stocks.
+        If after_date is given (a checkpoint key), only transactions from it on are aggregated'''
+        date_filter = { '$lte': threshold_date}
+        if after_date is not None:
+            date_filter['$gte'] = after_date
+        return [ {'$match':{ "date": date_filter, "broker": {'$eq': broker} } }, { '$group': { '_id': '$stock', 'total': { '$sum': "$total_price"}, 'quantity': { '$sum': "$quantity"} } } ]
+
+
+    @staticmethod
+    def _sold_stocks_query(from_date: datetime, to_date: datetime, broker: str) -> dict:
+        '''Find filter used by genreport_sold_stocks'''
+        return {'$and' : [{'date': {'$gt': from_date, '$lt': to_date }}, {"broker": {'$eq': broker}},  {"transaction_type": {'$eq': 'Sell'}} ]}
+
+
+    @staticmethod
+    def _yield_query(from_date: datetime, to_date: datetime, broker: str) -> dict:
+        '''Find filter used by genreport_yield'''
+        return {'$and' : [{'date': {'$gt': from_date, '$lt': to_date }}, {"broker": {'$eq': broker}} ]}
+
+
+    @staticmethod
+    def _execution_stats(explained: dict) -> dict:
+        '''Finds executionStats and the winning plan stages in an explain() output
+        (find and aggregate outputs have different shapes)'''
+        found = {'stats': None, 'stages': []}
+
+        def walk(node):
+            if isinstance(node, dict):
+                if found['stats'] is None and 'executionStats' in node:
+                    found['stats'] = node['executionStats']
+                if 'stage' in node and isinstance(node['stage'], str):
+                    found['stages'].append(node['stage'])
+                for value in node.values():
+                    walk(value)
+            elif isinstance(node, list):
+                for value in node:
+                    walk(value)
+        walk(explained)
+        return found
+
+
+    def explain_reports(self, collection: str, broker: str, threshold_date: datetime = None,
+                        from_date: datetime = None, to_date: datetime = None) -> list:
+        '''Runs explain() on the report queries of a collection and returns,
+        for each one, documents examined vs returned, execution time and plan stages.
+
+        :param collection: refers to yields or stocks
+        :param broker: broker used on the queries
+        :return : list of dicts, one per report query'''
+        now = datetime.now()
+        threshold_date = threshold_date or now
+        from_date = from_date or datetime(now.year, 1, 1)
+        to_date = to_date or now
+        if collection == 'stocks':
+            explained = {
+                        'genreport_stocks': self.investment_database.command('explain',
+                                                {'aggregate': self.stocks.name,
+                                                'pipeline': self._stocks_report_pipeline(threshold_date, broker),
+                                                'cursor': {}}, verbosity='executionStats'),
+                        'genreport_sold_stocks': self.stocks.find(self._sold_stocks_query(from_date, to_date, broker)).explain()
+                        }
+        elif collection == 'yields':
+            explained = {'genreport_yield': self.yields.find(self._yield_query(from_date, to_date, broker)).explain()}
+        else:
+            raise KeyError (f'{collection} not Found.')
+
+        results = []
+        for query, output in explained.items():
+            found = self._execution_stats(output)
+            stats = found['stats'] or {}
+            results.append({
+                            'query': query,
+                            'docs_examined': stats.get('totalDocsExamined'),
+                            'keys_examined': stats.get('totalKeysExamined'),
+                            'returned': stats.get('nReturned'),
+                            'execution_time_ms': stats.get('executionTimeMillis'),
+                            'index_used': 'IXSCAN' in found['stages'] and 'COLLSCAN' not in found['stages'],
+                            'stages': list(dict.fromkeys(found['stages']))
+                            })
+        return results
+
+
+    @timed('database.genreport_stocks', rows=len)
     def genreport_stocks (self, threshold_date: str =None, broker: str ='Rico') -> list:
         '''Query stocks matching transaction date before a threshold date 
             and the broker where th stocks were bought 
         
-        :param threshold_date :  Will query stocks bought/sold beofre this date
+        :param threshold_date :  Will query stocks bought/sold beofre this date (current positions if empty)
         :param broker : Stocks bought/sold matching this broker field
         :return : list of dicts containing the result of this query'''
+        if not threshold_date:
+            self._ensure_positions()
+        #Current positions depend on the day (transactions dated after today are left out)
+        return self._cached('genreport_stocks', 'stocks', (threshold_date or None, broker, self._today()),
+                            lambda: self._stocks_report(threshold_date, broker))
+
+
+    def _stocks_report(self, threshold_date: str, broker: str) -> list:
+        '''Runs the genreport_stocks query: current positions, or the nearest
+        checkpoint plus the transactions after it'''
         logger = logging.getLogger(Database.genreport_stocks.__qualname__)
         results = []
         if not threshold_date:
-            logger.debug('Setting date to today')
-            threshold_date = datetime.now().strftime("%Y-%m-%#d") 
-            threshold_date = datetime.strptime(threshold_date,'%Y-%m-%d' )  
-        else:
-            threshold_date = datetime.strptime(threshold_date, '%Y-%m-%d')
-        result = self.stocks.aggregate([ {'$match':{ "date": { '$lte': threshold_date}, "broker": {'$eq': broker} } }, { '$group': { '_id': '$stock', 'total': { '$sum': "$total_price"}, 'quantity': { '$sum': "$quantity"} } } ] )
+            #Current positions are kept up to date on each write
+            logger.debug('Reading current positions')
+            for row in self.get_positions([broker]):
+                results.append({ 'stock' : row['stock'], 'total': float(row['total']) , 'quantity': int(row['quantity'])})
+            return results
+        threshold_date = datetime.strptime(threshold_date, '%Y-%m-%d')
+        #Starts from the nearest earlier checkpoint and replays only the transactions from its key on
+        checkpoint = self._checkpoint_before(broker, threshold_date)
+        positions: dict = {}
+        after_date = None
+        if checkpoint:
+            after_date = checkpoint['date']
+            logger.info(f'Using checkpoint of "{after_date}"')
+            for row in checkpoint['positions']:
+                positions[row['stock']] = { 'stock' : row['stock'], 'total': float(row['total']) , 'quantity': int(row['quantity'])}
+        result = self.stocks.aggregate(self._stocks_report_pipeline(threshold_date, broker, after_date))
         logger.info(f'Threshold date "{threshold_date}"')
         for row in result:
-            results.append({ 'stock' : row['_id'], 'total': float(row['total']) , 'quantity': int(row['quantity'])})
+            position = positions.setdefault(row['_id'], { 'stock' : row['_id'], 'total': 0.0 , 'quantity': 0})
+            position['total'] += float(row['total'])
+            position['quantity'] += int(row['quantity'])
+        results = list(positions.values())
         return results
 
 
+    def _bump_version(self, collection: str) -> None:
+        '''Marks a collection as changed, so cached reports reading it are not served anymore'''
+        self.versions.update_one({'_id': collection}, {'$inc': {'version': 1}}, upsert=True)
+        #Versions kept by this process (see _version) are read again
+        self._versions_read_at = None
+
+
+    def _version(self, collection: str) -> int:
+        '''Version of a collection. Versions of every collection are read in one query, on every report
+        unless config.py's report_cache versions_ttl_seconds allows reusing them (writes of this process
+        always make them read again)'''
+        from time import monotonic
+
+        now = monotonic()
+        ttl = cache_config['versions_ttl_seconds']
+        if self._versions_read_at is None or not ttl or now - self._versions_read_at > ttl:
+            self._versions = {found['_id']: found['version'] for found in self.versions.find({'version': {'$exists': True}})}
+            self._versions_read_at = now
+        return self._versions.get(collection, 0)
+
+
+    def _cached(self, query: str, collection: str, parameters: tuple, run_query):
+        '''Returns the result of a report query from the report cache when the collection
+        has not changed since it was stored; otherwise runs it (run_query()) and stores it
+
+        :param query: name of the report query
+        :param collection: collection read by the query
+        :param parameters: query parameters (dates already parsed)'''
+        if self.cache is None:
+            return run_query()
+        key = self.cache.key(query, parameters, collection, self._version(collection))
+        hit, result = self.cache.get(key)
+        if not hit:
+            result = run_query()
+            self.cache.put(key, result)
+        return result
+
+
+    @timed('database.genreport_sold_stocks', rows=len)
     def genreport_sold_stocks(self, from_date: str = None, to_date: str = None, broker: str='Rico') -> list:
         '''Query Sold Stocks from/to specific period of time, matching a broker
         
@@ -92,22 +660,15 @@ class Database:
         :broker : Stocks sold matching this broker field
         :return : list of dict containing the result of this query'''
         logger = logging.getLogger(Database.genreport_sold_stocks.__qualname__)
-        if from_date:
-            from_date = datetime.strptime(from_date, "%Y-%m-%d")
-        if to_date:
-            to_date = datetime.strptime(to_date, "%Y-%m-%d")
-        if not from_date:
-            this_year = str(datetime.now().year)
-            from_date = datetime.strptime(str(this_year)+'-01-1', '%Y-%m-%d')
-        if not to_date:
-            to_date = datetime.now().strftime("%Y-%m-%#d")
-            to_date = datetime.strptime(to_date,'%Y-%m-%d') 
+        from_date, to_date = self._parse_period(from_date, to_date)
 
         logger.info(f'From date: {from_date} | To date: {to_date}')
-        results = list(self.stocks.find ({'$and' : [{'date': {'$gt': from_date, '$lt': to_date }}, {"broker": {'$eq': broker}},  {"transaction_type": {'$eq': 'Sell'}} ]}))
+        results = self._cached('genreport_sold_stocks', 'stocks', (from_date, to_date, broker),
+                               lambda: list(self.stocks.find (self._sold_stocks_query(from_date, to_date, broker))))
         return results
         
 
+    @timed('database.genreport_yield', rows=len)
     def genreport_yield(self, from_date: str = None, to_date: str = None, broker: str =None) -> list:
         '''Query yields received in a period of time matching a broker
         
@@ -116,22 +677,54 @@ class Database:
         :broker : Stocks sold matching this broker field
         :return : list of dict containing the result of this query'''
         logger = logging.getLogger(Database.genreport_yield.__qualname__)
-        if from_date:
-            from_date = datetime.strptime(from_date, "%Y-%m-%d")
-        if to_date:
-            to_date = datetime.strptime(to_date, "%Y-%m-%d")
-        if not from_date:
-            this_year = str(datetime.now().year)
-            from_date = datetime.strptime(str(this_year)+'-01-1', '%Y-%m-%d')
-        if not to_date:
-            to_date = datetime.now().strftime("%Y-%m-%#d")
-            to_date = datetime.strptime(to_date,'%Y-%m-%d') 
-        result =  list(self.yields.find ({'$and' : [{'date': {'$gt': from_date, '$lt': to_date }}, {"broker": {'$eq': broker}} ]}))
-        #result = self.yields.aggregate([ {'$match':{ "date": { '$gt': from_date, '$lt': to_date}, "broker": {'$eq': broker}} }, { '$group': { '_id': {'stock':'$stock','yield_type':'$yield_type'}, 'total_value': { '$sum': "$value"}  } }  ] )
+        from_date, to_date = self._parse_period(from_date, to_date)
+        result = self._cached('genreport_yield', 'yields', (from_date, to_date, broker),
+                              lambda: list(self.yields.find (self._yield_query(from_date, to_date, broker))))
         logger.info(f'From date: {from_date} | To date: {to_date}')
         return result
 
 
+    @timed('database.genreport_yield_summary', rows=lambda summary: len(summary['monthly']) + len(summary['per_stock']))
+    def genreport_yield_summary(self, from_date: str = None, to_date: str = None, broker: str =None) -> dict:
+        '''Aggregates yields received in a period of time matching a broker.
+        Grouping runs on the server in a single $facet, so only aggregated rows are transferred:
+        - monthly: total per stock and month (each value rounded to cents before summing)
+        - per_stock: total per stock and yield type
+        - total: grand total of the period
+        Rows come in order of their first yield as genreport_yield returns them (insertion order),
+        so summaries list months and stocks in the same order as from the raw rows
+
+        :param from_date : Start date of the time period
+        :param to_date: End date fo the time period
+        :broker : Yields matching this broker field
+        :return : dict with monthly and per_stock (lists of dict) and total (float)'''
+        logger = logging.getLogger(Database.genreport_yield_summary.__qualname__)
+        from_date, to_date = self._parse_period(from_date, to_date)
+        facets = self._cached('genreport_yield_summary', 'yields', (from_date, to_date, broker), lambda: next(
+                    self.yields.aggregate([ {'$match': self._yield_query(from_date, to_date, broker)},
+                                            {'$facet': {
+                                               'monthly': [ { '$group': { '_id': {'stock': '$stock', 'month': {'$month': '$date'}},
+                                                                          'value': { '$sum': {'$round': ['$value', 2]}},
+                                                                          'first_id': {'$min': '$_id'} } },
+                                                            { '$sort': {'first_id': 1} } ],
+                                               'per_stock': [ { '$group': { '_id': {'stock': '$stock', 'yield_type': '$yield_type'},
+                                                                            'value': { '$sum': "$value"},
+                                                                            'first_id': {'$min': '$_id'} } },
+                                                              { '$sort': {'first_id': 1} } ],
+                                               'total': [ { '$group': { '_id': None, 'value': { '$sum': "$value"}, 'count': {'$sum': 1} } } ]
+                                            } } ])))
+        logger.info(f'From date: {from_date} | To date: {to_date}')
+        total = facets['total'][0] if facets['total'] else {'value': 0.0, 'count': 0}
+        logger.info(f'{total["count"]} yields aggregated into {len(facets["monthly"]) + len(facets["per_stock"])} rows')
+        return {
+                'monthly': [{'stock': row['_id']['stock'], 'month': row['_id']['month'], 'value': float(row['value'])}
+                            for row in facets['monthly']],
+                'per_stock': [{'stock': row['_id']['stock'], 'yield_type': row['_id']['yield_type'], 'value': float(row['value'])}
+                              for row in facets['per_stock']],
+                'total': float(total['value'])
+                }
+
+
     def yield_per_stock(self):
         '''Legacy function'''
         from_date = datetime.strptime('2010-10-10', "%Y-%m-%d")
@@ -142,18 +735,32 @@ class Database:
         return list(result)
         
 
-    def find_all(self, collection):
+    def find_all(self, collection, verbose: bool = False):
         '''returns all rows from a collection
             
-            :param collection: the name of the collection, can be either stocks or yields'''
+            :param collection: the name of the collection, can be either stocks or yields
+            :param verbose: if True, prints every row'''
         if collection == 'stocks':
             all_rows = list(self.stocks.find())
         elif collection == 'yields':
             all_rows = list(self.yields.find())
-        print(all_rows)
+        if verbose:
+            print(all_rows)
         return all_rows
 
 
+    def iter_collection(self, collection: str, fields: list = None, batch_size: int = 5000):
+        '''Iterates over all rows of a collection without loading them all in memory.
+        The cursor fetches batch_size documents per round trip
+
+        :param collection: the name of the collection, can be either stocks or yields
+        :param fields: if given, only these fields are transferred (_id is never)
+        :param batch_size: number of documents per round trip'''
+        projection = {field: 1 for field in fields} if fields else {}
+        projection['_id'] = 0
+        return self._get_collection(collection).find({}, projection, batch_size=batch_size)
+
+
     def get_all_rows(self):
         '''Legacy function'''
         rows = []
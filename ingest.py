@@ -0,0 +1,184 @@
+import json
+import logging
+from datetime import datetime
+
+from create_table import Table
+from journal import Journal
+
+
+YIELD_TYPES: tuple = ('dividend', 'jcp', 'rendimentos_de_clientes', 'fracoes_de_acoes')
+
+
+def parse_date(value) -> datetime:
+    '''Date of a record: a datetime, or text starting with %Y-%m-%d
+
+    :raise ValueError: if the date is missing or invalid'''
+    if isinstance(value, datetime):
+        return value
+    if value is None or value == '':
+        raise ValueError('missing date')
+    try:
+        return datetime.strptime(str(value)[:10], '%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f'invalid date "{value}"')
+
+
+def read_records(path: str, bad_rows: list = None):
+    '''Yields (line number, record) of the records of a JSONL (one JSON object per line)
+    or a ";" separated CSV file. Empty CSV fields are left out of each record
+
+    :param path: file path, read as JSONL if it ends with .jsonl or .json
+    :param bad_rows: if given, receives (line number, reason) of each unreadable line'''
+    logger = logging.getLogger(read_records.__qualname__)
+    if path.lower().endswith(('.jsonl', '.json')):
+        with open(path, encoding='utf-8') as jsonf:
+            for line_number, line in enumerate(jsonf, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    if not isinstance(record, dict):
+                        raise ValueError('not a JSON object')
+                    record['date'] = parse_date(record.get('date'))
+                except ValueError as e:
+                    logger.warning(f'{path} line {line_number}: {str(e)}, record skipped')
+                    if bad_rows is not None:
+                        bad_rows.append((line_number, str(e)))
+                    continue
+                yield line_number, record
+    else:
+        csv_bad_rows: list = []
+        for chunk in Table.iter_csv(path, bad_rows=csv_bad_rows, line_numbers=True):
+            for line_number, row in chunk:
+                yield line_number, {key: value for key, value in row.items() if value != ''}
+        if bad_rows is not None:
+            bad_rows.extend((line, value if column is None else f'invalid {column} "{value}"')
+                            for line, column, value in csv_bad_rows)
+
+
+def _yield_row(record: dict) -> dict:
+    '''Builds a yields row as add_transaction does'''
+    yield_type = str(record['yield_type']).lower()
+    if yield_type not in YIELD_TYPES:
+        raise ValueError(f'Invalid yield type "{yield_type}"')
+    return {
+            'broker' : str(record['broker']).capitalize(),
+            'yield_type' : yield_type,
+            'stock' : str(record.get('stock', 'None')),
+            'date' : record['date'],
+            'value' : float(record.get('value', 0))
+            }
+
+
+def _stock_row(record: dict, positions: dict) -> dict:
+    '''Builds a stocks row as add_transaction does, updating the running position.
+    Sell performance is computed against the running average price'''
+    broker = str(record['broker']).capitalize()
+    stock = str(record['stock'])
+    transaction_type = str(record['transaction_type']).capitalize()
+    quantity = abs(int(record.get('quantity', 0)))
+    price = abs(float(record.get('price', 0)))
+    total_price = abs(float(record.get('total_price', quantity*price)))
+    position = positions.setdefault((broker, stock), {'quantity': 0, 'total': 0.0})
+    if transaction_type == 'Buy':
+        data = {
+                'broker': broker,
+                'transaction_type': transaction_type,
+                'stock' : stock,
+                'date' : record['date'],
+                'quantity' : quantity,
+                'price' : price,
+                'total_price' : total_price
+                }
+    elif transaction_type == 'Sell':
+        if not position['quantity']:
+            raise UnboundLocalError (' Stock has not been bought yet ')
+        pm = position['total']/position['quantity']
+        performance = quantity*price - pm*quantity
+        data = {
+                'broker': broker,
+                'transaction_type': transaction_type,
+                'stock' : stock,
+                'date' : record['date'],
+                'quantity' : -quantity,
+                'price' : -price,
+                'total_price' : -total_price,
+                'performance' : float(performance)
+                }
+    else:
+        raise ValueError(f'Invalid transaction type "{transaction_type}"')
+    position['quantity'] += data['quantity']
+    position['total'] += data['total_price']
+    return data
+
+
+def ingest(path: str, mongo_db, export_csv: bool = True) -> dict:
+    '''Loads a file of Buy/Sell/yield records in one run.
+    Records are processed in date order. Sell performance is computed against a running
+    in-memory average price per broker and stock, seeded from the stored positions
+    (so the file is expected to be newer than the stored history).
+    Everything is written with bulk inserts: one for stocks and one for yields.
+
+    :param path: JSONL or CSV file (see read_records)
+    :param mongo_db: Database instance
+    :param export_csv: if True, rows are also appended to stocks.csv/yields.csv
+    :return : dict with the number of inserted stocks and yields and the rejected records'''
+    rejected: list = []
+    return _ingest_numbered(read_records(path, rejected), mongo_db, export_csv, rejected, source=f'{path} line')
+
+
+def ingest_records(records, mongo_db, export_csv: bool = True) -> dict:
+    '''Loads Buy/Sell/yield records already read (ex: sent to daemon.py), as ingest does for a file.
+    Dates may be datetimes or %Y-%m-%d text; records without a valid date are rejected
+
+    :param records: iterable of dicts
+    :return : dict with the number of inserted stocks and yields and the rejected records,
+              numbered by their position in records (from 1)'''
+    return _ingest_numbered(enumerate(records, start=1), mongo_db, export_csv, [], source='request record')
+
+
+def _ingest_numbered(records, mongo_db, export_csv: bool, rejected: list, source: str) -> dict:
+    '''Loads (number, record) pairs, rejecting records by their number
+
+    :param rejected: (number, reason) of records rejected while reading them (ex: unreadable lines)
+    :param source: prefix of the numbers in the logs'''
+    logger = logging.getLogger(_ingest_numbered.__qualname__)
+    dated = []
+    for number, record in records:
+        try:
+            record['date'] = parse_date(record.get('date'))
+        except ValueError as e:
+            logger.warning(f'{source} {number}: {str(e)}, record skipped')
+            rejected.append((number, str(e)))
+            continue
+        dated.append((number, record))
+    records = sorted(dated, key=lambda item: item[1]['date'])
+
+    brokers = {str(record['broker']).capitalize() for _, record in records if 'transaction_type' in record and 'broker' in record}
+    positions: dict = {}
+    for position in mongo_db.get_positions(brokers):
+        positions[(position['broker'], position['stock'])] = {'quantity': position['quantity'], 'total': position['total']}
+
+    stocks: list = []
+    yields: list = []
+    for number, record in records:
+        try:
+            if 'yield_type' in record:
+                yields.append(_yield_row(record))
+            else:
+                stocks.append(_stock_row(record, positions))
+        except (KeyError, ValueError, UnboundLocalError) as e:
+            logger.warning(f'{source} {number}: {str(e)}, record skipped')
+            rejected.append((number, str(e)))
+
+    inserted = {'stocks': mongo_db.bulk_insert('stocks', stocks),
+                'yields': mongo_db.bulk_insert('yields', yields),
+                'rejected': sorted(rejected)}
+    if export_csv:
+        for filename, columns, rows in (('stocks.csv', Table.COLUMNS['stocks'], stocks),
+                                        ('yields.csv', Table.COLUMNS['yields'], yields)):
+            if rows:
+                with Journal(filename, columns, flush_every=len(rows)) as journal:
+                    for row in rows:
+                        journal.append(row)
+    return inserted
@@ -0,0 +1,106 @@
+import csv
+import io
+import logging
+import os
+
+from create_table import Table
+
+
+def _lock(csvf) -> None:
+    '''Blocks until this process holds an exclusive lock on the open file'''
+    if os.name == 'nt':
+        import msvcrt
+
+        csvf.seek(0)
+        msvcrt.locking(csvf.fileno(), msvcrt.LK_LOCK, 1)
+    else:
+        import fcntl
+
+        fcntl.flock(csvf.fileno(), fcntl.LOCK_EX)
+
+
+def _unlock(csvf) -> None:
+    '''Releases the lock taken by _lock'''
+    if os.name == 'nt':
+        import msvcrt
+
+        csvf.seek(0)
+        msvcrt.locking(csvf.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+
+        fcntl.flock(csvf.fileno(), fcntl.LOCK_UN)
+
+
+class Journal:
+    '''Append-only ";" separated file with a fixed column schema (see Table.COLUMNS).
+    Rows are kept in memory and written in batches. Each batch is written while holding
+    an exclusive file lock, so parallel processes never interleave rows or duplicate the header.
+    Use it as a context manager (or call close()) so pending rows are written'''
+
+    def __init__(self, filename: str, columns: list, flush_every: int = 100) -> None:
+        self.filename = filename
+        self.columns = columns
+        self.flush_every = flush_every
+        self._pending: list = []
+
+    def append(self, row: dict) -> None:
+        '''Queues a row, writing the batch when flush_every rows are pending'''
+        self._pending.append(row)
+        if len(self._pending) >= self.flush_every:
+            self.flush()
+
+    def flush(self) -> int:
+        '''Writes every pending row to the file
+
+        :return : number of written rows'''
+        logger = logging.getLogger(Journal.flush.__qualname__)
+        if not self._pending:
+            return 0
+        with open(self.filename, 'a+b') as csvf:
+            _lock(csvf)
+            try:
+                csvf.seek(0)
+                header = csvf.readline().decode('utf-8').rstrip('\r\n')
+                columns = self.columns
+                if header:
+                    #Keeps the columns of an existing file, so it stays parseable
+                    columns = header.split(';')
+                    missing = [column for column in self.columns if column not in columns]
+                    if missing:
+                        logger.warning(f'{self.filename} has no {missing} columns, those values are not written')
+                lines = io.StringIO()
+                writer = csv.writer(lines, delimiter=';', lineterminator='\n')
+                if not header:
+                    writer.writerow(columns)
+                for row in self._pending:
+                    writer.writerow([Table.format_value(row.get(column)) for column in columns])
+                csvf.seek(0, os.SEEK_END)
+                csvf.write(lines.getvalue().encode('utf-8'))
+                csvf.flush()
+                os.fsync(csvf.fileno())
+            finally:
+                _unlock(csvf)
+        written = len(self._pending)
+        self._pending = []
+        logger.info(f'{written} rows appended to {self.filename}')
+        return written
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def append_transaction(data: dict) -> None:
+    '''Appends one transaction to yields.csv or stocks.csv, depending on its fields'''
+    if 'yield_type' in data.keys():
+        filename, columns = 'yields.csv', Table.COLUMNS['yields']
+    elif 'Sell' in data['transaction_type'] or 'Buy' in data['transaction_type']:
+        filename, columns = 'stocks.csv', Table.COLUMNS['stocks']
+    with Journal(filename, columns) as journal:
+        journal.append(data)
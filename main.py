@@ -2,24 +2,89 @@
 import argparse
 import logging
 import os
+import sys
 from datetime import datetime
-from typing import Union
 
-import pytz
 
-from create_table import Table
-from database import Database
-from statistics import Statistics
+#Modules each operation needs. They are imported only when the operation runs,
+#so light operations do not pay for pandas/pymongo/yfinance imports they never use
+OPERATION_MODULES: dict = {
+                    'add_transaction' : ('journal', 'storage'),
+                    'get_report'      : ('storage', 'statistics'),
+                    'get_statistics'  : ('storage', 'statistics'),
+                    'update_from_csv' : ('create_table', 'storage'),
+                    'get_csv'         : ('create_table', 'storage'),
+                    'ensure_indexes'  : ('storage',),
+                    'explain_reports' : ('storage',),
+                    'rebuild_positions': ('storage',),
+                    'build_checkpoints': ('storage',),
+                    'ingest'          : ('ingest', 'storage'),
+                    'run_jobs'        : ('runner', 'storage', 'statistics'),
+                    'serve'           : ('daemon', 'storage', 'statistics'),
+                    'get_performance' : ('storage', 'price_history', 'statistics')
+                }
+
+#Operations that act on both products, so -p is not needed
+OPERATIONS_WITHOUT_PRODUCT: tuple = ('ingest', 'run_jobs', 'serve')
+
+
+def load_operation_modules(operation_type: str) -> dict:
+    '''Imports the modules needed by an operation, measuring each import
+
+    :param operation_type: the kind of the desired operation.
+    :return : dict module name -> seconds spent importing it (0.0 if already imported)'''
+    from importlib import import_module
+    from time import perf_counter
+
+    logger = logging.getLogger(load_operation_modules.__qualname__)
+    import_times = {}
+    for module_name in OPERATION_MODULES[operation_type]:
+        start = perf_counter()
+        import_module(module_name)
+        import_times[module_name] = perf_counter() - start
+        if module_name == 'storage':
+            #The storage backend selected at config.py
+            backend_module: str = sys.modules['storage'].backend_module()
+            start = perf_counter()
+            import_module(backend_module)
+            import_times[backend_module] = perf_counter() - start
+    logger.debug(f'Import times ({operation_type}): ' +
+                 ', '.join(f'{name} {seconds:.3f}s' for name, seconds in import_times.items()))
+    return import_times
 
 
-def run_operations(operation_type: str = None, product_type: str =None):
+def profile_startup(operation_type: str) -> bool:
+    '''Prints the import time breakdown of an operation and checks it against
+    the startup budget of config.py (light operations only)
+
+    :return : True if the operation is within its budget'''
+    from config import startup
+
+    import_times: dict = load_operation_modules(operation_type)
+    total = sum(import_times.values())
+    for module_name, seconds in sorted(import_times.items(), key=lambda item: -item[1]):
+        print(f'{module_name:<15} {seconds:.3f} s')
+    heavy = [name for name in ('pandas', 'pymongo', 'yfinance') if name in sys.modules]
+    print(f'{"total":<15} {total:.3f} s | heavy libraries loaded: {heavy}')
+    if operation_type in startup['lightweight_operations'] and total > startup['budget_seconds']:
+        print(f'Startup budget exceeded: {total:.3f} s > {startup["budget_seconds"]} s')
+        return False
+    return True
+
+
+def run_operations(operation_type: str = None, product_type: str =None, offline: bool = False,
+                   job_options: dict = None):
     '''Defines and call functions do realize desired operation
         :param operation_type: the kind of the desired operation.
-        :param product_type: The operation will act upon this product'''
+        :param product_type: The operation will act upon this product
+        :param offline: If True, market prices are read only from the local quote store
+        :param job_options: run_jobs settings (jobs file, brokers, portfolios, dates, output_dir, workers)'''
 
     def add_transaction(product_type = 'stocks'):
         '''Adds to database and CSV file new transaction'''
 
+        from storage import open_database
+
         logger = logging.getLogger(add_transaction.__qualname__)
         logger.info(f'Product Type: {product_type}')
 
@@ -53,12 +118,11 @@ def run_operations(operation_type: str = None, product_type: str =None):
                         }
             elif 'Sell' == transaction_type:
                 performance = None
-                mongo_db = Database()
-                report: list = mongo_db.genreport_stocks()
-                for row in report:
-                    if row['stock'] == stock:
-                        pm = row['total']/row['quantity']
-                        performance = int(quantity)*float(price)  -  pm*int(quantity) 
+                mongo_db = open_database()
+                position: dict = mongo_db.get_position(broker, stock)
+                if position and position['quantity']:
+                    pm = position['total']/position['quantity']
+                    performance = int(quantity)*float(price)  -  pm*int(quantity) 
                 if not performance:
                     raise UnboundLocalError (' Stock has not been bought yet ')
                 data = {
@@ -124,11 +188,13 @@ def run_operations(operation_type: str = None, product_type: str =None):
         '''Generates query report from database
         Sends report to Statistics Class
         Generates report'''
+        from storage import open_database
+        from statistics import Statistics
 
         logger = logging.getLogger(get_report.__qualname__)
         logger.info(f'Product Type: {product_type}')
         
-        mongo_db = Database()
+        mongo_db = open_database()
         if product_type == 'stocks':
             threshold_date: str  =  input('[Buy] Treshold date (format %Y-%m-%d, Press enter if today): ')
             from_date: str  = input('[Sell] From date (format %Y-%m-%d, Press enter if 1st day of this year): ')
@@ -156,82 +222,248 @@ def run_operations(operation_type: str = None, product_type: str =None):
         '''Generates query from database
         Sends it to Statistics class
         Generates statistics'''
+        from storage import open_database
+        from quotes import get_quote_service
+        from statistics import Statistics
+
         logger = logging.getLogger(get_statistics.__qualname__)
         logger.info(f'Product Type: {product_type}')
+        get_quote_service().offline = offline
         
-        portfolio: str  = input('Portifolio: ')
+        portfolio: str  = input('Portifolio (Press enter for all portfolios): ')
         broker: str  = input('Broker platform: ')
-        mongo_db = Database()
+        mongo_db = open_database()
         if product_type == 'yields':
             from_date: str  = input('From date (format %Y-%m-%d, Press enter if 1st day of this year): ')
             to_date: str  =  input('To date (format %Y-%m-%d, Press enter if today): ')
-            report: list = mongo_db.genreport_yield(from_date=from_date, to_date=to_date, broker=broker)
+            report: dict = mongo_db.genreport_yield_summary(from_date=from_date, to_date=to_date, broker=broker)
             statistics = Statistics(report)
-            statistics.generate_yields_summary(portfolio)
+            if portfolio:
+                statistics.generate_yields_summary(portfolio)
+            else:
+                statistics.generate_yields_summaries()
         elif product_type == 'stocks':
             threshold_date: str  =  input('Treshold date (format %Y-%m-%d, Press enter if today): ')
             report: list = mongo_db.genreport_stocks(threshold_date, broker)
             statistics = Statistics(report)
-            statistics.generate_stocks_summary(portfolio)  
+            if portfolio:
+                statistics.generate_stocks_summary(portfolio)
+            else:
+                statistics.generate_stocks_summaries()
         else:
             raise ValueError(f'Invalid "{product_type}" Selection. '
                     'Please choose either stocks or yield')
     
     def update_from_csv(product_type = 'stocks'):
+        from config import bulk
+        from create_table import Table
+        from storage import open_database
+
         logger = logging.getLogger(update_from_csv.__qualname__)
         logger.info(f'Product Type: {product_type}')
-        '''Update databse from a CSV file'''
-        csv_path : str = input('CSV PATH: ')
+        '''Update databse from a CSV (or Parquet) file'''
+        csv_path : str = input('CSV PATH (or .parquet file): ')
         csv_path = os.path.abspath(csv_path)
         #TODO: Check path
-        data = Table.import_csv(csv_path)
-        mongo_db = Database()
-        mongo_db.drop_collection(product_type)
-        for document in data:
-            mongo_db.insert_data(document)
+        if Table.is_parquet(csv_path):
+            batches = Table.iter_parquet(csv_path, chunksize=bulk['chunk_size'])
+        else:
+            batches = Table.iter_csv(csv_path, chunksize=bulk['chunk_size'])
+        mode: str = input('Import mode - reload, sync or dry-run (Press enter for reload): ').lower()
+        mongo_db = open_database()
+        if mode in ('sync', 'dry-run'):
+            summary: dict = mongo_db.sync(product_type, batches, dry_run=(mode == 'dry-run'))
+            print(f'{product_type} {"would be " if mode == "dry-run" else ""}synced: ' +
+                  ', '.join(f'{count} {change}' for change, count in summary.items()))
+        elif mode in ('', 'reload'):
+            inserted: int = mongo_db.bulk_load(product_type, batches)
+            print(f'{inserted} rows imported into {product_type}')
+        else:
+            raise ValueError(f'Invalid "{mode}" import mode. '
+                    'Please choose either reload, sync or dry-run')
 
     def get_csv(product_type = 'stocks'):
+        from config import bulk
+        from create_table import Table
+        from storage import open_database
+
         logger = logging.getLogger(get_csv.__qualname__)
         logger.info(f'Product Type: {product_type}')
-        '''Export database collection as a CSV File'''
-        csv_filename: str = input('CSV filename: ')
-        mongo_db = Database()
+        '''Export database collection as a CSV (or Parquet) File'''
+        csv_filename: str = input('CSV filename (or .parquet file): ')
+        mongo_db = open_database()
         if product_type.lower() == 'stocks' or product_type.lower() == 'yields':
-            if product_type.lower() == 'stocks':
-                all_rows: list = mongo_db.find_all(product_type.lower())
+            columns: list = Table.COLUMNS[product_type.lower()]
+            rows = mongo_db.iter_collection(product_type.lower(), fields=columns, batch_size=bulk['chunk_size'])
+            if Table.is_parquet(csv_filename):
+                written: int = Table.export_parquet(rows, csv_filename, columns, row_group_size=bulk['chunk_size'])
             else:
-                all_rows: list = mongo_db.find_all(product_type.lower())
-            table = Table(all_rows)
-            table.export_csv(csv_filename) 
-            #TODO: Check creation     
+                written: int = Table.stream_csv(rows, csv_filename, columns)
+            print(f'{written} rows exported to {csv_filename}')
         else:
             raise ValueError(f'Invalid "{product_type}" Selection. '
                     'Please choose either stocks or yield')
         
 
+    def ensure_indexes(product_type = 'stocks'):
+        '''Creates (if missing) the indexes used by the report queries'''
+        from storage import open_database
+
+        logger = logging.getLogger(ensure_indexes.__qualname__)
+        logger.info(f'Product Type: {product_type}')
+        mongo_db = open_database()
+        names: list = mongo_db.ensure_indexes(product_type)
+        print(f'Indexes on {product_type}: {names}')
+
+    def explain_reports(product_type = 'stocks'):
+        '''Prints the query plan summary of each report query'''
+        from storage import open_database
+
+        logger = logging.getLogger(explain_reports.__qualname__)
+        logger.info(f'Product Type: {product_type}')
+        broker: str  = input('Broker platform: ')
+        mongo_db = open_database()
+        for plan in mongo_db.explain_reports(product_type, broker):
+            print(f'\n{plan["query"]}: {"index" if plan["index_used"] else "COLLECTION SCAN"} {plan["stages"]}')
+            print(f'Docs examined: {plan["docs_examined"]} | Keys examined: {plan["keys_examined"]} '
+                    f'| Returned: {plan["returned"]} | Execution time: {plan["execution_time_ms"]} ms')
+
+    def rebuild_positions(product_type = 'stocks'):
+        '''Recomputes current positions (per broker and stock) from the stocks history'''
+        from storage import open_database
+
+        logger = logging.getLogger(rebuild_positions.__qualname__)
+        logger.info(f'Product Type: {product_type}')
+        if product_type != 'stocks':
+            raise ValueError(f'Positions are kept only for stocks, not "{product_type}"')
+        mongo_db = open_database()
+        mongo_db.rebuild_positions()
+
+    def build_checkpoints(product_type = 'stocks'):
+        '''Stores month-end position snapshots used by past threshold date reports'''
+        from storage import open_database
+
+        logger = logging.getLogger(build_checkpoints.__qualname__)
+        logger.info(f'Product Type: {product_type}')
+        if product_type != 'stocks':
+            raise ValueError(f'Checkpoints are kept only for stocks, not "{product_type}"')
+        broker: str  = input('Broker platform (Press enter for all brokers): ')
+        mongo_db = open_database()
+        stored: int = mongo_db.build_checkpoints(broker)
+        print(f'{stored} checkpoints stored')
+
+    def ingest(product_type = None):
+        '''Adds many transactions (stocks and yields) from a JSONL or CSV file in one run'''
+        from storage import open_database
+        from ingest import ingest as ingest_file
+
+        logger = logging.getLogger(ingest.__qualname__)
+        path : str = input('JSONL or CSV PATH: ')
+        path = os.path.abspath(path)
+        mongo_db = open_database()
+        result: dict = ingest_file(path, mongo_db)
+        print(f'{result["stocks"]} stock transactions and {result["yields"]} yields added')
+        for number, reason in result['rejected']:
+            print(f'Record {number} rejected: {reason}')
+        logger.info(f'{len(result["rejected"])} records rejected')
+
+    def run_jobs(product_type = None):
+        '''Runs report jobs (get_report/get_statistics) without prompts, in parallel,
+        from a job file or from brokers x portfolios given by CLI flags'''
+        from storage import open_database
+        from quotes import get_quote_service
+        from runner import expand_jobs, load_jobs, run_jobs as run_report_jobs
+
+        logger = logging.getLogger(run_jobs.__qualname__)
+        options: dict = job_options or {}
+        if options.get('jobs'):
+            jobs: list = load_jobs(options['jobs'])
+        elif options.get('brokers'):
+            jobs: list = expand_jobs(brokers=options['brokers'].split(','),
+                                     portfolios=(options.get('portfolios') or 'All').split(','),
+                                     product_types=[product_type] if product_type else ['stocks', 'yields'],
+                                     threshold_date=options.get('threshold_date'),
+                                     from_date=options.get('from_date'), to_date=options.get('to_date'))
+        else:
+            raise ValueError('run_jobs needs --jobs or --brokers')
+        logger.info(f'{len(jobs)} jobs to run')
+        get_quote_service().offline = offline
+        results: list = run_report_jobs(jobs, options.get('output_dir') or 'reports', open_database(),
+                                        get_quote_service(), max_workers=options.get('workers'))
+        for job, written in results:
+            print(f'{job["operation"]} {job["product_type"]} {job["broker"]} {job.get("portfolio", "")}: {written}')
+
+    def get_performance(product_type = 'stocks'):
+        '''Generates the daily portfolio value, returns and drawdown over a period
+        from the stocks history and the local price history (only missing days are fetched)'''
+        from storage import Storage, open_database
+        from price_history import PriceHistory, split_transactions
+        from statistics import Statistics
+
+        logger = logging.getLogger(get_performance.__qualname__)
+        logger.info(f'Product Type: {product_type}')
+        if product_type != 'stocks':
+            raise ValueError(f'Performance is computed only for stocks, not "{product_type}"')
+        from_date: str  = input('From date (format %Y-%m-%d, Press enter if 1st day of this year): ')
+        to_date: str  =  input('To date (format %Y-%m-%d, Press enter if today): ')
+        broker: str  = input('Broker platform (Press enter for all brokers): ')
+        from_date, to_date = Storage._parse_period(from_date, to_date)
+        mongo_db = open_database()
+        transactions, incomplete = split_transactions(row for row in mongo_db.iter_collection('stocks', fields=['broker', 'stock', 'date', 'quantity', 'total_price'])
+                                                      if not broker or row.get('broker') == broker)
+        if incomplete:
+            logger.warning(f'{len(incomplete)} stock rows left out: missing stock, date, quantity or total_price')
+            print(f'{len(incomplete)} stock rows without stock, date, quantity or total_price left out')
+        history = PriceHistory()
+        if transactions and not offline:
+            history.update([row['stock'] for row in transactions],
+                           start=min(row['date'] for row in transactions), end=to_date)
+        series: list = history.portfolio_series(transactions, from_date, to_date)
+        statistics = Statistics(series)
+        statistics.getreport_performance(broker)
+
+    def serve(product_type = None):
+        '''Keeps the database connection, quotes and recent reports warm and serves
+        operations to the thin client (python daemon.py ...) until interrupted'''
+        from daemon import serve as serve_daemon
+
+        serve_daemon(offline=offline)
+
     operations = {
                     'add_transaction' : add_transaction,
                     'get_report'      : get_report,
                     'get_statistics'  : get_statistics,
                     'update_from_csv' : update_from_csv,
-                    'get_csv'         : get_csv
+                    'get_csv'         : get_csv,
+                    'ensure_indexes'  : ensure_indexes,
+                    'explain_reports' : explain_reports,
+                    'rebuild_positions': rebuild_positions,
+                    'build_checkpoints': build_checkpoints,
+                    'ingest'          : ingest,
+                    'run_jobs'        : run_jobs,
+                    'serve'           : serve,
+                    'get_performance' : get_performance
                 }
 
     
+    load_operation_modules(operation_type)
     operations[operation_type](product_type)
     
 
 
 def export_to_csv(data) -> None:
     '''Export received data to CSV file
-        through Table class'''
-    table = Table(data)
-    table.create_csv()
+        through the append journal'''
+    from journal import append_transaction
+
+    append_transaction(data)
 
 def export_to_db(data: dict) -> None:
     '''Export received data to CSV file
         through Table class'''
-    mongo_db = Database()
+    from storage import open_database
+
+    mongo_db = open_database()
     mongo_db.insert_data(data)
 
 def main():
@@ -247,14 +479,32 @@ def main():
     parsed_args: argparse.Namespace = __parse_arguments__()
     logger.info('====START====')
     logger.debug(f'Arguments parsed: {parsed_args}')
+    if parsed_args.profile_startup:
+        within_budget: bool = profile_startup(parsed_args.operation_type)
+        sys.exit(0 if within_budget else 1)
     start = datetime.now()
     try:
         result = run_operations(operation_type = parsed_args.operation_type,
-                                product_type = parsed_args.product_type)
+                                product_type = parsed_args.product_type,
+                                offline = parsed_args.offline,
+                                job_options = {'jobs': parsed_args.jobs, 'brokers': parsed_args.brokers,
+                                               'portfolios': parsed_args.portfolios,
+                                               'threshold_date': parsed_args.threshold_date,
+                                               'from_date': parsed_args.from_date, 'to_date': parsed_args.to_date,
+                                               'output_dir': parsed_args.output_dir, 'workers': parsed_args.workers})
         
     except Exception as e:
         print(str(e))
     finally:
+        #The MongoDB client exists only if an operation has used the mongodb backend
+        if 'database' in sys.modules:
+            sys.modules['database'].close_client()
+        #Spans exist only if an operation has imported an instrumented module
+        if 'metrics' in sys.modules:
+            from config import metrics as metrics_config
+            sys.modules['metrics'].write_reports(**metrics_config)
+        if 'report_cache' in sys.modules and sys.modules['report_cache']._report_cache is not None:
+            logger.info(f'Report cache: {sys.modules["report_cache"]._report_cache.stats()}')
         end = datetime.now()
         logger.info(f'Total time of execution: {(end - start).total_seconds()} seconds')
         logger.info('====END====')
@@ -271,11 +521,29 @@ def __parse_arguments__():
     parser = argparse.ArgumentParser(description=__description)
     parser.add_argument('-o','--operation_type', help='Operation type', dest='operation_type',
                         choices =('add_transaction', 'get_report', 'get_statistics', 
-                                'update_from_csv', 'get_csv'), required=True)
-    parser.add_argument('-p','--product_type', help='Product type', dest='product_type',
-                        choices =('yields', 'stocks'), required=True)
+                                'update_from_csv', 'get_csv', 'ensure_indexes',
+                                'explain_reports', 'rebuild_positions', 'build_checkpoints',
+                                'ingest', 'run_jobs', 'serve', 'get_performance'), required=True)
+    parser.add_argument('-p','--product_type', help='Product type (not needed by ingest, run_jobs and serve)', dest='product_type',
+                        choices =('yields', 'stocks'))
+    parser.add_argument('--offline', help='Use only locally stored market prices (stale ones are flagged) and price history',
+                        dest='offline', action='store_true')
+    parser.add_argument('--profile-startup', help='Print the import time of the operation and exit (status 1 if over budget)',
+                        dest='profile_startup', action='store_true')
+    jobs_group = parser.add_argument_group('run_jobs', 'Headless reports (-o run_jobs)')
+    jobs_group.add_argument('--jobs', help='JSON job file', dest='jobs')
+    jobs_group.add_argument('--brokers', help='Comma separated brokers (one job per broker x portfolio)', dest='brokers')
+    jobs_group.add_argument('--portfolios', help='Comma separated portfolios of config.py (default: All)', dest='portfolios')
+    jobs_group.add_argument('--threshold-date', help='[Buy] Threshold date (format %%Y-%%m-%%d, default today)', dest='threshold_date')
+    jobs_group.add_argument('--from-date', help='From date (format %%Y-%%m-%%d, default 1st day of this year)', dest='from_date')
+    jobs_group.add_argument('--to-date', help='To date (format %%Y-%%m-%%d, default today)', dest='to_date')
+    jobs_group.add_argument('--output-dir', help='Directory where reports are written (default: reports)', dest='output_dir')
+    jobs_group.add_argument('--workers', help='Number of worker processes (default: number of cores)', dest='workers', type=int)
 
-    return parser.parse_args()
+    parsed_args = parser.parse_args()
+    if not parsed_args.product_type and parsed_args.operation_type not in OPERATIONS_WITHOUT_PRODUCT:
+        parser.error(f'the following arguments are required for {parsed_args.operation_type}: -p/--product_type')
+    return parsed_args
 
 if __name__ == '__main__':
     main()
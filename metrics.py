@@ -0,0 +1,145 @@
+import functools
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+
+class Span:
+    '''A timed section of code. Code inside it may add the rows and bytes it handled'''
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.rows = 0
+        self.bytes = 0
+        #Seconds spent waiting for the user, excluded from the duration
+        self.paused = 0.0
+
+
+class Metrics:
+    '''Aggregates spans per name: calls, seconds (without prompt waits), rows and bytes.
+    Spans may be nested and opened from several threads'''
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._totals: dict = {}
+
+    def _active(self) -> list:
+        if not hasattr(self._local, 'spans'):
+            self._local.spans = []
+        return self._local.spans
+
+    @contextmanager
+    def span(self, name: str):
+        '''Times the enclosed code as one call of the span name'''
+        current = Span(name)
+        active = self._active()
+        active.append(current)
+        start = perf_counter()
+        try:
+            yield current
+        finally:
+            seconds = perf_counter() - start - current.paused
+            active.pop()
+            self.record(name, seconds, current.rows, current.bytes)
+
+    def _totals_of(self, name: str) -> dict:
+        return self._totals.setdefault(name, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'rows': 0, 'bytes': 0})
+
+    def record(self, name: str, seconds: float, rows: int = 0, size: int = 0) -> None:
+        '''Adds one call to the totals of a span name'''
+        with self._lock:
+            totals = self._totals_of(name)
+            totals['calls'] += 1
+            totals['seconds'] += seconds
+            totals['max_seconds'] = max(totals['max_seconds'], seconds)
+            totals['rows'] += rows
+            totals['bytes'] += size
+
+    def merge(self, summary: dict) -> None:
+        '''Adds the totals of another Metrics (its summary), ex: of a worker process of runner.run_jobs'''
+        with self._lock:
+            for name, values in summary.items():
+                totals = self._totals_of(name)
+                for field in ('calls', 'seconds', 'rows', 'bytes'):
+                    totals[field] += values[field]
+                totals['max_seconds'] = max(totals['max_seconds'], values['max_seconds'])
+
+    def prompt(self, text: str) -> str:
+        '''input(), with the wait excluded from every open span of this thread'''
+        start = perf_counter()
+        try:
+            return input(text)
+        finally:
+            waited = perf_counter() - start
+            for current in self._active():
+                current.paused += waited
+
+    def summary(self) -> dict:
+        '''Totals per span name, slowest first'''
+        with self._lock:
+            totals = {name: dict(values) for name, values in self._totals.items()}
+        for values in totals.values():
+            values['seconds'] = round(values['seconds'], 6)
+            values['max_seconds'] = round(values['max_seconds'], 6)
+        return dict(sorted(totals.items(), key=lambda item: -item[1]['seconds']))
+
+    def prometheus(self) -> str:
+        '''Totals in the Prometheus text exposition format'''
+        lines = []
+        summary = self.summary()
+        for metric, field, help_text in (('investments_span_seconds_total', 'seconds', 'Time spent in the span, without prompt waits'),
+                                         ('investments_span_calls_total', 'calls', 'Number of times the span ran'),
+                                         ('investments_span_rows_total', 'rows', 'Rows handled by the span'),
+                                         ('investments_span_bytes_total', 'bytes', 'Bytes read or written by the span')):
+            lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} counter')
+            for name, values in summary.items():
+                lines.append(f'{metric}{{span="{name}"}} {values[field]}')
+        return '\n'.join(lines) + '\n'
+
+    def clear(self) -> None:
+        with self._lock:
+            self._totals.clear()
+
+
+#Metrics of the whole process
+metrics = Metrics()
+span = metrics.span
+prompt = metrics.prompt
+
+
+def timed(name: str, rows=None):
+    '''Decorator timing each call of a function as the span name
+
+    :param rows: optional function of the result returning the number of rows handled'''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with metrics.span(name) as current:
+                result = function(*args, **kwargs)
+                if rows is not None:
+                    current.rows += rows(result)
+            return result
+        return wrapper
+    return decorator
+
+
+def write_reports(json_path: str = None, prometheus_path: str = None) -> dict:
+    '''Logs the summary of this run and writes it as JSON and/or Prometheus text files
+
+    :return : the summary'''
+    logger = logging.getLogger(write_reports.__qualname__)
+    summary = metrics.summary()
+    if not summary:
+        return summary
+    logger.info(f'Metrics: {json.dumps(summary)}')
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as jsonf:
+            json.dump(summary, jsonf, indent=2)
+    if prometheus_path:
+        with open(prometheus_path, 'w', encoding='utf-8') as promf:
+            promf.write(metrics.prometheus())
+    return summary
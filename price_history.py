@@ -0,0 +1,353 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from config import price_history as history_config
+from config import quotes as quotes_config
+from metrics import span, timed
+
+
+#Columns of each ticker: trading days (days since 1970-01-01) and closing prices, one file each
+DAY_DTYPE = np.dtype('<i4')
+CLOSE_DTYPE = np.dtype('<f8')
+#Fields a stock row needs to be valued by portfolio_series
+TRANSACTION_FIELDS: tuple = ('stock', 'date', 'quantity', 'total_price')
+
+
+def to_day(date) -> int:
+    '''Day number (days since 1970-01-01) of a date or datetime'''
+    return int(np.datetime64(date, 'D').astype(np.int64))
+
+
+def from_day(day: int) -> str:
+    '''Date (format %Y-%m-%d) of a day number'''
+    return str(np.datetime64(int(day), 'D'))
+
+
+def split_transactions(transactions) -> tuple:
+    '''Separates the stock rows portfolio_series can value (every TRANSACTION_FIELDS set,
+    date as a datetime) from the incomplete ones
+
+    :return : (valid rows, incomplete rows)'''
+    valid, incomplete = [], []
+    for row in transactions:
+        complete = all(row.get(field) not in (None, '') for field in TRANSACTION_FIELDS)
+        (valid if complete and isinstance(row['date'], datetime) else incomplete).append(row)
+    return valid, incomplete
+
+
+class YFinanceHistoryProvider:
+    '''Fetches daily closing prices from Yahoo Finance through yfinance.
+    Each ticker is requested by a bounded pool of workers'''
+
+    def __init__(self, suffix: str = quotes_config['suffix'], max_workers: int = quotes_config['max_workers']) -> None:
+        self.suffix = suffix
+        self.max_workers = max_workers
+
+    def _fetch_one(self, request: tuple) -> tuple:
+        '''Returns (days, closes) of a single stock between two day numbers (both included), None if it failed'''
+        from yfinance import Ticker
+
+        logger = logging.getLogger(YFinanceHistoryProvider._fetch_one.__qualname__)
+        stock, start, end = request
+        try:
+            frame = Ticker(stock + self.suffix).history(start=from_day(start), end=from_day(end + 1),
+                                                        auto_adjust=False, actions=False)
+            closes = frame['Close'].dropna()
+            days = closes.index.tz_localize(None).values.astype('datetime64[D]').astype(DAY_DTYPE)
+            return days, closes.to_numpy(dtype=CLOSE_DTYPE)
+        except Exception as e:
+            logger.warning(f'Could not fetch price history of "{stock}", reason: {str(e)}')
+            return None
+
+    def fetch(self, requests: dict) -> dict:
+        '''Fetches the daily closes of all received stocks
+
+        :param requests: dict stock -> (first day, last day) as day numbers
+        :return : dict stock -> (days, closes) arrays (None for stocks that could not be fetched)'''
+        if not requests:
+            return {}
+        workers = max(1, min(self.max_workers, len(requests)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            histories = list(executor.map(self._fetch_one, [(stock,) + period for stock, period in requests.items()]))
+        return dict(zip(requests, histories))
+
+
+class StubHistoryProvider:
+    '''Local provider returning fixed histories. Used to run without network'''
+
+    def __init__(self, histories: dict = None) -> None:
+        self.histories = dict(histories or {})
+        self.calls = 0
+
+    def fetch(self, requests: dict) -> dict:
+        '''Returns the configured (days, closes) of each stock within its period'''
+        self.calls += 1
+        fetched = {}
+        for stock, (start, end) in requests.items():
+            days, closes = self.histories.get(stock, (np.empty(0, DAY_DTYPE), np.empty(0, CLOSE_DTYPE)))
+            days = np.asarray(days, dtype=DAY_DTYPE)
+            selected = (days >= start) & (days <= end)
+            fetched[stock] = days[selected], np.asarray(closes, dtype=CLOSE_DTYPE)[selected]
+        return fetched
+
+
+class PriceHistory:
+    '''Daily closing prices kept on local files, one pair per ticker (<ticker>.days and <ticker>.closes,
+    raw little endian arrays). Files are read as memory maps, so only the pages a query touches are loaded.
+    Each update appends the days after the last stored one; days before the first stored one
+    (an earlier start) are prepended by rewriting both files'''
+
+    def __init__(self, path: str = history_config['path'], provider=None) -> None:
+        self.path = path
+        self.provider = provider if provider is not None else YFinanceHistoryProvider()
+        os.makedirs(path, exist_ok=True)
+
+    def _base(self, stock: str) -> str:
+        return os.path.join(self.path, stock.replace(os.sep, '_').replace('/', '_'))
+
+    def _files(self, stock: str) -> tuple:
+        base = self._base(stock)
+        return f'{base}.days', f'{base}.closes'
+
+    def _start_file(self, stock: str) -> str:
+        '''Text file with the earliest fetched day number, kept so days before a stock's first close are not fetched again'''
+        return f'{self._base(stock)}.start'
+
+    def covered_from(self, stock: str) -> int:
+        '''Earliest day number already fetched for a stock (there may be no close on it), None if it has no history'''
+        first_day = self.first_day(stock)
+        if first_day is not None and os.path.exists(self._start_file(stock)):
+            with open(self._start_file(stock), encoding='utf-8') as startf:
+                return min(first_day, int(startf.read()))
+        return first_day
+
+    def _set_covered_from(self, stock: str, day: int) -> None:
+        with open(self._start_file(stock), 'w', encoding='utf-8') as startf:
+            startf.write(str(day))
+
+    def _length(self, stock: str) -> int:
+        '''Number of stored days. Files left with different lengths (an interrupted append) are cut to the shorter one,
+        and an interrupted rewrite (see prepend) is finished or discarded'''
+        days_file, closes_file = self._files(stock)
+        self._recover(days_file, closes_file)
+        if not os.path.exists(days_file) or not os.path.exists(closes_file):
+            return 0
+        days_size, closes_size = os.path.getsize(days_file), os.path.getsize(closes_file)
+        length = min(days_size // DAY_DTYPE.itemsize, closes_size // CLOSE_DTYPE.itemsize)
+        if days_size != length*DAY_DTYPE.itemsize:
+            os.truncate(days_file, length*DAY_DTYPE.itemsize)
+        if closes_size != length*CLOSE_DTYPE.itemsize:
+            os.truncate(closes_file, length*CLOSE_DTYPE.itemsize)
+        return length
+
+    @staticmethod
+    def _recover(days_file: str, closes_file: str) -> None:
+        '''Finishes a rewrite stopped between its renames (the days file is renamed last),
+        or drops its temporary files if they were not fully written'''
+        days_tmp, closes_tmp = days_file + '.tmp', closes_file + '.tmp'
+        if not os.path.exists(days_tmp):
+            if os.path.exists(closes_tmp):
+                os.remove(closes_tmp)
+            return
+        if not os.path.exists(closes_tmp):
+            os.replace(days_tmp, days_file)
+        elif os.path.getsize(days_tmp)//DAY_DTYPE.itemsize == os.path.getsize(closes_tmp)//CLOSE_DTYPE.itemsize:
+            os.replace(closes_tmp, closes_file)
+            os.replace(days_tmp, days_file)
+        else:
+            os.remove(days_tmp)
+            os.remove(closes_tmp)
+
+    def load(self, stock: str) -> tuple:
+        '''Stored history of a stock, as read only memory maps
+
+        :return : (days, closes) arrays, days in ascending order'''
+        length = self._length(stock)
+        if not length:
+            return np.empty(0, DAY_DTYPE), np.empty(0, CLOSE_DTYPE)
+        days_file, closes_file = self._files(stock)
+        return (np.memmap(days_file, dtype=DAY_DTYPE, mode='r', shape=(length,)),
+                np.memmap(closes_file, dtype=CLOSE_DTYPE, mode='r', shape=(length,)))
+
+    def last_day(self, stock: str) -> int:
+        '''Last stored day number of a stock, None if it has no history'''
+        days, _ = self.load(stock)
+        return int(days[-1]) if len(days) else None
+
+    def first_day(self, stock: str) -> int:
+        '''First stored day number of a stock, None if it has no history'''
+        days, _ = self.load(stock)
+        return int(days[0]) if len(days) else None
+
+    @staticmethod
+    def _sorted(days, closes) -> tuple:
+        '''Days in ascending order without repetitions, with their closes'''
+        days = np.asarray(days, dtype=DAY_DTYPE)
+        closes = np.asarray(closes, dtype=CLOSE_DTYPE)
+        order = np.argsort(days, kind='stable')
+        days, unique = np.unique(days[order], return_index=True)
+        return days, closes[order][unique]
+
+    def append(self, stock: str, days, closes) -> int:
+        '''Appends the days after the last stored one (earlier or repeated days are ignored)
+
+        :return : number of appended days'''
+        days, closes = self._sorted(days, closes)
+        last_day = self.last_day(stock)
+        if last_day is not None:
+            newer = days > last_day
+            days, closes = days[newer], closes[newer]
+        if not len(days):
+            return 0
+        days_file, closes_file = self._files(stock)
+        with open(closes_file, 'ab') as closesf, open(days_file, 'ab') as daysf:
+            closesf.write(closes.tobytes())
+            daysf.write(days.tobytes())
+        return len(days)
+
+    def prepend(self, stock: str, days, closes) -> int:
+        '''Adds the days before the first stored one (later or repeated days are ignored).
+        Both files are rewritten to temporary files and renamed over the stored ones
+
+        :return : number of added days'''
+        days, closes = self._sorted(days, closes)
+        stored_days, stored_closes = self.load(stock)
+        if len(stored_days):
+            older = days < stored_days[0]
+            days, closes = days[older], closes[older]
+        if not len(days):
+            return 0
+        days_file, closes_file = self._files(stock)
+        #Written closes first and renamed days last, the order _recover relies on
+        for path, values in ((closes_file, np.concatenate((closes, stored_closes))),
+                             (days_file, np.concatenate((days, stored_days)))):
+            with open(path + '.tmp', 'wb') as tmpf:
+                tmpf.write(values.tobytes())
+                tmpf.flush()
+                os.fsync(tmpf.fileno())
+        del stored_days, stored_closes
+        os.replace(closes_file + '.tmp', closes_file)
+        os.replace(days_file + '.tmp', days_file)
+        return len(days)
+
+    def _fetch(self, requests: dict) -> dict:
+        if not requests:
+            return {}
+        with span('price_history.fetch') as current:
+            fetched = self.provider.fetch(requests)
+            current.rows = len(requests)
+        return fetched
+
+    @timed('price_history.update', rows=lambda added: added)
+    def update(self, stocks, start=None, end=None) -> int:
+        '''Fetches, in one batch, the days missing from the history of each stock:
+        the ones after its last stored day and, if start is earlier, the ones before its first stored day.
+        Only closed days are fetched: end is capped at yesterday, as today's price is not a close yet
+
+        :param stocks: iterable of stocks (without suffix)
+        :param start: first date to fetch (default: config.py's price_history start_date)
+        :param end: last date to fetch (default and latest: yesterday)
+        :return : number of added days'''
+        logger = logging.getLogger(PriceHistory.update.__qualname__)
+        start = to_day(start or datetime.strptime(history_config['start_date'], '%Y-%m-%d'))
+        yesterday = to_day(datetime.now() - timedelta(days=1))
+        end = min(to_day(end), yesterday) if end else yesterday
+        appends, backfills = {}, {}
+        for stock in dict.fromkeys(stocks):
+            covered_from, last_day = self.covered_from(stock), self.last_day(stock)
+            first = start if last_day is None else last_day + 1
+            if first <= end:
+                appends[stock] = (first, end)
+            if covered_from is not None and start < covered_from:
+                backfills[stock] = (start, min(covered_from - 1, end))
+        if not appends and not backfills:
+            return 0
+        fetched, fetched_before = self._fetch(appends), self._fetch(backfills)
+        added = 0
+        for stock, (first, _) in appends.items():
+            if fetched.get(stock) is not None:
+                added += self.append(stock, *fetched[stock])
+                if first == start and self.last_day(stock) is not None:
+                    self._set_covered_from(stock, start)
+        for stock, (first, _) in backfills.items():
+            if fetched_before.get(stock) is not None:
+                added += self.prepend(stock, *fetched_before[stock])
+                self._set_covered_from(stock, first)
+        logger.info(f'{added} days added to the history of {len(appends.keys() | backfills.keys())} stocks')
+        return added
+
+    @timed('price_history.portfolio_series', rows=len)
+    def portfolio_series(self, transactions, from_date: datetime, to_date: datetime) -> list:
+        '''Daily value of a portfolio over a period, from its stock transactions and the stored closes.
+        The calendar is every day with a stored close of a held stock. Holdings and prices are built
+        as stocks x days matrices, each price carried forward to the days without a close.
+        daily_return leaves out the money put in or taken out that day (time weighted)
+
+        :param transactions: stock rows (broker, stock, date, quantity and total_price; Sell ones negative).
+                             Incomplete rows (see split_transactions) are left out
+        :param from_date: first day of the series
+        :param to_date: last day of the series
+        :return : list of dicts with date, value, invested, daily_return, cumulative_return and drawdown (%)'''
+        logger = logging.getLogger(PriceHistory.portfolio_series.__qualname__)
+        start, end = to_day(from_date), to_day(to_date)
+        transactions, incomplete = split_transactions(transactions)
+        if incomplete:
+            logger.warning(f'{len(incomplete)} stock rows without {"/".join(TRANSACTION_FIELDS)} left out')
+        rows = [(row['stock'], row['date'], row['quantity'], row['total_price']) for row in transactions]
+        if not rows:
+            return []
+        names, dates, quantities, totals = zip(*rows)
+        tx_days = np.array(dates, dtype='datetime64[us]').astype('datetime64[D]').astype(np.int64)
+        quantities = np.array(quantities, dtype=np.float64)
+        totals = np.array(totals, dtype=np.float64)
+        stocks, tx_stock = np.unique(np.array(names), return_inverse=True)
+        until_end = tx_days <= end
+        histories = [self.load(stock) for stock in stocks.tolist()]
+        calendar = np.unique(np.concatenate([days[np.searchsorted(days, start):np.searchsorted(days, end, side='right')]
+                                             for days, _ in histories]))
+        if not len(calendar):
+            logger.warning('No stored closes in the period, update the price history first')
+            return []
+
+        holdings = np.zeros((len(stocks), len(calendar) + 1))
+        prices = np.zeros((len(stocks), len(calendar)))
+        flows = np.zeros(len(calendar) + 1)
+        invested = np.zeros(len(calendar) + 1)
+        missing = []
+        #Transactions before the calendar count from its 1st day, the others from their own (or next) trading day.
+        #Transactions after the last trading day fall on the extra column, dropped below
+        positions = np.searchsorted(calendar, tx_days[until_end])
+        np.add.at(holdings, (tx_stock[until_end], positions), quantities[until_end])
+        np.add.at(invested, positions, totals[until_end])
+        in_period = tx_days[until_end] >= calendar[0]
+        np.add.at(flows, positions[in_period], totals[until_end][in_period])
+        for row_number, (stock, (days, closes)) in enumerate(zip(stocks.tolist(), histories)):
+            last_close = np.searchsorted(days, calendar, side='right') - 1
+            known = last_close >= 0
+            prices[row_number, known] = closes[last_close[known]]
+            if not known.all():
+                missing.append(stock)
+        if missing:
+            logger.warning(f'Stocks without closes at the start of the period, valued as 0: {missing}')
+
+        holdings = np.cumsum(holdings, axis=1)[:, :-1]
+        value = (holdings*prices).sum(axis=0)
+        invested = np.cumsum(invested)[:-1]
+        flows = flows[:-1]
+        previous = np.concatenate(([0.0], value[:-1]))
+        daily_return = np.zeros(len(calendar))
+        valued = previous > 0
+        daily_return[valued] = (value[valued] - flows[valued])/previous[valued] - 1
+        growth = np.cumprod(1 + daily_return)
+        drawdown = growth/np.maximum.accumulate(growth) - 1
+
+        return [{'date': from_day(day), 'value': round(day_value, 2), 'invested': round(day_invested, 2),
+                 'daily_return': round(day_return*100, 4), 'cumulative_return': round((day_growth - 1)*100, 4),
+                 'drawdown': round(day_drawdown*100, 4)}
+                for day, day_value, day_invested, day_return, day_growth, day_drawdown in
+                zip(calendar.tolist(), value.tolist(), invested.tolist(), daily_return.tolist(),
+                    growth.tolist(), drawdown.tolist())]
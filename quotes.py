@@ -0,0 +1,191 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import quotes as quotes_config
+from metrics import span, timed
+
+
+class YFinanceProvider:
+    '''Fetches last prices from Yahoo Finance through yfinance.
+    Each ticker is requested by a bounded pool of workers'''
+
+    def __init__(self, suffix: str = quotes_config['suffix'], max_workers: int = quotes_config['max_workers']) -> None:
+        self.suffix = suffix
+        self.max_workers = max_workers
+
+    def _fetch_one(self, stock: str) -> float:
+        '''Returns the last price of a single stock, None if not available'''
+        from yfinance import Ticker
+
+        logger = logging.getLogger(YFinanceProvider._fetch_one.__qualname__)
+        try:
+            return Ticker(stock + self.suffix).fast_info['last_price']
+        except Exception as e:
+            logger.warning(f'Could not fetch last price of "{stock}", reason: {str(e)}')
+            return None
+
+    def fetch(self, stocks: list) -> dict:
+        '''Fetches last prices of all received stocks
+
+        :param stocks: list of stocks (without suffix)
+        :return : dict stock -> last price (None if not available)'''
+        if not stocks:
+            return {}
+        workers = max(1, min(self.max_workers, len(stocks)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            prices = list(executor.map(self._fetch_one, stocks))
+        return dict(zip(stocks, prices))
+
+
+class StubProvider:
+    '''Local provider returning fixed prices. Used to run summaries offline'''
+
+    def __init__(self, prices: dict = None) -> None:
+        self.prices = dict(prices or {})
+        self.calls = 0
+
+    def fetch(self, stocks: list) -> dict:
+        '''Returns the configured price of each stock, None if unknown'''
+        self.calls += 1
+        return {stock: self.prices.get(stock) for stock in stocks}
+
+
+class QuoteStore:
+    '''Persists last prices on a local SQLite file, so they survive between runs.
+    It may be used from several threads (ex: requests of daemon.py)'''
+
+    def __init__(self, path: str = quotes_config['store_path']) -> None:
+        import sqlite3
+
+        self.path = path
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS quotes ('
+                                'stock TEXT PRIMARY KEY, price REAL NOT NULL, updated_at REAL NOT NULL)')
+        self.connection.commit()
+
+    def load(self, stocks: list) -> dict:
+        '''Returns the stored quotes of the received stocks
+
+        :param stocks: list of stocks (without suffix)
+        :return : dict stock -> (price, updated_at as epoch seconds)'''
+        stored = {}
+        with self._lock:
+            for start in range(0, len(stocks), 500):
+                chunk = stocks[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                cursor = self.connection.execute(f'SELECT stock, price, updated_at FROM quotes WHERE stock IN ({placeholders})', chunk)
+                for stock, price, updated_at in cursor:
+                    stored[stock] = (price, updated_at)
+        return stored
+
+    def save(self, prices: dict, updated_at: float = None) -> None:
+        '''Stores (or replaces) the received prices. None prices are ignored'''
+        if updated_at is None:
+            updated_at = time.time()
+        rows = [(stock, price, updated_at) for stock, price in prices.items() if price is not None]
+        with self._lock:
+            self.connection.executemany('INSERT OR REPLACE INTO quotes (stock, price, updated_at) VALUES (?, ?, ?)', rows)
+            self.connection.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.close()
+
+
+class QuoteService:
+    '''Keeps market prices in memory for a configurable time (ttl).
+    Repeated stocks are fetched only once, missing ones in a single batch.
+    If a store is given, it is read first and only prices older than max_age are refreshed.
+    In offline mode the provider is never called and old stored prices are flagged as stale'''
+
+    def __init__(self, provider=None, ttl: float = quotes_config['ttl'], store: QuoteStore = None,
+                 max_age: float = quotes_config['max_age'], offline: bool = False) -> None:
+        self.provider = provider if provider is not None else YFinanceProvider()
+        self.ttl = ttl
+        self.store = store
+        self.max_age = max_age
+        self.offline = offline
+        self.stale: set = set()
+        self._cache: dict = {}
+
+    def _is_fresh(self, stock: str, now: float) -> bool:
+        cached = self._cache.get(stock)
+        return cached is not None and now - cached[1] < self.ttl
+
+    @timed('quotes.prefetch', rows=len)
+    def prefetch(self, stocks) -> dict:
+        '''Makes sure every stock has a fresh price in cache.
+        Duplicated stocks are removed before asking the store/provider
+
+        :param stocks: iterable of stocks (without suffix)
+        :return : dict stock -> last price (None if not available)'''
+        logger = logging.getLogger(QuoteService.prefetch.__qualname__)
+        unique_stocks = list(dict.fromkeys(stocks))
+        now = time.monotonic()
+        missing = [stock for stock in unique_stocks if not self._is_fresh(stock, now)]
+        if missing:
+            prices = {}
+            stored = self.store.load(missing) if self.store is not None else {}
+            wall_now = time.time()
+            to_fetch = []
+            for stock in missing:
+                price, updated_at = stored.get(stock, (None, None))
+                if price is not None and wall_now - updated_at < self.max_age:
+                    prices[stock] = price
+                    self.stale.discard(stock)
+                else:
+                    to_fetch.append(stock)
+            if to_fetch and not self.offline:
+                start = time.perf_counter()
+                with span('quotes.fetch') as current:
+                    fetched = self.provider.fetch(to_fetch)
+                    current.rows = len(to_fetch)
+                logger.info(f'Fetched {len(to_fetch)} quotes in {time.perf_counter() - start:.2f} seconds')
+                if self.store is not None:
+                    self.store.save(fetched)
+            else:
+                fetched = {}
+            for stock in to_fetch:
+                if fetched.get(stock) is not None:
+                    prices[stock] = fetched[stock]
+                    self.stale.discard(stock)
+                elif stock in stored:
+                    logger.warning(f'Using stale stored price of "{stock}"')
+                    prices[stock] = stored[stock][0]
+                    self.stale.add(stock)
+                else:
+                    prices[stock] = None
+            now = time.monotonic()
+            for stock in missing:
+                self._cache[stock] = (prices[stock], now)
+        return {stock: self._cache[stock][0] for stock in unique_stocks}
+
+    def get(self, stock: str) -> float:
+        '''Returns the last price of a stock, fetching it if not cached'''
+        return self.prefetch([stock])[stock]
+
+    def is_stale(self, stock: str) -> bool:
+        '''True if the price of this stock came from an outdated stored quote'''
+        return stock in self.stale
+
+    def clear(self) -> None:
+        '''Forgets every cached price'''
+        self._cache.clear()
+        self.stale.clear()
+
+
+_quote_service = None
+_quote_service_lock = threading.Lock()
+
+
+def get_quote_service() -> QuoteService:
+    '''Returns the quote service shared by the whole process (and the threads of daemon.py).
+    It is created once, by the first call'''
+    global _quote_service
+    with _quote_service_lock:
+        if _quote_service is None:
+            _quote_service = QuoteService(store=QuoteStore())
+    return _quote_service
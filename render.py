@@ -0,0 +1,112 @@
+import calendar
+import io
+import json
+import logging
+import sys
+from functools import lru_cache
+
+from config import currency
+from create_table import Table
+
+
+#Words that make a column a currency value (a [value, percent] pair is also accepted)
+CURRENCY_WORDS: tuple = ('value', 'performance', 'dividend', 'jcp', 'rendimentos_de_clientes', 'fracoes_de_acoes', 'average')
+MONTHS: frozenset = frozenset(calendar.month_name)
+
+
+def column_kind(key: str) -> str:
+    '''Returns how a column is rendered: currency, percent, shares, label, month or text'''
+    lower = key.lower()
+    if any(word in lower for word in CURRENCY_WORDS):
+        return 'currency'
+    if 'weight' in lower:
+        return 'percent'
+    if 'quantity' in lower:
+        return 'shares'
+    if 'type' in lower:
+        return 'label'
+    if key in MONTHS:
+        return 'month'
+    return 'text'
+
+
+def _currency(value) -> str:
+    if type(value) == list:
+        return f'{value[0]} {currency[1]}  | {value[1]} %'
+    return f'{value} {currency[1]}'
+
+
+FORMATTERS: dict = {
+                    'currency': _currency,
+                    'percent': lambda value: f'{value} %',
+                    'shares': lambda value: f'{value} shares',
+                    'label': lambda value: value.capitalize().replace('_', ' '),
+                    'month': lambda value: f'{round(value, 2)} {currency[1]}',
+                    'text': lambda value: f'{value} '
+                }
+
+
+@lru_cache(maxsize=256)
+def compile_schema(keys: tuple) -> tuple:
+    '''Compiles the columns of a report once: (key, printed label, formatter) per column'''
+    return tuple((key, key.capitalize().replace('_', ' '), FORMATTERS[column_kind(key)]) for key in keys)
+
+
+def columns_of(rows: list) -> list:
+    '''Every column of the rows, in order of appearance'''
+    columns = {}
+    for row in rows:
+        columns.update(dict.fromkeys(row))
+    return list(columns)
+
+
+class TerminalSink:
+    '''Prints each row as "Label: value unit" lines. The whole report is written at once'''
+    extension = None
+
+    def __init__(self, stream=None) -> None:
+        self.stream = stream
+
+    def write(self, rows: list, filename: str = None) -> None:
+        lines = io.StringIO()
+        keys, schema = None, ()
+        for row in rows:
+            if tuple(row) != keys:
+                keys = tuple(row)
+                schema = compile_schema(keys)
+            lines.write('\n\n')
+            for key, label, formatter in schema:
+                lines.write(f'{label}: {formatter(row[key])}\n')
+        (self.stream or sys.stdout).write(lines.getvalue())
+
+
+class CsvSink:
+    '''Writes the report to a ";" separated file in one pass (appends if the file exists)'''
+    extension = 'csv'
+
+    def write(self, rows: list, filename: str = None) -> None:
+        Table.stream_csv(rows, filename, columns_of(rows))
+
+
+class JsonSink:
+    '''Writes the report as a JSON list of rows (dates as text), replacing the file'''
+    extension = 'json'
+
+    def write(self, rows: list, filename: str = None) -> None:
+        logger = logging.getLogger(JsonSink.write.__qualname__)
+        with open(filename, 'w', encoding='utf-8') as jsonf:
+            json.dump(rows, jsonf, default=str, ensure_ascii=False, indent=2)
+        logger.info(f'{len(rows)} rows written to {filename}')
+
+
+#Export targets of Statistics.export. New sinks need an extension (None if no file) and write(rows, filename)
+SINKS: dict = {
+                'print': TerminalSink(),
+                'csv': CsvSink(),
+                'json': JsonSink()
+            }
+
+
+def register_sink(name: str, sink) -> None:
+    '''Adds (or replaces) an export target'''
+    SINKS[name] = sink
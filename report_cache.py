@@ -0,0 +1,142 @@
+import logging
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from hashlib import blake2b
+
+from config import report_cache as cache_config
+
+
+class ReportCache:
+    '''Keeps results of report queries on a local SQLite file, so repeated reports
+    are served without querying the database. Entries are keyed by the query parameters
+    and the version of the collections it reads (see Database._cached), so a write
+    makes older entries unreachable. Beyond max_entries the least recently used are evicted.
+    The memory_entries most recently used are also kept in memory, which serves a long
+    running process (see daemon.py) without reading the file.
+    Hits do not write to the file: their use times are kept and written in one batch
+    (every touch_batch hits, before an eviction and on stats/flush/close)'''
+
+    def __init__(self, path: str = cache_config['path'], max_entries: int = cache_config['max_entries'],
+                 memory_entries: int = cache_config['memory_entries'], touch_batch: int = cache_config['touch_batch']) -> None:
+        import sqlite3
+
+        self.path = path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.touch_batch = touch_batch
+        #Pickled results, so each hit returns a copy the caller may change
+        self._recent: OrderedDict = OrderedDict()
+        #Use time of the entries served since the last flush, and the number of hits since then
+        self._touched: dict = {}
+        self._touches = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS reports ('
+                                'key BLOB PRIMARY KEY, value BLOB NOT NULL, used_at REAL NOT NULL)')
+        self.connection.commit()
+
+    @staticmethod
+    def key(*parts) -> bytes:
+        '''Builds an entry key from the query name, its parameters and the collection versions'''
+        return blake2b(repr(parts).encode('utf-8'), digest_size=16).digest()
+
+    def get(self, key: bytes) -> tuple:
+        '''Returns (True, result) if the key is cached, (False, None) otherwise'''
+        logger = logging.getLogger(ReportCache.get.__qualname__)
+        with self._lock:
+            value = self._recent.get(key)
+            if value is not None:
+                self._recent.move_to_end(key)
+                self.hits += 1
+                self._touch(key)
+                logger.debug('Report served from memory')
+                return True, pickle.loads(value)
+            found = self.connection.execute('SELECT value FROM reports WHERE key = ?', (key,)).fetchone()
+            if found is None:
+                self.misses += 1
+                return False, None
+            self.hits += 1
+            self._touch(key)
+            self._remember(key, found[0])
+        logger.debug('Report served from cache')
+        return True, pickle.loads(found[0])
+
+    def _touch(self, key: bytes) -> None:
+        '''Records the use of an entry, writing the pending ones every touch_batch uses'''
+        self._touched[key] = time.time()
+        self._touches += 1
+        if self._touches >= self.touch_batch:
+            self._write_touched()
+            self.connection.commit()
+
+    def _write_touched(self) -> None:
+        '''Writes the pending use times (without committing)'''
+        if self._touched:
+            self.connection.executemany('UPDATE reports SET used_at = ? WHERE key = ?',
+                                        [(used_at, key) for key, used_at in self._touched.items()])
+            self._touched.clear()
+        self._touches = 0
+
+    def flush(self) -> None:
+        '''Writes the pending use times'''
+        with self._lock:
+            self._write_touched()
+            self.connection.commit()
+
+    def _remember(self, key: bytes, value: bytes) -> None:
+        '''Keeps a pickled result in memory, evicting the least recently used beyond memory_entries (at most max_entries)'''
+        if self.memory_entries <= 0:
+            return
+        self._recent[key] = value
+        self._recent.move_to_end(key)
+        while len(self._recent) > min(self.memory_entries, self.max_entries):
+            self._recent.popitem(last=False)
+
+    def put(self, key: bytes, result) -> None:
+        '''Stores a result, evicting the least recently used entries beyond max_entries'''
+        value = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._remember(key, value)
+            self._touched.pop(key, None)
+            #Evictions must see the latest use times
+            self._write_touched()
+            self.connection.execute('INSERT OR REPLACE INTO reports (key, value, used_at) VALUES (?, ?, ?)',
+                                    (key, value, time.time()))
+            self.connection.execute('DELETE FROM reports WHERE key NOT IN '
+                                    '(SELECT key FROM reports ORDER BY used_at DESC LIMIT ?)', (self.max_entries,))
+            self.connection.commit()
+
+    def stats(self) -> dict:
+        '''Hits and misses of this process and number of stored entries'''
+        with self._lock:
+            self._write_touched()
+            self.connection.commit()
+            entries = self.connection.execute('SELECT COUNT(*) FROM reports').fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries, 'in_memory': len(self._recent)}
+
+    def clear(self) -> None:
+        '''Forgets every stored result'''
+        with self._lock:
+            self._recent.clear()
+            self._touched.clear()
+            self.connection.execute('DELETE FROM reports')
+            self.connection.commit()
+
+    def close(self) -> None:
+        self.flush()
+        self.connection.close()
+
+
+_report_cache = None
+
+
+def get_report_cache() -> ReportCache:
+    '''Returns the report cache shared by the whole process (None if disabled at config.py)'''
+    global _report_cache
+    if _report_cache is None and cache_config['enabled']:
+        _report_cache = ReportCache()
+    return _report_cache
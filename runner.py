@@ -0,0 +1,162 @@
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from time import perf_counter
+
+
+#Report operations that can run headless, and the products they accept
+REPORT_OPERATIONS: tuple = ('get_report', 'get_statistics')
+PRODUCT_TYPES: tuple = ('stocks', 'yields')
+
+
+def load_jobs(path: str) -> list:
+    '''Reads a JSON job file: a list of jobs, or {"jobs": [...]}.
+    Each job is a dict with operation, product_type, broker and, when needed,
+    portfolio, threshold_date, from_date and to_date (format %Y-%m-%d)'''
+    with open(path, encoding='utf-8') as jobf:
+        content = json.load(jobf)
+    return content['jobs'] if isinstance(content, dict) else content
+
+
+def expand_jobs(brokers: list, portfolios: list, product_types: list = PRODUCT_TYPES,
+                operations: list = REPORT_OPERATIONS, threshold_date: str = None,
+                from_date: str = None, to_date: str = None) -> list:
+    '''Builds one job per broker x product x operation (x portfolio for get_statistics)'''
+    jobs = []
+    for broker in brokers:
+        for product_type in product_types:
+            for operation in operations:
+                job = {'operation': operation, 'product_type': product_type, 'broker': broker,
+                       'threshold_date': threshold_date, 'from_date': from_date, 'to_date': to_date}
+                if operation == 'get_statistics':
+                    jobs.extend(dict(job, portfolio=portfolio) for portfolio in portfolios)
+                else:
+                    jobs.append(job)
+    return jobs
+
+
+def _queries(job: dict) -> list:
+    '''Database queries needed by a job, as hashable (method name, keyword arguments) keys'''
+    broker = job['broker']
+    threshold_date = job.get('threshold_date') or None
+    period = (('from_date', job.get('from_date') or None), ('to_date', job.get('to_date') or None), ('broker', broker))
+    if job['operation'] not in REPORT_OPERATIONS or job['product_type'] not in PRODUCT_TYPES:
+        raise ValueError(f'Invalid job {job}')
+    if job['operation'] == 'get_report' and job['product_type'] == 'stocks':
+        return [('genreport_stocks', (('threshold_date', threshold_date), ('broker', broker))),
+                ('genreport_sold_stocks', period)]
+    if job['operation'] == 'get_report':
+        return [('genreport_yield', period)]
+    if job['product_type'] == 'stocks':
+        return [('genreport_stocks', (('threshold_date', threshold_date), ('broker', broker)))]
+    return [('genreport_yield_summary', period)]
+
+
+def fetch_reports(jobs: list, mongo_db, max_workers: int = 8) -> dict:
+    '''Runs each distinct query of the jobs once, in parallel threads
+
+    :return : dict query key -> query result'''
+    logger = logging.getLogger(fetch_reports.__qualname__)
+    keys = list(dict.fromkeys(key for job in jobs for key in _queries(job)))
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(keys)))) as executor:
+        results = list(executor.map(lambda key: getattr(mongo_db, key[0])(**dict(key[1])), keys))
+    logger.info(f'{len(keys)} queries for {len(jobs)} jobs in {perf_counter() - start:.2f} seconds')
+    return dict(zip(keys, results))
+
+
+def _run_job(job: dict, reports: list, prices: dict, stale: list, output_dir: str) -> tuple:
+    '''Runs one report job without prompts (in a worker process)
+
+    :return : (list of written files, metrics summary of the job)'''
+    from metrics import metrics
+    from quotes import QuoteService, StubProvider
+
+    #A worker process runs many jobs: only the spans of this one are returned
+    metrics.clear()
+    #Prices were fetched once by the parent process: the worker never goes to the network
+    quote_service = QuoteService(StubProvider(prices))
+    quote_service.prefetch(prices)
+    quote_service.stale = set(stale)
+    written = compute_job(job, reports, quote_service, output_dir)
+    return written, metrics.summary()
+
+
+def compute_job(job: dict, reports: list, quote_service, output_dir: str = None, results: dict = None) -> list:
+    '''Computes one report job from its query results (see _queries) and writes
+    its outputs to output_dir, as "export_to" of the job (default: csv).
+    A get_statistics job without portfolio reports every portfolio
+
+    :param results: receives the rows of each output when export_to is "api"
+    :return : list of written files'''
+    from statistics import Statistics
+
+    prefix = '_'.join(str(part).replace(' ', '_') for part in
+                      (job['operation'], job['product_type'], job['broker'], job.get('portfolio')) if part) + '_'
+    options = {'quote_service': quote_service, 'export_to': job.get('export_to', 'csv'),
+               'output_dir': output_dir, 'output_prefix': prefix, 'results': results}
+    written = []
+    if job['operation'] == 'get_report' and job['product_type'] == 'stocks':
+        statistics = Statistics(reports[0], **options)
+        statistics.getreport_stocks(job['broker'])
+        written += statistics.written_files
+        statistics = Statistics(reports[1], **options)
+        statistics.getreport_sell(job['broker'])
+    elif job['operation'] == 'get_report':
+        statistics = Statistics(reports[0], **options)
+        statistics.getreport_yield(job['broker'])
+    elif job['product_type'] == 'stocks':
+        statistics = Statistics(reports[0], **options)
+        if job.get('portfolio'):
+            statistics.generate_stocks_summary(job['portfolio'])
+        else:
+            statistics.generate_stocks_summaries()
+    else:
+        statistics = Statistics(reports[0], **options)
+        if job.get('portfolio'):
+            statistics.generate_yields_summary(job['portfolio'])
+        else:
+            statistics.generate_yields_summaries()
+    return written + statistics.written_files
+
+
+def run_jobs(jobs: list, output_dir: str, mongo_db, quote_service, max_workers: int = None) -> list:
+    '''Runs report jobs without prompts.
+    Each distinct query runs once (shared by every job of the same broker and period),
+    market prices of every stock are fetched in one batch, then jobs are computed and
+    written to output_dir by a pool of worker processes. Metrics recorded by the workers
+    are added to those of this process
+
+    :param jobs: list of jobs (see load_jobs/expand_jobs)
+    :param output_dir: directory where report files are written
+    :param mongo_db: Database instance
+    :param quote_service: QuoteService used for the single prices fetch
+    :param max_workers: number of worker processes (default: number of cores)
+    :return : list of (job, written files or error message)'''
+    from metrics import metrics
+
+    logger = logging.getLogger(run_jobs.__qualname__)
+    os.makedirs(output_dir, exist_ok=True)
+    reports: dict = fetch_reports(jobs, mongo_db)
+
+    stocks = [row['stock'] for job in jobs if job['operation'] == 'get_statistics' and job['product_type'] == 'stocks'
+              for row in reports[_queries(job)[0]]]
+    prices: dict = quote_service.prefetch(stocks) if stocks else {}
+    stale = [stock for stock in prices if quote_service.is_stale(stock)]
+
+    start = perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_run_job, job, [reports[key] for key in _queries(job)], prices, stale, output_dir)
+                   for job in jobs]
+        for job, future in zip(jobs, futures):
+            try:
+                written, job_metrics = future.result()
+                metrics.merge(job_metrics)
+                results.append((job, written))
+            except Exception as e:
+                logger.error(f'Job {job} failed: {str(e)}')
+                results.append((job, f'failed: {str(e)}'))
+    logger.info(f'{len(jobs)} jobs computed in {perf_counter() - start:.2f} seconds')
+    return results
@@ -0,0 +1,462 @@
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from time import perf_counter
+
+from config import storage as storage_config
+from metrics import timed
+from storage import Storage
+
+
+class _SumInOrder:
+    '''SUM_IN_ORDER(_id, value): adds values one by one in _id order (the order genreport_yield returns them),
+    as the per row loops of Statistics do. SUM adds them in the order the grouping reads them, and float
+    totals depend on that order'''
+
+    def __init__(self) -> None:
+        self.values: list = []
+
+    def step(self, order: int, value: float) -> None:
+        if value is not None:
+            self.values.append((order, value))
+
+    def finalize(self) -> float:
+        total = 0.0
+        for _, value in sorted(self.values):
+            total += value
+        return total
+
+
+class SQLiteDatabase(Storage):
+    '''Embedded storage backend on a local SQLite file, with the interface of database.Database.
+    Reports are aggregated by SQL on indexed tables, without network round trips.
+    Positions are kept up to date on each write; month-end checkpoints are not needed'''
+
+    #Columns of each table, in the order they are stored. Dates are stored as ISO text
+    COLUMNS: dict = {
+                    'stocks': ['broker', 'transaction_type', 'stock', 'date', 'quantity', 'price', 'total_price', 'performance'],
+                    'yields': ['broker', 'yield_type', 'stock', 'date', 'value']
+                    }
+
+    SCHEMA: list = [
+                    'CREATE TABLE IF NOT EXISTS stocks (_id INTEGER PRIMARY KEY, broker TEXT NOT NULL, '
+                    'transaction_type TEXT NOT NULL, stock TEXT NOT NULL, date TEXT NOT NULL, quantity INTEGER NOT NULL, '
+                    'price REAL, total_price REAL NOT NULL, performance REAL)',
+                    'CREATE TABLE IF NOT EXISTS yields (_id INTEGER PRIMARY KEY, broker TEXT NOT NULL, '
+                    'yield_type TEXT NOT NULL, stock TEXT, date TEXT NOT NULL, value REAL NOT NULL)',
+                    'CREATE TABLE IF NOT EXISTS positions (broker TEXT NOT NULL, stock TEXT NOT NULL, '
+                    'quantity INTEGER NOT NULL, total REAL NOT NULL, PRIMARY KEY (broker, stock))'
+                    ]
+
+    #Indexes backing the report queries (equality fields first, then date range), as in Database.INDEXES
+    INDEXES: dict = {
+                    'stocks': {
+                                'broker_1_date_1': 'stocks (broker, date)',
+                                'broker_1_transaction_type_1_date_1': 'stocks (broker, transaction_type, date)'
+                            },
+                    'yields': {
+                                'broker_1_date_1': 'yields (broker, date)'
+                            },
+                    'positions': {}
+                    }
+
+    _AVERAGE_PRICE: str = 'CASE WHEN quantity = 0 THEN 0.0 ELSE total / quantity END'
+
+    def __init__(self, path: str = None):
+        '''
+        :param path: SQLite file (default: config.py's storage sqlite_path)'''
+        self.path = path or storage_config['sqlite_path']
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        #SQLite ROUND differs from Python's round on half cases; monthly sums must match Statistics
+        self.connection.create_function('PY_ROUND', 2, round, deterministic=True)
+        self.connection.create_aggregate('SUM_IN_ORDER', 2, _SumInOrder)
+        #Report queries may run from several threads (see runner.fetch_reports)
+        self._lock = threading.RLock()
+        with self._lock, self.connection:
+            for statement in SQLiteDatabase.SCHEMA:
+                self.connection.execute(statement)
+        for collection in ('stocks', 'yields'):
+            self.ensure_indexes(collection)
+
+    @staticmethod
+    def _to_text(value):
+        '''Dates are stored as ISO text, so they sort and compare as dates'''
+        if isinstance(value, datetime):
+            return value.isoformat(sep=' ')
+        return value
+
+    @staticmethod
+    def _to_row(collection: str, data: dict) -> tuple:
+        '''Values of a document in table column order. Empty fields ('' from CSV) are stored as NULL'''
+        return tuple(None if data.get(column) == '' else SQLiteDatabase._to_text(data.get(column))
+                     for column in SQLiteDatabase.COLUMNS[collection])
+
+    @staticmethod
+    def _to_document(columns: list, row: tuple) -> dict:
+        '''Builds a document as Database returns it: dates as datetimes and NULL fields left out'''
+        document = {}
+        for column, value in zip(columns, row):
+            if value is None:
+                continue
+            document[column] = datetime.fromisoformat(value) if column == 'date' else value
+        return document
+
+    def _query(self, sql: str, parameters: tuple = ()) -> list:
+        with self._lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def _get_collection(self, collection: str) -> str:
+        '''Returns the table name of yields or stocks'''
+        if collection in SQLiteDatabase.COLUMNS:
+            return collection
+        raise KeyError (f'{collection} not Found.')
+
+    def _insert(self, collection: str, rows: list) -> int:
+        columns = SQLiteDatabase.COLUMNS[collection]
+        self.connection.executemany(f'INSERT INTO {collection} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})',
+                                    [self._to_row(collection, row) for row in rows])
+        return len(rows)
+
+    def _update_positions(self, rows: list) -> None:
+        '''Adds stock transactions to their (broker, stock) positions with one upsert per position'''
+        changes: dict = {}
+        for row in rows:
+            change = changes.setdefault((row['broker'], row['stock']), [0, 0.0])
+            change[0] += int(row['quantity'])
+            change[1] += float(row['total_price'])
+        self.connection.executemany('INSERT INTO positions (broker, stock, quantity, total) VALUES (?, ?, ?, ?) '
+                                    'ON CONFLICT (broker, stock) DO UPDATE SET quantity = quantity + excluded.quantity, '
+                                    'total = total + excluded.total',
+                                    [(broker, stock, quantity, total) for (broker, stock), (quantity, total) in changes.items()])
+
+    @timed('database.insert_data', rows=lambda result: 1)
+    def insert_data ( self, data: dict) -> None:
+        '''Inserts data (one row) to yields or stocks table.
+        If yield_type in data.keys(), redirects to yields table.
+        If transaction_type as "Sell" or "Buy", redirects it to stocks table
+
+        :param data: the dict to be inserted into the database
+        :return: None'''
+        logger = logging.getLogger(SQLiteDatabase.insert_data.__qualname__)
+        try:
+            with self._lock, self.connection:
+                if 'yield_type' in data.keys():
+                    self._insert('yields', [data])
+                elif 'Sell' in data['transaction_type'] or 'Buy' in data['transaction_type']:
+                    self._insert('stocks', [data])
+                    self._update_positions([data])
+            logger.info(f'{data} data has been successfully inserted')
+        except Exception as e:
+            raise Exception('Could not insert data: ', str(e))
+
+    @timed('database.bulk_insert', rows=int)
+    def bulk_insert(self, collection: str, rows: list) -> int:
+        '''Inserts many rows to yields or stocks table in one transaction.
+        For stocks, positions are updated in the same transaction
+
+        :param collection: refers to yields or stocks
+        :param rows: list of dicts to be inserted
+        :return : number of inserted rows'''
+        logger = logging.getLogger(SQLiteDatabase.bulk_insert.__qualname__)
+        if not rows:
+            return 0
+        try:
+            with self._lock, self.connection:
+                inserted = self._insert(self._get_collection(collection), rows)
+                if collection == 'stocks':
+                    self._update_positions(rows)
+        except Exception as e:
+            raise Exception('Could not insert data: ', str(e))
+        logger.info(f'{inserted} rows inserted into {collection}')
+        return inserted
+
+    def drop_collection(self, collection: str) -> bool:
+        '''Removes every row of yields or stocks table (the table and its indexes are kept)
+
+        :param collection: refers to yields or stocks
+        :return : bool'''
+        logger = logging.getLogger(SQLiteDatabase.drop_collection.__qualname__)
+        with self._lock, self.connection:
+            deleted = self.connection.execute(f'DELETE FROM {self._get_collection(collection)}').rowcount
+            if collection == 'stocks':
+                self.connection.execute('DELETE FROM positions')
+        logger.info(f'{deleted} rows removed from {collection}')
+        return bool(deleted)
+
+    @timed('database.bulk_load', rows=int)
+    def bulk_load(self, collection: str, batches, allow_empty: bool = False) -> int:
+        '''Replaces every row of a table by the batches, in a single transaction,
+        so reports never read an empty or half-filled table.
+        A load without rows (ex: an empty or unreadable file) is refused unless allow_empty
+
+        :param collection: refers to yields or stocks
+        :param batches: iterable of lists of dicts (ex: Table.iter_csv)
+        :param allow_empty: if True, a load without rows empties the table
+        :return : number of inserted rows'''
+        logger = logging.getLogger(SQLiteDatabase.bulk_load.__qualname__)
+        table = self._get_collection(collection)
+        inserted = 0
+        start = perf_counter()
+        try:
+            with self._lock, self.connection:
+                self.connection.execute(f'DELETE FROM {table}')
+                for batch in batches:
+                    inserted += self._insert(table, batch)
+                if not inserted and not allow_empty:
+                    raise ValueError('no rows to load')
+                if collection == 'stocks':
+                    self._rebuild_positions()
+        except Exception as e:
+            raise Exception('Could not load data, live table kept untouched: ', str(e))
+        elapsed = perf_counter() - start
+        logger.info(f'{inserted} rows loaded into {table} in {elapsed:.2f} seconds '
+                    f'({inserted/elapsed if elapsed else 0:.0f} rows/sec)')
+        return inserted
+
+    @timed('database.sync', rows=lambda summary: sum(summary.values()))
+    def sync(self, collection: str, batches, dry_run: bool = False) -> dict:
+        '''Makes a table match the rows of a file touching only what changed
+        (see Database.sync), in a single transaction
+
+        :param collection: refers to yields or stocks
+        :param batches: iterable of lists of dicts (ex: Table.iter_csv)
+        :param dry_run: if True, nothing is written
+        :return : dict with the number of inserted, updated, deleted and unchanged records'''
+        logger = logging.getLogger(SQLiteDatabase.sync.__qualname__)
+        table = self._get_collection(collection)
+        columns = SQLiteDatabase.COLUMNS[collection]
+        start = perf_counter()
+        stored = ((row[0], self._to_document(columns, row[1:]))
+                  for row in self._query(f'SELECT _id, {", ".join(columns)} FROM {table} ORDER BY _id'))
+        changes: dict = self._sync_changes(collection, stored, batches)
+        summary: dict = changes['summary']
+        if dry_run or not (changes['inserts'] or changes['updates'] or changes['deletes']):
+            logger.info(f'Sync of {collection} {"(dry run) " if dry_run else ""}in {perf_counter() - start:.2f} seconds: {summary}')
+            return summary
+        try:
+            with self._lock, self.connection:
+                self._insert(table, changes['inserts'])
+                self.connection.executemany(f'UPDATE {table} SET {", ".join(column + " = ?" for column in columns)} WHERE _id = ?',
+                                            [self._to_row(collection, row) + (_id,) for _id, row in changes['updates']])
+                self.connection.executemany(f'DELETE FROM {table} WHERE _id = ?', [(_id,) for _id in changes['deletes']])
+                if collection == 'stocks':
+                    self._rebuild_positions()
+        except Exception as e:
+            raise Exception('Could not sync data: ', str(e))
+        logger.info(f'Sync of {collection} in {perf_counter() - start:.2f} seconds: {summary}')
+        return summary
+
+    def ensure_indexes(self, collection: str, target=None) -> list:
+        '''Creates the indexes declared at INDEXES for a table (idempotent)
+
+        :param collection: refers to yields or stocks
+        :return : list of index names'''
+        logger = logging.getLogger(SQLiteDatabase.ensure_indexes.__qualname__)
+        indexes: dict = SQLiteDatabase.INDEXES[collection]
+        with self._lock, self.connection:
+            for name, definition in indexes.items():
+                self.connection.execute(f'CREATE INDEX IF NOT EXISTS {collection}_{name} ON {definition}')
+        logger.debug(f'Indexes ensured on {collection}: {list(indexes)}')
+        return list(indexes)
+
+    def explain_reports(self, collection: str, broker: str, threshold_date: datetime = None,
+                        from_date: datetime = None, to_date: datetime = None) -> list:
+        '''Runs each report query of a table with EXPLAIN QUERY PLAN and returns,
+        for each one, returned rows, execution time and plan steps (as Database.explain_reports)
+
+        :param collection: refers to yields or stocks
+        :param broker: broker used on the queries
+        :return : list of dicts, one per report query'''
+        now = datetime.now()
+        threshold_date = threshold_date or now
+        from_date = from_date or datetime(now.year, 1, 1)
+        to_date = to_date or now
+        if collection == 'stocks':
+            queries = {
+                        'genreport_stocks': self._stocks_report_query(threshold_date, broker),
+                        'genreport_sold_stocks': self._sold_stocks_query(from_date, to_date, broker)
+                        }
+        elif collection == 'yields':
+            queries = {'genreport_yield': self._yield_query(from_date, to_date, broker)}
+        else:
+            raise KeyError (f'{collection} not Found.')
+
+        results = []
+        for query, (sql, parameters) in queries.items():
+            stages = [row[-1] for row in self._query(f'EXPLAIN QUERY PLAN {sql}', parameters)]
+            start = perf_counter()
+            returned = len(self._query(sql, parameters))
+            results.append({
+                            'query': query,
+                            'docs_examined': None,
+                            'keys_examined': None,
+                            'returned': returned,
+                            'execution_time_ms': round((perf_counter() - start)*1000, 3),
+                            'index_used': any('USING INDEX' in stage or 'USING COVERING INDEX' in stage for stage in stages),
+                            'stages': stages
+                            })
+        return results
+
+    def _rebuild_positions(self) -> None:
+        self.connection.execute('DELETE FROM positions')
+        self.connection.execute('INSERT INTO positions (broker, stock, quantity, total) '
+                                'SELECT broker, stock, SUM(quantity), SUM(total_price) FROM stocks GROUP BY broker, stock')
+
+    def rebuild_positions(self) -> None:
+        '''Recomputes the positions table from the whole stocks history'''
+        logger = logging.getLogger(SQLiteDatabase.rebuild_positions.__qualname__)
+        with self._lock, self.connection:
+            self._rebuild_positions()
+        logger.info(f'{self._query("SELECT COUNT(*) FROM positions")[0][0]} positions rebuilt')
+
+    def _future_moves(self, brokers: list, stock: str = None) -> dict:
+        '''Totals of the transactions dated after today (positions include them, current reports do not)
+
+        :return : dict (broker, stock) -> (quantity, total)'''
+        sql = (f'SELECT broker, stock, SUM(quantity), SUM(total_price) FROM stocks '
+               f'WHERE broker IN ({", ".join("?" * len(brokers))}) AND date > ?')
+        parameters = tuple(brokers) + (self._to_text(self._today()),)
+        if stock is not None:
+            sql += ' AND stock = ?'
+            parameters += (stock,)
+        return {(broker, stock): (quantity, total) for broker, stock, quantity, total in
+                self._query(sql + ' GROUP BY broker, stock', parameters)}
+
+    def get_positions(self, brokers: list) -> list:
+        '''Returns the current positions (transactions up to today) of every stock at these brokers'''
+        brokers = list(brokers)
+        rows = self._query(f'SELECT broker, stock, quantity, total, {SQLiteDatabase._AVERAGE_PRICE} FROM positions '
+                           f'WHERE broker IN ({", ".join("?" * len(brokers))})', tuple(brokers))
+        return self._remove_moves([dict(zip(('broker', 'stock', 'quantity', 'total', 'average_price'), row)) for row in rows],
+                                  self._future_moves(brokers))
+
+    def get_position(self, broker: str, stock: str) -> dict:
+        '''Returns the current position (transactions up to today) of a stock at a broker
+
+        :return : dict with stock, total, quantity and average_price, None if never bought'''
+        rows = self._query(f'SELECT broker, stock, quantity, total, {SQLiteDatabase._AVERAGE_PRICE} FROM positions '
+                           'WHERE broker = ? AND stock = ?', (broker, stock))
+        if not rows:
+            return None
+        return self._remove_moves([dict(zip(('broker', 'stock', 'quantity', 'total', 'average_price'), rows[0]))],
+                                  self._future_moves([broker], stock))[0]
+
+    def build_checkpoints(self, broker: str = None) -> int:
+        '''Not needed by this backend: past threshold date reports aggregate on the (broker, date) index
+
+        :return : number of stored checkpoints (always 0)'''
+        logger = logging.getLogger(SQLiteDatabase.build_checkpoints.__qualname__)
+        logger.info('The sqlite backend does not use position checkpoints')
+        return 0
+
+    @staticmethod
+    def _stocks_report_query(threshold_date: datetime, broker: str) -> tuple:
+        '''SQL and parameters used by genreport_stocks'''
+        return ('SELECT stock, SUM(total_price), SUM(quantity) FROM stocks WHERE broker = ? AND date <= ? GROUP BY stock',
+                (broker, SQLiteDatabase._to_text(threshold_date)))
+
+    @staticmethod
+    def _sold_stocks_query(from_date: datetime, to_date: datetime, broker: str) -> tuple:
+        '''SQL and parameters used by genreport_sold_stocks'''
+        return (f'SELECT _id, {", ".join(SQLiteDatabase.COLUMNS["stocks"])} FROM stocks '
+                "WHERE broker = ? AND transaction_type = 'Sell' AND date > ? AND date < ? ORDER BY _id",
+                (broker, SQLiteDatabase._to_text(from_date), SQLiteDatabase._to_text(to_date)))
+
+    @staticmethod
+    def _yield_query(from_date: datetime, to_date: datetime, broker: str) -> tuple:
+        '''SQL and parameters used by genreport_yield'''
+        return (f'SELECT _id, {", ".join(SQLiteDatabase.COLUMNS["yields"])} FROM yields '
+                'WHERE broker = ? AND date > ? AND date < ? ORDER BY _id',
+                (broker, SQLiteDatabase._to_text(from_date), SQLiteDatabase._to_text(to_date)))
+
+    @timed('database.genreport_stocks', rows=len)
+    def genreport_stocks (self, threshold_date: str =None, broker: str ='Rico') -> list:
+        '''Query stocks matching transaction date before a threshold date
+            and the broker where th stocks were bought
+
+        :param threshold_date :  Will query stocks bought/sold beofre this date (current positions if empty)
+        :param broker : Stocks bought/sold matching this broker field
+        :return : list of dicts containing the result of this query'''
+        if not threshold_date:
+            rows = [(row['stock'], row['total'], row['quantity']) for row in self.get_positions([broker])]
+        else:
+            rows = self._query(*self._stocks_report_query(datetime.strptime(threshold_date, '%Y-%m-%d'), broker))
+        return [{'stock': stock, 'total': float(total), 'quantity': int(quantity)} for stock, total, quantity in rows]
+
+    @timed('database.genreport_sold_stocks', rows=len)
+    def genreport_sold_stocks(self, from_date: str = None, to_date: str = None, broker: str='Rico') -> list:
+        '''Query Sold Stocks from/to specific period of time, matching a broker
+
+        :param from_date : Start date of the time period
+        :param to_date: End date fo the time period
+        :broker : Stocks sold matching this broker field
+        :return : list of dict containing the result of this query'''
+        from_date, to_date = self._parse_period(from_date, to_date)
+        columns = ['_id'] + SQLiteDatabase.COLUMNS['stocks']
+        return [self._to_document(columns, row) for row in self._query(*self._sold_stocks_query(from_date, to_date, broker))]
+
+    @timed('database.genreport_yield', rows=len)
+    def genreport_yield(self, from_date: str = None, to_date: str = None, broker: str =None) -> list:
+        '''Query yields received in a period of time matching a broker
+
+        :param from_date : Start date of the time period
+        :param to_date: End date fo the time period
+        :broker : Stocks sold matching this broker field
+        :return : list of dict containing the result of this query'''
+        from_date, to_date = self._parse_period(from_date, to_date)
+        columns = ['_id'] + SQLiteDatabase.COLUMNS['yields']
+        return [self._to_document(columns, row) for row in self._query(*self._yield_query(from_date, to_date, broker))]
+
+    @timed('database.genreport_yield_summary', rows=lambda summary: len(summary['monthly']) + len(summary['per_stock']))
+    def genreport_yield_summary(self, from_date: str = None, to_date: str = None, broker: str =None) -> dict:
+        '''Aggregates yields received in a period of time matching a broker with SQL
+        (same result as Database.genreport_yield_summary)
+
+        :param from_date : Start date of the time period
+        :param to_date: End date fo the time period
+        :broker : Yields matching this broker field
+        :return : dict with monthly and per_stock (lists of dict) and total (float)'''
+        from_date, to_date = self._parse_period(from_date, to_date)
+        where = 'WHERE broker = ? AND date > ? AND date < ?'
+        parameters = (broker, self._to_text(from_date), self._to_text(to_date))
+        with self._lock:
+            monthly = self.connection.execute('SELECT stock, CAST(strftime(\'%m\', date) AS INTEGER) AS month, '
+                                              f'SUM_IN_ORDER(_id, PY_ROUND(value, 2)) FROM yields {where} '
+                                              'GROUP BY stock, month ORDER BY MIN(_id)', parameters).fetchall()
+            per_stock = self.connection.execute(f'SELECT stock, yield_type, SUM_IN_ORDER(_id, value) FROM yields {where} '
+                                                'GROUP BY stock, yield_type ORDER BY MIN(_id)', parameters).fetchall()
+            total = self.connection.execute(f'SELECT SUM_IN_ORDER(_id, value) FROM yields {where}', parameters).fetchone()[0]
+        return {
+                'monthly': [{'stock': stock, 'month': month, 'value': float(value)} for stock, month, value in monthly],
+                'per_stock': [{'stock': stock, 'yield_type': yield_type, 'value': float(value)} for stock, yield_type, value in per_stock],
+                'total': float(total)
+                }
+
+    def find_all(self, collection, verbose: bool = False):
+        '''returns all rows from a table
+
+            :param collection: the name of the table, can be either stocks or yields
+            :param verbose: if True, prints every row'''
+        columns = ['_id'] + SQLiteDatabase.COLUMNS[self._get_collection(collection)]
+        all_rows = [self._to_document(columns, row) for row in self._query(f'SELECT {", ".join(columns)} FROM {collection} ORDER BY _id')]
+        if verbose:
+            print(all_rows)
+        return all_rows
+
+    def iter_collection(self, collection: str, fields: list = None, batch_size: int = 5000):
+        '''Iterates over all rows of a table, fetching batch_size rows at a time
+
+        :param collection: the name of the table, can be either stocks or yields
+        :param fields: if given, only these fields are read
+        :param batch_size: number of rows per fetch'''
+        columns = [column for column in SQLiteDatabase.COLUMNS[self._get_collection(collection)] if not fields or column in fields]
+        with self._lock:
+            cursor = self.connection.execute(f'SELECT {", ".join(columns)} FROM {collection} ORDER BY _id')
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            for row in rows:
+                yield self._to_document(columns, row)
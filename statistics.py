@@ -1,79 +1,291 @@
 import typing
 import logging
 
-from yfinance import Ticker
+import pandas as pd
 
-from database import Database
-from create_table import Table
 from config import portfolios, currency
+from metrics import prompt, timed
+from quotes import get_quote_service
 
 
 
+def portfolio_index() -> tuple:
+    '''Reverse index of config.py portfolios, built once per process
+
+    :return : (dict stock -> set of portfolios with this stock, set of portfolios with every stock ('*'))'''
+    global _portfolio_index
+    if _portfolio_index is None:
+        stock_portfolios: dict = {}
+        all_stocks_portfolios: set = set()
+        for portfolio, stocks in portfolios.items():
+            for stock in stocks:
+                if stock == '*':
+                    all_stocks_portfolios.add(portfolio)
+                else:
+                    stock_portfolios.setdefault(stock, set()).add(portfolio)
+        _portfolio_index = (stock_portfolios, all_stocks_portfolios)
+    return _portfolio_index
+
+
+_portfolio_index = None
+
+
 class Statistics:
 
-    def __init__(self, data):
+    #Yield types always present at the per stock summary
+    YIELD_TYPES: list = ['dividend', 'jcp', 'rendimentos_de_clientes', 'fracoes_de_acoes']
+
+    def __init__(self, data, quote_service=None, export_to: str = None, output_dir: str = None, output_prefix: str = '',
+                 results: dict = None):
+        '''
+        :param data: rows of a report, or (yields only) the aggregated dict from Database.genreport_yield_summary
+        :param quote_service: source of market prices (default: the process-wide QuoteService)
+        :param export_to: if given, used for every export instead of asking the user (headless mode)
+        :param output_dir: if given, csv files are written there with generated names instead of asking the user
+        :param output_prefix: prefix of the generated file names
+        :param results: receives the rows of each report exported to "api" (a new dict if not given)'''
         self.data =  data
         self.total_asset = 0
         self.current_total_asset = 0
+        self.quotes = quote_service if quote_service is not None else get_quote_service()
+        self.export_to = export_to
+        self.output_dir = output_dir
+        self.output_prefix = output_prefix
+        self.written_files: list = []
+        self.results: dict = results if results is not None else {}
+        self._frame = None
+
+    def _export_target(self, text: str) -> str:
+        '''Returns the configured export target, or asks the user for it'''
+        if self.export_to:
+            return self.export_to
+        return prompt(text)
+
+    def _output_filename(self, name: str, extension: str = 'csv') -> str:
+        '''Returns the file name of an export, asking the user unless output_dir is set.
+        In headless mode a file is overwritten the first time it is written by this instance'''
+        import os
+
+        if not self.output_dir:
+            return prompt(f'{extension.upper()} Filename: ')
+        filename = os.path.join(self.output_dir, f'{self.output_prefix}{name}.{extension}')
+        if filename not in self.written_files:
+            if os.path.exists(filename):
+                os.remove(filename)
+            self.written_files.append(filename)
+        return filename
+
+    @property
+    def frame(self) -> pd.DataFrame:
+        '''self.data as a columnar pandas DataFrame, built only once'''
+        if self._frame is None:
+            self._frame = pd.DataFrame.from_records(self.data) if self.data else pd.DataFrame(columns=['stock'])
+        return self._frame
+
+    @staticmethod
+    def _round(values: pd.Series, digits: int = 2) -> pd.Series:
+        '''Rounds each value with Python's round, so results match the values
+        printed before (numpy rounding differs on some half cases)'''
+        return values.map(lambda value: round(value, digits))
+
+    @staticmethod
+    def _sum(values: pd.Series, keys: list) -> pd.Series:
+        '''Sums values per group of keys (columns of the same frame), adding them one by one in row order
+        as the per row loops did: pandas' sum and cumsum compensate rounding errors, so their totals may differ
+        from the values printed before in the last digit. Groups are kept in order of first appearance'''
+        import numpy as np
+
+        codes, groups = pd.MultiIndex.from_arrays(keys).factorize()
+        groups = groups.set_names([key.name for key in keys])
+        totals = np.zeros(len(groups))
+        #Unbuffered: each value is added to its group total in turn
+        np.add.at(totals, codes, values.to_numpy(dtype=float))
+        return pd.Series(totals, index=groups if len(keys) > 1 else groups.get_level_values(0))
+
+    @staticmethod
+    def _valid_portfolios(names: list, logger: logging.Logger) -> list:
+        '''Returns the names registered at config.py, logging the others'''
+        valid = []
+        for portfolio in names:
+            if not portfolios.get(portfolio):
+                logger.info(f'Portfolio "{portfolio}" does not exist at config.py')
+            else:
+                valid.append(portfolio)
+        return valid
+
+    def _assign_portfolios(self, names: list, logger: logging.Logger, frame: pd.DataFrame = None) -> pd.DataFrame:
+        '''Returns the rows of frame (default: self.frame) with a "portfolio" column.
+        A row appears once per portfolio its stock belongs to, so every portfolio
+        is computed in one group-by. Each stock is looked up once in the reverse index'''
+        if frame is None:
+            frame = self.frame
+        stock_portfolios, all_stocks_portfolios = portfolio_index()
+        membership = {}
+        for stock in frame['stock'].unique():
+            member_of = stock_portfolios.get(stock, set()) | all_stocks_portfolios
+            membership[stock] = [portfolio for portfolio in names if portfolio in member_of]
+        rows = frame.assign(portfolio=frame['stock'].map(membership)).explode('portfolio')
+        rows = rows[rows['portfolio'].notna()].reset_index(drop=True)
+        for portfolio in names:
+            logger.info(f'Selected Stocks from portfolio {portfolio}: '
+                        f'{[stock for stock, member_of in membership.items() if portfolio in member_of]}')
+        return rows
+
+    def _yields_summaries(self, names: list, logger: logging.Logger) -> dict:
+        '''Computes monthly yields and yields per stock of every portfolio in names in one pass
+
+        :return : dict portfolio -> (monthly_performance, yields_per_stocks)'''
+        import calendar
+
+        monthly = pd.Series(dtype=float)
+        per_type = pd.Series(dtype=float)
+        if isinstance(self.data, dict):
+            monthly_rows = self._assign_portfolios(names, logger,
+                                pd.DataFrame.from_records(self.data['monthly'], columns=['stock', 'month', 'value']))
+            type_rows = self._assign_portfolios(names, logger,
+                                pd.DataFrame.from_records(self.data['per_stock'], columns=['stock', 'yield_type', 'value']))
+            monthly = self._sum(monthly_rows['value'], [monthly_rows['portfolio'], monthly_rows['month']])
+            per_type = self._sum(type_rows['value'], [type_rows['portfolio'], type_rows['stock'], type_rows['yield_type']])
+        elif not self.frame.empty:
+            values = self.frame['value'].astype(float)
+            #Rounded before portfolios are assigned, so a row shared by portfolios is rounded once
+            rows = self._assign_portfolios(names, logger, self.frame.assign(value=values, rounded_value=self._round(values),
+                                                                            month=pd.to_datetime(self.frame['date']).dt.month))
+            monthly = self._sum(rows['rounded_value'], [rows['portfolio'], rows['month']])
+            per_type = self._sum(rows['value'], [rows['portfolio'], rows['stock'], rows['yield_type']])
+        else:
+            self._assign_portfolios(names, logger)
+
+        monthly_per_portfolio = {portfolio: group.droplevel(0) for portfolio, group in monthly.groupby(level=0, sort=False)}
+        type_per_portfolio = {portfolio: group.droplevel(0) for portfolio, group in per_type.groupby(level=0, sort=False)}
+        summaries = {}
+        for portfolio in names:
+            monthly_performance = {}
+            yields_per_stocks = []
+            for month, total in monthly_per_portfolio.get(portfolio, {}).items():
+                monthly_performance[calendar.month_name[month]] = float(total)
+            portfolio_types = type_per_portfolio.get(portfolio)
+            if portfolio_types is not None and not portfolio_types.empty:
+                yield_per_stock = portfolio_types.unstack('yield_type') \
+                                        .reindex(index=portfolio_types.index.get_level_values('stock').unique(), columns=Statistics.YIELD_TYPES) \
+                                        .fillna(0.0).apply(self._round)
+                yield_per_stock.index.name = 'stock'
+                yields_per_stocks = yield_per_stock.reset_index().to_dict('records')
+            monthly_performance['average_per_month'] = round(sum(monthly_performance.values())/12, 2)
+            summaries[portfolio] = (monthly_performance, yields_per_stocks)
+        return summaries
     
+    @timed('statistics.generate_yields_summary')
     def generate_yields_summary(self, portfolio: str) -> None:
         '''This method generates yields summary.
         It gets stocks from selected portfolio, calculates:
         - total and monthly yields 
         - total yields per stock in the time period
-        received from the database query at self.data. 
+        received from the database query at self.data (raw rows or server-side aggregated). 
         It asks an input from user to get the export method.
         
         :param portfolio : The name of the registered portfolio at config.py'''
-        import calendar
-
         logger = logging.getLogger(Statistics.generate_yields_summary.__qualname__)
         logger.info('Generating yields summary')
 
-        monthly_performance = {}
-        yields_per_stocks = []
-        yield_per_stock = {}
-        selected_stocks = portfolios.get(portfolio)
-
-        if not selected_stocks:
-            logger.info(f'Portfolio "{portfolio}" does not exist at config.py')
+        if not self._valid_portfolios([portfolio], logger):
             return 
-        elif '*' in selected_stocks:
-            logger.info('All stocks selected')
-            selected_stocks = []
-            for row in self.data:
-                selected_stocks.append(row['stock'])
+        monthly_performance, yields_per_stocks = self._yields_summaries([portfolio], logger)[portfolio]
+        export_to = self._export_target('\nYield general summary - Export to ( select print, csv or json): ')
+        self.export(payload = [monthly_performance], export_to=export_to.lower(), name='yields_summary')
+        export_to = self._export_target('\nYield per stock summary - Export to ( select print, csv or json): ')
+        self.export(payload = yields_per_stocks, export_to=export_to.lower(), name='yields_per_stock')
 
-        logger.info(f'Selected Stocks from portfolio {portfolio}: {selected_stocks}')
-        for row in self.data:
-            if row['stock'] in selected_stocks:
-                month = row["date"].month
-                monthly_performance[calendar.month_name[month]] =monthly_performance.get(calendar.month_name[month],0.0) \
-                                                                + round(float(row["value"]),2) 
-                yield_per_stock[row['stock']] = {
-                                                'dividend': 0.0,
-                                                'jcp': 0.0,
-                                                'rendimentos_de_clientes': 0.0,
-                                                'fracoes_de_acoes': 0.0
-                                                }
-        for row in self.data:
-            if row['stock'] in selected_stocks:
-                yield_per_stock[row['stock']][row['yield_type']] = yield_per_stock[row['stock']].get(row['yield_type'],0) + row['value']
-        for key in yield_per_stock.keys():
-            yields_per_stocks.append({
-                                    'stock': key, 
-                                    'dividend':  round(yield_per_stock[key].get('dividend', 0.0 ),2),
-                                    'jcp':  round(yield_per_stock[key].get('jcp', 0.0 ),2),
-                                    'rendimentos_de_clientes':  round(yield_per_stock[key].get('rendimentos_de_clientes', 0.0 ),2),
-                                    'fracoes_de_acoes': round(yield_per_stock[key].get('fracoes_de_acoes', 0.0 ),2)
-                                    })
-        monthly_performance['average_per_month'] = round(sum(monthly_performance.values())/12, 2)
-        export_to = input('\nYield general summary - Export to ( select print or csv): ')
-        self.export(payload = [monthly_performance], export_to=export_to.lower())
-        export_to = input('\nYield per stock summary - Export to ( select print or csv): ')
-        self.export(payload = yields_per_stocks, export_to=export_to.lower())
-        
+    @timed('statistics.generate_yields_summaries')
+    def generate_yields_summaries(self, names: list = None) -> None:
+        '''Generates the yields summary of several portfolios (default: all of config.py)
+        in one pass over the data. It asks the export method once for all portfolios.
+
+        :param names : names of registered portfolios at config.py'''
+        logger = logging.getLogger(Statistics.generate_yields_summaries.__qualname__)
+        logger.info('Generating yields summaries')
+
+        names = self._valid_portfolios(names or list(portfolios), logger)
+        summaries = self._yields_summaries(names, logger)
+        export_to = self._export_target('\nYield general summaries - Export to ( select print, csv or json): ')
+        for portfolio, (monthly_performance, _) in summaries.items():
+            self._export_header(portfolio, export_to.lower())
+            self.export(payload = [monthly_performance], export_to=export_to.lower(), name=f'{portfolio}_yields_summary')
+        export_to = self._export_target('\nYield per stock summaries - Export to ( select print, csv or json): ')
+        for portfolio, (_, yields_per_stocks) in summaries.items():
+            self._export_header(portfolio, export_to.lower())
+            self.export(payload = yields_per_stocks, export_to=export_to.lower(), name=f'{portfolio}_yields_per_stock')
+
+    def _stocks_summaries(self, names: list, logger: logging.Logger) -> dict:
+        '''Computes the stocks summary of every portfolio in names in one pass
+        and with a single market prices fetch
 
+        :return : dict portfolio -> (summary, stocks_summary). Portfolios without invested value are left out'''
+        rows = self._assign_portfolios(names, logger)
+        if rows.empty:
+            for portfolio in names:
+                logger.info(f'Portfolio "{portfolio}" has no stocks at this report')
+            return {}
+
+        #Calculates total summary
+        market_prices = self.quotes.prefetch(rows['stock'])
+        market_price = rows['stock'].map(market_prices).astype(float).fillna(0.0)
+        quantity = rows['quantity'].astype(int)
+        invested = rows['total'].astype(float)
+        rows = rows.assign(market_price=market_price, quantity=quantity, total=invested, current_value=market_price*quantity)
+        totals = pd.DataFrame({'total': self._sum(rows['total'], [rows['portfolio']]),
+                               'current_value': self._sum(rows['current_value'], [rows['portfolio']])})
+
+        #Calculates individual stock 
+        held = rows[rows['quantity'] != 0]
+        portfolio_current_value = held['portfolio'].map(totals['current_value'])
+        total_current_stock_value = self._round(held['current_value'])
+        total_invested_stock_value = self._round(held['total'])
+        held = held.assign(total_current_stock_value=total_current_stock_value,
+                           total_invested_stock_value=total_invested_stock_value,
+                           stock_weight=self._round(total_current_stock_value/portfolio_current_value)*100,
+                           performance_value=self._round(total_current_stock_value - total_invested_stock_value),
+                           performance_percent=self._round(total_current_stock_value/total_invested_stock_value - 1)*100)
+        stocks_summaries = {}
+        for portfolio, group in held.groupby('portfolio', sort=False):
+            stocks_summary = []
+            for stock, price, current, invested_value, weight, performance_value, performance_percent, shares in zip(
+                    group['stock'], group['market_price'], group['total_current_stock_value'], group['total_invested_stock_value'],
+                    group['stock_weight'], group['performance_value'], group['performance_percent'], group['quantity']):
+                stock_summary = {
+                                    'stock': stock, 
+                                    'current_stock_value': float(price),
+                                    'total_current_stock_value': float(current),
+                                    'total_invested_stock_value': float(invested_value),
+                                    'stock_weight': float(weight),
+                                    'stock_performance': [float(performance_value), float(performance_percent)],
+                                    'quantity': int(shares)
+                                }
+                if self.quotes.is_stale(stock):
+                    stock_summary['stale_quote'] = True
+                stocks_summary.append(stock_summary)
+            stocks_summaries[portfolio] = stocks_summary
+
+        summaries = {}
+        for portfolio in names:
+            if portfolio not in totals.index or not totals.loc[portfolio, 'total']:
+                logger.info(f'Portfolio "{portfolio}" has no invested value at this report')
+                continue
+            total_invested = float(totals.loc[portfolio, 'total'])
+            current_total_value = float(totals.loc[portfolio, 'current_value'])
+            performance = [round(current_total_value - total_invested,2),
+                            round(current_total_value/total_invested - 1,2)*100]
+            summary = {'total_invested': round(total_invested,2), 'current_total_value': round(current_total_value,2) ,
+                        'performance': performance}
+            stale_quotes = [stock for stock in dict.fromkeys(rows['stock'][rows['portfolio'] == portfolio])
+                            if self.quotes.is_stale(stock)] if self.quotes.stale else []
+            if stale_quotes:
+                logger.warning(f'Summary of "{portfolio}" computed with stale quotes: {stale_quotes}')
+                summary['stale_quotes'] = stale_quotes
+            summaries[portfolio] = (summary, stocks_summaries.get(portfolio, []))
+        return summaries
+
+    @timed('statistics.generate_stocks_summary')
     def generate_stocks_summary(self, portfolio: str)-> None:
         '''This method generates stocks summary.
         It gets stocks from selected portfolio, calculates:
@@ -83,68 +295,46 @@ class Statistics:
         
         :param portfolio : The name of the registered portfolio at config.py'''
         logger = logging.getLogger(Statistics.generate_stocks_summary.__qualname__)
-        total_invested = 0
-        current_total_value = 0
-        stocks_summary = []
-
-        selected_stocks = portfolios.get(portfolio)
 
-        if not selected_stocks:
-            logger.info(f'Portfolio "{portfolio}" does not exist at config.py')
+        if not self._valid_portfolios([portfolio], logger):
             return 
-        elif '*' in selected_stocks:
-            logger.info('All stocks selected')
-            selected_stocks = []
-            for row in self.data:
-                selected_stocks.append(row['stock'])
+        summaries = self._stocks_summaries([portfolio], logger)
+        if portfolio not in summaries:
+            return
+        summary, stocks_summary = summaries[portfolio]
+        export_to = self._export_target('\nGeneral Staticstics - Export to ( select print, csv or json): ')
+        self.export([summary], export_to.lower(), name='stocks_summary')
+        export_to = self._export_target('\nStocks Staticstics - Export to ( select print, csv or json): ')
+        self.export(stocks_summary, export_to.lower(), name='stocks_per_stock')
+        #return summary, stocks_summary
 
-        logger.info(f'Selected Stocks from portfolio {portfolio}: {selected_stocks}')
-        for row in self.data:
-            if row['stock'] in selected_stocks:
-                #Calculates total summary
-                market_price = Ticker(row['stock']+'.SA').fast_info['last_price']
-                if not market_price:
-                    market_price = 0.0
-                total_invested = total_invested + row['total']   
-                current_total_value = current_total_value + market_price*row['quantity']
-        performance = [round(current_total_value - total_invested,2),
-                        round(current_total_value/total_invested - 1,2)*100]
-        summary = {'total_invested': round(total_invested,2), 'current_total_value': round(current_total_value,2) ,
-                    'performance': performance}
+    @timed('statistics.generate_stocks_summaries')
+    def generate_stocks_summaries(self, names: list = None)-> None:
+        '''Generates the stocks summary of several portfolios (default: all of config.py)
+        in one pass over the data and one market prices fetch.
+        It asks the export method once for all portfolios.
 
-        for row in self.data:
-        #Calculates individual stock 
-            if row['stock'] in selected_stocks:  
-                if row['quantity'] == 0:
-                    pass
-                else:    
-                    market_price = Ticker(row["stock"]+".SA").fast_info['last_price']
-                    if not market_price:
-                        market_price = 0.0                                    
-                    current_stock_value = market_price
-                    total_current_stock_value =  round(current_stock_value*row["quantity"],2)
-                    total_invested_stock_value = round(row["total"],2)
-                    stock_weight = round(total_current_stock_value/current_total_value,2)*100
-                    stock_performance = [round(total_current_stock_value - total_invested_stock_value,2), 
-                                            round(total_current_stock_value/total_invested_stock_value - 1,2)*100]
-                    
-                    stock_summary = {
-                                        'stock':row['stock'], 
-                                        'current_stock_value': current_stock_value,
-                                        'total_current_stock_value': total_current_stock_value,
-                                        'total_invested_stock_value': total_invested_stock_value,
-                                        'stock_weight': stock_weight,
-                                        'stock_performance': stock_performance,
-                                        'quantity': row['quantity']
-                                    }
-                    stocks_summary.append(stock_summary)
-                
-        export_to = input('\nGeneral Staticstics - Export to ( select print or csv): ')
-        self.export([summary], export_to.lower())
-        export_to = input('\nStocks Staticstics - Export to ( select print or csv): ')
-        self.export(stocks_summary, export_to.lower())
-        #return summary, stocks_summary
+        :param names : names of registered portfolios at config.py'''
+        logger = logging.getLogger(Statistics.generate_stocks_summaries.__qualname__)
+
+        names = self._valid_portfolios(names or list(portfolios), logger)
+        summaries = self._stocks_summaries(names, logger)
+        export_to = self._export_target('\nGeneral Staticstics - Export to ( select print, csv or json): ')
+        for portfolio, (summary, _) in summaries.items():
+            self._export_header(portfolio, export_to.lower())
+            self.export([summary], export_to.lower(), name=f'{portfolio}_stocks_summary')
+        export_to = self._export_target('\nStocks Staticstics - Export to ( select print, csv or json): ')
+        for portfolio, (_, stocks_summary) in summaries.items():
+            self._export_header(portfolio, export_to.lower())
+            self.export(stocks_summary, export_to.lower(), name=f'{portfolio}_stocks_per_stock')
 
+    @staticmethod
+    def _export_header(portfolio: str, export_to: str) -> None:
+        '''Prints the portfolio name before its printed summary'''
+        if export_to == 'print':
+            print(f'\n==== {portfolio} ====')
+
+    @timed('statistics.getreport_stocks')
     def getreport_stocks(self, broker: str=None) -> None:
         '''This method generates info to Stocks IR report (Brazil)
         It asks an input from user to get the export method
@@ -152,7 +342,7 @@ class Statistics:
         :param broker: The broker from where to generate this report'''
         logger = logging.getLogger(Statistics.getreport_stocks.__qualname__)
         logger.info(f'Stocks IR report at "{broker}"')
-        export_to = input('Stocks report - Export to ( select print or csv): ')
+        export_to = self._export_target('Stocks report - Export to ( select print, csv or json): ')
         stocks_to_report = []
         for row in self.data:
             if row['quantity'] == 0:
@@ -160,8 +350,9 @@ class Statistics:
             else:
                 row['pm'] = round(float(row["total"])/int(row["quantity"]), 2)
                 stocks_to_report.append(row)
-        self.export(stocks_to_report, export_to.lower())
+        self.export(stocks_to_report, export_to.lower(), name='stocks_report')
 
+    @timed('statistics.getreport_sell')
     def getreport_sell(self,broker: str=None) -> None:
         '''This method generates info to Sold Stocks IR report (Brazil)
         It asks an input from user to get the export method
@@ -171,7 +362,8 @@ class Statistics:
         import calendar
         monthly_performance = {}# [0., 0., 0., 0., 0., 0.,  0., 0., 0., 0., 0., 0., 0., ]
         logger.info(f'Sold Stocks IR report at "{broker}": ')
-        export_to = input('Sold Stocks report - Export to ( select print or csv): ')
+        export_to = self._export_target('Sold Stocks report - Export to ( select print, csv or json): ')
+        sold_stocks = []
         for row in self.data:
             month = row["date"].month
             #monthly_performance[month] += round(float(row["performance"]),2) 
@@ -183,12 +375,14 @@ class Statistics:
                             'total_value' : -row['total_price'],
                             'performance' : round(float(row['performance']),2)
                         }
-            self.export([row_stock], export_to.lower())
+            sold_stocks.append(row_stock)
+        self.export(sold_stocks, export_to.lower(), name='sell_report')
         logger.info(f'Sold Stocks Monthly Performance at "{broker}": ')
-        export_to = input('Monthly Performance - Export to ( select print or csv): ')
-        self.export([monthly_performance], export_to.lower())
+        export_to = self._export_target('Monthly Performance - Export to ( select print, csv or json): ')
+        self.export([monthly_performance], export_to.lower(), name='sell_monthly_performance')
            
 
+    @timed('statistics.getreport_yield')
     def getreport_yield(self, broker: str = None):
         '''This method generates info to Sold Stocks IR report (Brazil)
         Date - Stock - Type and value
@@ -197,42 +391,47 @@ class Statistics:
         :param broker: The broker from where to generate this report'''
         logger = logging.getLogger(Statistics.getreport_yield.__qualname__)
         logger.info(f'Yield IR report at "{broker}": ')
-        export_to = input('\nYield report - Export to ( select print or csv): ')
-        self.export(payload = sorted(self.data, key=lambda d: d['yield_type']), export_to=export_to.lower())
+        export_to = self._export_target('\nYield report - Export to ( select print, csv or json): ')
+        #Aggregated data (Database.genreport_yield_summary) reports totals per stock and yield type
+        rows = self.data['per_stock'] if isinstance(self.data, dict) else self.data
+        self.export(payload = sorted(rows, key=lambda d: d['yield_type']), export_to=export_to.lower(), name='yield_report')
          
-    def export(self, payload: list = [] , export_to = None):
-        #TODO: Implement export logic (db, api, document, etc)
-        import calendar
-        if export_to == 'print':
-            for row in payload:
-                keys = list(row.keys())
-                print('\n')
-                for key in keys:
-                    if 'value' in key.lower() or 'performance' in key.lower() or 'dividend' in key.lower() \
-                        or 'jcp' in key.lower() or 'rendimentos_de_clientes' in key.lower() \
-                        or 'fracoes_de_acoes' in key.lower() or 'average' in key.lower():
-                        if type(row[key]) == list:
-                            print(f'{key.capitalize().replace("_"," ")}: {row[key][0]} {currency[1]}  | {row[key][1]} %')
-                        else:
-                            print(f'{key.capitalize().replace("_"," ")}: {row[key]} {currency[1]}')
-                    elif 'weight' in key.lower():
-                        print(f'{key.capitalize().replace("_"," ")}: {row[key]} %')
-                    elif 'quantity' in key.lower():
-                        print(f'{key.capitalize().replace("_"," ")}: {row[key]} shares')
-                    elif 'type' in key.lower():
-                        print(f'{key.capitalize().replace("_"," ")}: {row[key].capitalize().replace("_"," ")}')
-                    elif key in list(calendar.month_name):
-                        print(f'{key.capitalize().replace("_"," ")}: {round(row[key],2)} {currency[1]}')
-                    else:
-                        print(f'{key.capitalize().replace("_"," ")}: {row[key]} ')
-
-        if export_to == 'csv':
-            table = Table(payload)
-            filename =  input('CSV Filename: ')
-            table.export_csv(filename)
+    @timed('statistics.getreport_performance')
+    def getreport_performance(self, broker: str = None) -> None:
+        '''This method reports the portfolio value over time (see PriceHistory.portfolio_series):
+        a summary of the period and the daily series
+        It asks an input from user to get the export method
+
+        :param broker: The broker from where to generate this report'''
+        logger = logging.getLogger(Statistics.getreport_performance.__qualname__)
+        logger.info(f'Performance report at "{broker or "all brokers"}"')
+        if not self.data:
+            logger.warning('Empty performance series')
+            return
+        summary = {'from_date': self.data[0]['date'], 'to_date': self.data[-1]['date'],
+                   'start_value': self.data[0]['value'], 'end_value': self.data[-1]['value'],
+                   'invested_value': self.data[-1]['invested'],
+                   'cumulative_return': self.data[-1]['cumulative_return'],
+                   'max_drawdown': min(row['drawdown'] for row in self.data)}
+        export_to = self._export_target('Performance summary - Export to ( select print, csv or json): ')
+        self.export([summary], export_to.lower(), name='performance_summary')
+        export_to = self._export_target('Daily performance - Export to ( select print, csv or json): ')
+        self.export(self.data, export_to.lower(), name='performance_history')
+
+    def export(self, payload: list = [] , export_to = None, name: str = 'report'):
+        '''Renders a whole report in one batch through the sink registered for export_to (see render.SINKS)'''
+        #TODO: Implement export logic (db, api, etc)
+        from render import SINKS
+
+        sink = SINKS.get(export_to)
+        if sink is not None:
+            filename = self._output_filename(name, sink.extension) if sink.extension else None
+            sink.write(payload, filename)
         if export_to == 'database':
             pass
         if export_to == 'api':
+            #Kept for the caller instead of rendered (see daemon.py)
+            self.results[name] = payload
             return payload
         print('\n')
         return
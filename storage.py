@@ -0,0 +1,159 @@
+from datetime import datetime
+from importlib import import_module
+
+from config import storage as storage_config
+
+
+#Module and class of each storage backend selectable at config.py
+BACKENDS: dict = {
+                'mongodb': ('database', 'Database'),
+                'sqlite': ('sqlite_database', 'SQLiteDatabase')
+            }
+
+
+def backend_module(backend: str = None) -> str:
+    '''Name of the module implementing a backend (default: the one selected at config.py)'''
+    backend = backend or storage_config['backend']
+    if backend not in BACKENDS:
+        raise KeyError (f'Storage backend "{backend}" not Found. Choose one of {list(BACKENDS)}')
+    return BACKENDS[backend][0]
+
+
+def open_database(backend: str = None):
+    '''Returns the storage of the backend selected at config.py (or the one given).
+    Every backend has the interface of database.Database'''
+    backend = backend or storage_config['backend']
+    return getattr(import_module(backend_module(backend)), BACKENDS[backend][1])()
+
+
+class Storage:
+    '''Parts shared by every storage backend: parsing of report periods and the
+    record matching used by sync. Backends implement insert_data, bulk_insert, bulk_load,
+    sync, drop_collection, find_all, iter_collection, ensure_indexes, explain_reports,
+    the positions methods and the genreport_* queries'''
+
+    #Fields identifying a record when syncing (a record repeated in a file is matched by occurrence)
+    #and fields whose change makes it an update
+    SYNC_KEYS: dict = {
+                    'stocks': ['broker', 'transaction_type', 'stock', 'date'],
+                    'yields': ['broker', 'yield_type', 'stock', 'date']
+                    }
+    SYNC_FIELDS: dict = {
+                    'stocks': ['quantity', 'price', 'total_price', 'performance'],
+                    'yields': ['value']
+                    }
+
+
+    @staticmethod
+    def _fingerprint(row: dict, fields: list) -> bytes:
+        '''Content hash of the fields of a record. Numbers are compared as floats rounded to
+        6 decimals (CSV parsing may change the last digit) and empty fields ('' from CSV) as missing ones'''
+        from hashlib import blake2b
+
+        values = []
+        for field in fields:
+            value = row.get(field)
+            if value == '':
+                value = None
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                value = round(float(value), 6)
+            values.append(repr(value))
+        return blake2b('\x1f'.join(values).encode('utf-8'), digest_size=16).digest()
+
+
+    @staticmethod
+    def _sync_changes(collection: str, stored, batches) -> dict:
+        '''Compares stored records with the rows of a file.
+        Each record is identified by SYNC_KEYS (plus its occurrence, for repeated records)
+        and fingerprinted over SYNC_FIELDS
+
+        :param collection: refers to yields or stocks
+        :param stored: iterable of (id, record) of the stored records, in insertion order
+        :param batches: iterable of lists of dicts (ex: Table.iter_csv)
+        :return : dict with inserts (rows), updates ((id, row)), deletes (ids), the earliest changed
+                  date of each broker (first_dates, rows without a date left out) and the summary
+                  (number of records per change)'''
+        keys, fields = Storage.SYNC_KEYS[collection], Storage.SYNC_FIELDS[collection]
+
+        #Stored records: identity -> (id, fingerprint, broker, date)
+        index: dict = {}
+        occurrences: dict = {}
+        for record_id, record in stored:
+            key = tuple(record.get(field) for field in keys)
+            occurrences[key] = occurrences.get(key, -1) + 1
+            index[key + (occurrences[key],)] = (record_id, Storage._fingerprint(record, fields), record.get('broker'), record.get('date'))
+
+        changes = {'inserts': [], 'updates': [], 'deletes': [], 'first_dates': {},
+                   'summary': {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}}
+        first_dates = changes['first_dates']
+        occurrences = {}
+        for batch in batches:
+            for row in batch:
+                key = tuple(row.get(field) for field in keys)
+                occurrences[key] = occurrences.get(key, -1) + 1
+                match = index.pop(key + (occurrences[key],), None)
+                if match is None:
+                    changes['inserts'].append(row)
+                    changes['summary']['inserted'] += 1
+                elif match[1] != Storage._fingerprint(row, fields):
+                    changes['updates'].append((match[0], row))
+                    changes['summary']['updated'] += 1
+                else:
+                    changes['summary']['unchanged'] += 1
+                    continue
+                Storage._track_first_date(first_dates, row.get('broker'), row.get('date'))
+        for record_id, _, broker, date in index.values():
+            changes['deletes'].append(record_id)
+            changes['summary']['deleted'] += 1
+            Storage._track_first_date(first_dates, broker, date)
+        return changes
+
+
+    @staticmethod
+    def _track_first_date(first_dates: dict, broker: str, date) -> None:
+        '''Keeps the earliest date of each broker. Rows without a date (empty or not a datetime)
+        are left out: no date-bound data (ex: position checkpoints) covers them'''
+        if isinstance(date, datetime):
+            first_dates[broker] = min(date, first_dates.get(broker, date))
+
+
+    @staticmethod
+    def _today() -> datetime:
+        '''Midnight of today. Transactions dated after it are not part of the current positions'''
+        now = datetime.now()
+        return datetime(now.year, now.month, now.day)
+
+
+    @staticmethod
+    def _remove_moves(positions: list, moves: dict) -> list:
+        '''Takes transactions (ex: future dated ones) out of positions
+
+        :param positions: dicts with broker, stock, quantity, total and average_price
+        :param moves: dict (broker, stock) -> (quantity, total) of the transactions to take out
+        :return : the positions, average prices recomputed'''
+        if not moves:
+            return positions
+        for position in positions:
+            quantity, total = moves.get((position['broker'], position['stock']), (0, 0.0))
+            if quantity or total:
+                position['quantity'] -= int(quantity)
+                position['total'] -= float(total)
+                position['average_price'] = position['total']/position['quantity'] if position['quantity'] else 0.0
+        return positions
+
+
+    @staticmethod
+    def _parse_period(from_date: str = None, to_date: str = None) -> tuple:
+        '''Translates a period typed by the user (format %Y-%m-%d) to datetimes.
+        Empty from_date is the 1st day of this year, empty to_date is today'''
+        if from_date:
+            from_date = datetime.strptime(from_date, "%Y-%m-%d")
+        if to_date:
+            to_date = datetime.strptime(to_date, "%Y-%m-%d")
+        if not from_date:
+            this_year = str(datetime.now().year)
+            from_date = datetime.strptime(str(this_year)+'-01-1', '%Y-%m-%d')
+        if not to_date:
+            to_date = datetime.now().strftime("%Y-%m-%#d")
+            to_date = datetime.strptime(to_date,'%Y-%m-%d')
+        return from_date, to_date
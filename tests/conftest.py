@@ -0,0 +1,57 @@
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+#Modules live at the repository root. statistics.py shadows the standard library module of the same name
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+if 'statistics' in sys.modules and not getattr(sys.modules['statistics'], '__file__', '').startswith(ROOT):
+    del sys.modules['statistics']
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    '''Each test runs in its own directory, where local files (quotes.db, report_cache.db, ...) are written,
+    with fresh process-wide quote service and report cache'''
+    import quotes
+    import report_cache
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(quotes, '_quote_service', None)
+    monkeypatch.setattr(report_cache, '_report_cache', None)
+    return tmp_path
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    '''Points database.Database at an in-memory MongoDB'''
+    mongomock = pytest.importorskip('mongomock')
+    import database
+
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(database, 'get_client', lambda: client)
+    return client
+
+
+@pytest.fixture
+def sqlite_backend(tmp_path, monkeypatch):
+    '''Selects the sqlite storage backend (on a file of the test directory) for open_database'''
+    import config
+
+    monkeypatch.setitem(config.storage, 'backend', 'sqlite')
+    monkeypatch.setitem(config.storage, 'sqlite_path', str(tmp_path / 'investments.db'))
+    return config.storage
+
+
+def buy(broker: str, stock: str, date: datetime, quantity: int, price: float) -> dict:
+    '''A stocks row, as add_transaction stores a Buy'''
+    return {'broker': broker, 'transaction_type': 'Buy', 'stock': stock, 'date': date,
+            'quantity': quantity, 'price': price, 'total_price': quantity*price}
+
+
+def sell(broker: str, stock: str, date: datetime, quantity: int, price: float, performance: float = 0.0) -> dict:
+    '''A stocks row, as add_transaction stores a Sell (negative quantity and prices)'''
+    return {'broker': broker, 'transaction_type': 'Sell', 'stock': stock, 'date': date,
+            'quantity': -quantity, 'price': -price, 'total_price': -quantity*price, 'performance': performance}
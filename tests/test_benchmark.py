@@ -0,0 +1,50 @@
+import pytest
+
+pytest.importorskip('pandas')
+
+
+@pytest.mark.parametrize('backend', ['sqlite', 'mongomock'])
+def test_every_operation_runs_on_each_backend(backend, tmp_path):
+    import benchmark
+
+    if backend == 'mongomock':
+        pytest.importorskip('mongomock')
+    results = benchmark.run_size(50, str(tmp_path), backend=backend)
+
+    operations = {result['operation'] for result in results}
+    assert {'update_from_csv_stocks', 'get_csv', 'get_report_stocks', 'get_performance', 'add_transaction'} <= operations
+    assert all(result['backend'] == backend and result['seconds'] >= 0 for result in results)
+
+
+def test_compare_flags_slower_operations_of_the_same_backend():
+    from benchmark import compare
+
+    baseline = [{'operation': 'get_csv', 'size': 10, 'seconds': 1.0},
+                {'backend': 'mongomock', 'operation': 'get_csv', 'size': 10, 'seconds': 5.0}]
+    results = [{'backend': 'sqlite', 'operation': 'get_csv', 'size': 10, 'seconds': 1.5},
+               {'backend': 'mongomock', 'operation': 'get_csv', 'size': 10, 'seconds': 5.5}]
+
+    assert compare(results, baseline) == [{'backend': 'sqlite', 'operation': 'get_csv', 'size': 10,
+                                           'baseline': 1.0, 'seconds': 1.5}]
+
+
+@pytest.mark.parametrize('installed', [True, False])
+def test_main_runs_every_backend_by_default_skipping_mongomock_if_not_installed(installed, tmp_path, monkeypatch, capsys):
+    import json
+    import sys
+
+    import benchmark
+
+    if installed:
+        pytest.importorskip('mongomock')
+    else:
+        monkeypatch.setitem(sys.modules, 'mongomock', None)
+    output = str(tmp_path / 'benchmark.json')
+    monkeypatch.setattr(sys, 'argv', ['benchmark.py', '--sizes', '20', '--output', output])
+
+    assert benchmark.main() == 0
+
+    with open(output, encoding='utf-8') as jsonf:
+        backends = {result['backend'] for result in json.load(jsonf)['results']}
+    assert backends == ({'sqlite', 'mongomock'} if installed else {'sqlite'})
+    assert ('Skipping the mongomock backend' in capsys.readouterr().out) is not installed
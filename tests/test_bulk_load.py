@@ -0,0 +1,38 @@
+from datetime import datetime
+
+import pytest
+
+from conftest import buy
+
+
+@pytest.fixture(params=['mongodb', 'sqlite'])
+def db(request, tmp_path):
+    '''Each storage backend, with two stored transactions'''
+    if request.param == 'mongodb':
+        request.getfixturevalue('mongo')
+        from database import Database
+
+        db = Database()
+    else:
+        from sqlite_database import SQLiteDatabase
+
+        db = SQLiteDatabase(str(tmp_path / 'investments.db'))
+    db.bulk_load('stocks', [[buy('Rico', 'AAA', datetime(2023, 1, 2), 10, 2.0),
+                             buy('Rico', 'BBB', datetime(2023, 1, 3), 1, 5.0)]])
+    return db
+
+
+@pytest.mark.parametrize('batches', [[], [[], []]])
+def test_empty_load_is_refused_and_keeps_the_collection(db, batches):
+    with pytest.raises(Exception, match='kept untouched'):
+        db.bulk_load('stocks', iter(batches))
+
+    assert len(list(db.iter_collection('stocks'))) == 2
+    assert db.get_position('Rico', 'AAA')['quantity'] == 10
+
+
+def test_empty_load_empties_the_collection_when_allowed(db):
+    assert db.bulk_load('stocks', [], allow_empty=True) == 0
+
+    assert list(db.iter_collection('stocks')) == []
+    assert db.get_positions(['Rico']) == []
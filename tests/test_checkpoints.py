@@ -0,0 +1,56 @@
+from datetime import datetime
+
+import pytest
+
+from conftest import buy, sell
+
+
+@pytest.fixture
+def db(mongo):
+    from database import Database
+
+    db = Database()
+    db.bulk_insert('stocks', [buy('Rico', 'AAA', datetime(2023, 1, 10), 10, 2.0),
+                              buy('Rico', 'AAA', datetime(2023, 1, 31, 15, 30), 5, 2.0),
+                              sell('Rico', 'AAA', datetime(2023, 2, 1), 3, 4.0),
+                              buy('Rico', 'BBB', datetime(2023, 2, 20), 1, 10.0),
+                              buy('Rico', 'AAA', datetime(2023, 3, 5), 2, 3.0)])
+    return db
+
+
+def quantities(report: list) -> dict:
+    return {row['stock']: row['quantity'] for row in report if row['quantity']}
+
+
+def replayed(db, threshold_date: str) -> dict:
+    '''The report computed from the whole history, without checkpoints'''
+    rows = db.stocks.aggregate(db._stocks_report_pipeline(datetime.strptime(threshold_date, '%Y-%m-%d'), 'Rico'))
+    return {row['_id']: row['quantity'] for row in rows if row['quantity']}
+
+
+@pytest.mark.parametrize('threshold_date', ['2023-01-31', '2023-02-01', '2023-02-15', '2023-03-01', '2023-03-31'])
+def test_reports_from_checkpoints_match_the_full_replay(db, threshold_date):
+    db.build_checkpoints()
+
+    assert [checkpoint['date'] for checkpoint in db.checkpoints.find({}, sort=[('date', 1)])] == \
+           [datetime(2023, 2, 1), datetime(2023, 3, 1), datetime(2023, 4, 1)]
+    assert quantities(db.genreport_stocks(threshold_date, 'Rico')) == replayed(db, threshold_date)
+
+
+def test_back_dated_insert_invalidates_and_reports_rebuild_lazily(db):
+    db.build_checkpoints()
+
+    db.insert_data(buy('Rico', 'CCC', datetime(2023, 1, 31), 4, 1.0))
+
+    assert db.checkpoints.count_documents({}) == 0
+    assert quantities(db.genreport_stocks('2023-02-15', 'Rico')) == {'AAA': 12, 'CCC': 4}
+    assert db.checkpoints.count_documents({}) == 3
+    assert db.versions.find_one({'_id': 'position_checkpoints'})['stale'] == []
+
+
+def test_checkpoints_keyed_at_the_month_last_day_are_rebuilt(db):
+    db.checkpoints.insert_one({'broker': 'Rico', 'date': datetime(2023, 1, 31),
+                               'positions': [{'stock': 'AAA', 'total': 30.0, 'quantity': 15}]})
+
+    assert quantities(db.genreport_stocks('2023-02-15', 'Rico')) == {'AAA': 12}
+    assert db.checkpoints.find_one({'date': datetime(2023, 1, 31)}) is None
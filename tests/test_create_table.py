@@ -0,0 +1,129 @@
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip('pandas')
+
+
+def test_iter_csv_reports_invalid_rows_with_their_line(tmp_path):
+    from create_table import Table
+
+    path = tmp_path / 'stocks.csv'
+    path.write_text('broker;transaction_type;stock;date;quantity;price;total_price\n'
+                    'Rico;Buy;AAA;2023-01-02;10;2.0;20.0\n'
+                    '\n'
+                    'Rico;Buy;BBB;2023-01-03;1;2.0;2.0;extra;fields\n'
+                    'Rico;Buy;CCC;2023-13-01;1;2.0;2.0\n'
+                    'Rico;Buy;DDD;2023-01-04;1.5;2.0;3.0\n'
+                    'Rico;Buy;EEE;2023-01-05;2;;\n', encoding='utf-8')
+    bad_rows = []
+
+    rows = [row for chunk in Table.iter_csv(str(path), chunksize=2, bad_rows=bad_rows) for row in chunk]
+
+    assert [row['stock'] for row in rows] == ['AAA', 'EEE']
+    assert rows[0]['date'] == datetime(2023, 1, 2)
+    assert (rows[0]['quantity'], rows[0]['total_price']) == (10, 20.0)
+    assert (rows[1]['price'], rows[1]['total_price']) == ('', '')
+    assert sorted(bad_rows) == [(4, None, 'expected 7 fields, saw 9'), (5, 'date', '2023-13-01'), (6, 'quantity', '1.5')]
+
+
+def test_iter_csv_reports_a_bad_line_that_starts_a_chunk_and_reads_quoted_separators(tmp_path):
+    from create_table import Table
+
+    path = tmp_path / 'stocks.csv'
+    path.write_text('broker;transaction_type;stock;date;quantity;price;total_price\n'
+                    'Rico;Buy;AAA;2023-01-02;10;2.0;20.0\n'
+                    'Rico;Buy;BBB;2023-01-03;1;2.0;2.0;extra\n'
+                    'Rico;Buy;CCC;2023-01-03;1;2.0\n'
+                    '"Rico;Easy";Buy;DDD;2023-01-04;1;2.0;2.0\n'
+                    'Rico;Buy;EEE;2023-01-05;x;2.0;2.0\n', encoding='utf-8')
+    bad_rows = []
+
+    rows = [row for chunk in Table.iter_csv(str(path), chunksize=1, bad_rows=bad_rows) for row in chunk]
+
+    assert [(row['broker'], row['stock']) for row in rows] == [('Rico', 'AAA'), ('Rico;Easy', 'DDD')]
+    assert sorted(bad_rows) == [(3, None, 'expected 7 fields, saw 8'), (4, None, 'expected 7 fields, saw 6'),
+                                (6, 'quantity', 'x')]
+
+
+def test_iter_csv_reads_with_the_c_parser_faster_than_row_by_row(tmp_path, monkeypatch):
+    from csv import DictReader
+    from time import perf_counter
+
+    import pandas as pd
+
+    from create_table import Table
+
+    path = tmp_path / 'stocks.csv'
+    with open(path, 'w', encoding='utf-8') as csvf:
+        csvf.write('broker;transaction_type;stock;date;quantity;price;total_price;performance\n')
+        for index in range(20000):
+            csvf.write(f'Rico;Buy;S{index % 50};2023-{index % 12 + 1:02}-{index % 28 + 1:02};{index % 90 + 1};2.5;{(index % 90 + 1)*2.5};\n')
+    engines = []
+    read_csv = pd.read_csv
+    monkeypatch.setattr(pd, 'read_csv', lambda *args, **options: engines.append(options.get('engine')) or read_csv(*args, **options))
+
+    def row_by_row() -> list:
+        with open(path, encoding='utf-8') as csvf:
+            rows = list(DictReader(csvf, delimiter=';'))
+        for row in rows:
+            for column in ('quantity', 'price', 'total_price', 'performance'):
+                if row.get(column):
+                    row[column] = int(row[column]) if column == 'quantity' else float(row[column])
+            row['date'] = datetime.strptime(row['date'], '%Y-%m-%d')
+        return rows
+
+    def best_of(read) -> float:
+        times = []
+        for _ in range(3):
+            start = perf_counter()
+            read()
+            times.append(perf_counter() - start)
+        return min(times)
+
+    assert len(Table.import_csv(str(path))) == 20000
+    assert engines and set(engines) == {'c'}
+    #About half the time of the row by row reader import_csv used before iter_csv
+    assert best_of(lambda: Table.import_csv(str(path))) < 0.8*best_of(row_by_row)
+
+
+
+def test_stream_csv_appends_fixed_columns_and_writes_dates_as_pandas(tmp_path):
+    from conftest import buy
+    from create_table import Table
+
+    path = str(tmp_path / 'stocks.csv')
+    columns = Table.COLUMNS['stocks']
+    assert Table.stream_csv(iter([dict(buy('Rico', 'AAA', datetime(2023, 1, 2), 10, 2.0), _id=1)]), path, columns) == 1
+    assert Table.stream_csv(iter([buy('Rico', 'BBB', datetime(2023, 1, 3, 15, 30), 1, 5.5)]), path, columns) == 1
+
+    lines = open(path, encoding='utf-8').read().splitlines()
+    assert lines == [';'.join(columns), 'Rico;Buy;AAA;2023-01-02;10;2.0;20.0;', 'Rico;Buy;BBB;2023-01-03 15:30:00;1;5.5;5.5;']
+
+
+def test_parquet_round_trip_keeps_types_and_leaves_out_empty_fields(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    from create_table import Table
+
+    columns = ['broker', 'stock', 'date', 'quantity', 'price', 'total_price']
+    rows = [{'broker': 'Rico', 'stock': f'S{index}', 'date': datetime(2023, 1, index + 1), 'quantity': index,
+             'price': 2.5, 'total_price': 2.5*index} for index in range(5)]
+    rows[1]['price'] = ''
+    del rows[3]['stock']
+    path = str(tmp_path / 'stocks.parquet')
+
+    assert Table.export_parquet(iter(rows), path, columns, row_group_size=2) == 5
+
+    parquet_file = pq.ParquetFile(path)
+    assert parquet_file.num_row_groups == 3
+    assert {field.name: str(field.type) for field in parquet_file.schema_arrow} == {
+            'broker': 'dictionary<values=string, indices=int32, ordered=0>',
+            'stock': 'dictionary<values=string, indices=int32, ordered=0>',
+            'date': 'timestamp[ms]', 'quantity': 'int64', 'price': 'double', 'total_price': 'double'}
+    chunks = list(Table.iter_parquet(path))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    #'' is written as a null, and a null is read back as a missing field
+    expected = [dict(row) for row in rows]
+    del expected[1]['price']
+    assert [row for chunk in chunks for row in chunk] == expected
+    assert [len(chunk) for chunk in Table.iter_parquet(path, chunksize=1)] == [1, 1, 1, 1, 1]
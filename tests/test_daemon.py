@@ -0,0 +1,36 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pytest
+
+from conftest import buy
+
+pytest.importorskip('pandas')
+
+
+def test_service_runs_reports_from_worker_threads(sqlite_backend):
+    '''The quote store is created on the main thread and used by the request threads'''
+    import quotes
+    from daemon import Service
+
+    quotes._quote_service = quotes.QuoteService(quotes.StubProvider({'AAA': 12.0, 'BBB': 3.0}), store=quotes.QuoteStore())
+    service = Service()
+    service.database.bulk_insert('stocks', [buy('Rico', 'AAA', datetime(2023, 1, 2), 10, 10.0),
+                                            buy('Rico', 'BBB', datetime(2023, 2, 1), 5, 4.0)])
+    request = {'operation': 'get_statistics', 'product_type': 'stocks', 'broker': 'Rico', 'portfolio': 'All'}
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        answers = list(executor.map(service.run, [request, dict(request)]))
+
+    for answer in answers:
+        per_stock = {row['stock']: row for row in answer['reports']['stocks_per_stock']}
+        assert set(per_stock) == {'AAA', 'BBB'}
+    assert quotes._quote_service.store.load(['AAA'])['AAA'][0] == 12.0
+    assert service.health()['requests'] == 2
+
+
+def test_service_rejects_unknown_operations(sqlite_backend):
+    from daemon import Service
+
+    with pytest.raises(ValueError):
+        Service().run({'operation': 'drop_everything'})
@@ -0,0 +1,87 @@
+import pytest
+
+
+@pytest.fixture
+def mongo_client(monkeypatch):
+    '''get_client creating in-memory MongoDB clients instead of connecting to a server'''
+    mongomock = pytest.importorskip('mongomock')
+    pymongo = pytest.importorskip('pymongo')
+    import database
+
+    created = []
+
+    def client(*args, **kwargs):
+        created.append(kwargs)
+        return mongomock.MongoClient()
+    monkeypatch.setenv('MONGODB_PWD', 'secret')
+    monkeypatch.setattr(pymongo, 'MongoClient', client)
+    monkeypatch.setattr(database, '_client', None)
+    return created
+
+
+def test_client_is_shared_by_every_database_until_closed(mongo_client):
+    from config import mongo as mongo_config
+    from database import Database, close_client, get_client
+
+    client = get_client()
+
+    assert Database().client is client
+    assert Database().client is get_client()
+    assert len(mongo_client) == 1
+    assert mongo_client[0]['maxPoolSize'] == mongo_config['max_pool_size']
+    close_client()
+    close_client()
+    assert get_client() is not client
+    assert len(mongo_client) == 2
+
+
+@pytest.mark.parametrize('collection', ['stocks', 'yields', 'positions', 'position_checkpoints'])
+def test_ensure_indexes_is_idempotent(mongo, collection):
+    from database import Database
+
+    db = Database()
+    target = db.investment_database[collection]
+
+    names = db.ensure_indexes(collection)
+    indexes = target.index_information()
+
+    assert db.ensure_indexes(collection) == names
+    assert target.index_information() == indexes
+    assert [indexes[name]['key'] for name in names] == Database.INDEXES[collection]
+    assert sorted(indexes) == sorted(['_id_'] + names)
+
+
+def test_explain_reports_reads_the_stats_of_find_and_aggregate_outputs(mongo, monkeypatch):
+    from datetime import datetime
+
+    from database import Database
+
+    db = Database()
+    aggregate = {'stages': [{'$cursor': {'queryPlanner': {'winningPlan': {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN'}}},
+                                         'executionStats': {'nReturned': 2, 'totalDocsExamined': 2, 'totalKeysExamined': 2,
+                                                            'executionTimeMillis': 1}}}, {'$group': {}}]}
+    find = {'queryPlanner': {'winningPlan': {'stage': 'COLLSCAN'}},
+            'executionStats': {'nReturned': 1, 'totalDocsExamined': 40, 'totalKeysExamined': 0, 'executionTimeMillis': 3}}
+
+    class Server:
+        '''Answers explain commands as a MongoDB server (the in-memory one does not explain)'''
+        name = 'stocks'
+
+        def command(self, *args, **kwargs):
+            return aggregate
+
+        def find(self, query):
+            return self
+
+        def explain(self):
+            return find
+    monkeypatch.setattr(db, 'investment_database', Server())
+    monkeypatch.setattr(db, 'stocks', Server())
+
+    assert db.explain_reports('stocks', 'Rico', datetime(2023, 12, 31)) == [
+            {'query': 'genreport_stocks', 'docs_examined': 2, 'keys_examined': 2, 'returned': 2, 'execution_time_ms': 1,
+             'index_used': True, 'stages': ['FETCH', 'IXSCAN']},
+            {'query': 'genreport_sold_stocks', 'docs_examined': 40, 'keys_examined': 0, 'returned': 1, 'execution_time_ms': 3,
+             'index_used': False, 'stages': ['COLLSCAN']}]
+    with pytest.raises(KeyError):
+        db.explain_reports('unknown', 'Rico')
@@ -0,0 +1,85 @@
+import json
+
+import pytest
+
+pytest.importorskip('pandas')
+
+
+@pytest.fixture
+def db(tmp_path):
+    from sqlite_database import SQLiteDatabase
+
+    return SQLiteDatabase(str(tmp_path / 'investments.db'))
+
+
+def test_invalid_jsonl_records_are_rejected_and_the_rest_ingested(db, tmp_path):
+    from ingest import ingest
+
+    lines = [json.dumps({'broker': 'rico', 'transaction_type': 'buy', 'stock': 'AAA', 'date': '2023-01-02', 'quantity': 10, 'price': 2}),
+             json.dumps({'broker': 'rico', 'transaction_type': 'buy', 'stock': 'AAA', 'quantity': 1, 'price': 2}),
+             json.dumps({'broker': 'rico', 'transaction_type': 'buy', 'stock': 'AAA', 'date': '2023-13-45', 'quantity': 1, 'price': 2}),
+             json.dumps(['not', 'an', 'object']),
+             '{broken',
+             json.dumps({'broker': 'rico', 'yield_type': 'dividend', 'stock': 'AAA', 'date': '2023-02-01', 'value': 1.5}),
+             json.dumps({'transaction_type': 'Sell', 'stock': 'AAA', 'date': '2023-03-01', 'quantity': 1, 'price': 2})]
+    path = tmp_path / 'records.jsonl'
+    path.write_text('\n'.join(lines), encoding='utf-8')
+
+    result = ingest(str(path), db, export_csv=False)
+
+    assert (result['stocks'], result['yields']) == (1, 1)
+    assert [line for line, _ in result['rejected']] == [2, 3, 4, 5, 7]
+    assert [reason for _, reason in result['rejected'][:3]] == ['missing date', 'invalid date "2023-13-45"', 'not a JSON object']
+    assert db.get_position('Rico', 'AAA')['quantity'] == 10
+
+
+def test_records_after_an_unreadable_line_are_rejected_with_their_line(db, tmp_path):
+    from ingest import ingest
+
+    lines = ['{broken',
+             '',
+             json.dumps({'broker': 'rico', 'transaction_type': 'buy', 'stock': 'AAA', 'date': '2023-01-02', 'quantity': 10, 'price': 2}),
+             json.dumps({'broker': 'rico', 'transaction_type': 'hold', 'stock': 'AAA', 'date': '2023-01-03', 'quantity': 1, 'price': 2})]
+    path = tmp_path / 'records.jsonl'
+    path.write_text('\n'.join(lines), encoding='utf-8')
+
+    result = ingest(str(path), db, export_csv=False)
+
+    assert result['stocks'] == 1
+    assert [line for line, _ in result['rejected']] == [1, 4]
+    assert result['rejected'][1] == (4, 'Invalid transaction type "Hold"')
+
+    path = tmp_path / 'records.csv'
+    path.write_text('broker;transaction_type;stock;date;quantity;price;total_price\n'
+                    'Rico;Buy;AAA;2023-01-02;x;2.0;20.0\n'
+                    '\n'
+                    'Rico;Hold;AAA;2023-01-03;1;2.0;2.0\n', encoding='utf-8')
+
+    result = ingest(str(path), db, export_csv=False)
+
+    assert result['rejected'] == [(2, 'invalid quantity "x"'), (4, 'Invalid transaction type "Hold"')]
+
+
+def test_csv_row_without_date_is_rejected(db, tmp_path):
+    from ingest import ingest
+
+    path = tmp_path / 'records.csv'
+    path.write_text('broker;transaction_type;stock;date;quantity;price;total_price\n'
+                    'Rico;Buy;AAA;2023-01-02;10;2.0;20.0\n'
+                    'Rico;Buy;BBB;;5;1.0;5.0\n', encoding='utf-8')
+
+    result = ingest(str(path), db, export_csv=False)
+
+    assert result['stocks'] == 1
+    assert [reason for _, reason in result['rejected']] == ['missing date']
+
+
+def test_request_records_accept_text_dates(db):
+    from ingest import ingest_records
+
+    result = ingest_records([{'broker': 'Rico', 'yield_type': 'jcp', 'stock': 'AAA', 'date': '2023-05-04', 'value': 2.0},
+                             {'broker': 'Rico', 'yield_type': 'jcp', 'stock': 'AAA', 'date': None, 'value': 2.0}],
+                            db, export_csv=False)
+
+    assert result['yields'] == 1
+    assert result['rejected'] == [(2, 'missing date')]
@@ -0,0 +1,57 @@
+import threading
+from datetime import datetime
+
+from conftest import buy
+from journal import Journal, append_transaction
+
+
+def test_rows_are_written_in_batches_under_one_header(tmp_path):
+    path = str(tmp_path / 'stocks.csv')
+    journal = Journal(path, ['stock', 'quantity'], flush_every=2)
+
+    journal.append({'stock': 'AAA', 'quantity': 1})
+    assert not (tmp_path / 'stocks.csv').exists()
+    journal.append({'stock': 'BBB', 'quantity': 2})
+    with Journal(path, ['stock', 'quantity']) as other:
+        other.append({'stock': 'CCC'})
+
+    assert (tmp_path / 'stocks.csv').read_text(encoding='utf-8') == 'stock;quantity\nAAA;1\nBBB;2\nCCC;\n'
+
+
+def test_existing_columns_are_kept(tmp_path):
+    path = tmp_path / 'yields.csv'
+    path.write_text('stock;value\n', encoding='utf-8')
+
+    with Journal(str(path), ['broker', 'stock', 'value']) as journal:
+        journal.append({'broker': 'Rico', 'stock': 'AAA', 'value': 1.5})
+
+    assert path.read_text(encoding='utf-8') == 'stock;value\nAAA;1.5\n'
+
+
+def test_parallel_writers_never_interleave_rows(tmp_path):
+    path = str(tmp_path / 'stocks.csv')
+
+    def write(number: int) -> None:
+        for batch in range(20):
+            with Journal(path, ['stock', 'quantity'], flush_every=50) as journal:
+                for row in range(50):
+                    journal.append({'stock': f'W{number}', 'quantity': batch*50 + row})
+    writers = [threading.Thread(target=write, args=(number,)) for number in range(4)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+
+    lines = open(path, encoding='utf-8').read().splitlines()
+    assert lines[0] == 'stock;quantity'
+    assert len(lines) == 1 + 4*20*50
+    for number in range(4):
+        assert [int(line.split(';')[1]) for line in lines[1:] if line.startswith(f'W{number};')] == list(range(1000))
+
+
+def test_append_transaction_picks_the_file(workdir):
+    append_transaction(buy('Rico', 'AAA', datetime(2023, 1, 2), 10, 2.0))
+    append_transaction({'broker': 'Rico', 'yield_type': 'dividend', 'stock': 'AAA', 'date': datetime(2023, 2, 1), 'value': 1.0})
+
+    assert (workdir / 'stocks.csv').read_text(encoding='utf-8').splitlines()[1] == 'Rico;Buy;AAA;2023-01-02;10;2.0;20.0;'
+    assert (workdir / 'yields.csv').read_text(encoding='utf-8').splitlines()[1] == 'Rico;dividend;AAA;2023-02-01;1.0'
@@ -0,0 +1,68 @@
+import threading
+
+import pytest
+
+import metrics as metrics_module
+from metrics import Metrics
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    '''A perf_counter advanced by hand'''
+    now = [0.0]
+    monkeypatch.setattr(metrics_module, 'perf_counter', lambda: now[0])
+    return now
+
+
+def test_prompt_waits_are_left_out_of_every_open_span(clock, monkeypatch):
+    metrics = Metrics()
+
+    def answer(text):
+        clock[0] += 10.0
+        return 'yes'
+    monkeypatch.setattr('builtins.input', answer)
+
+    with metrics.span('outer'):
+        clock[0] += 1.0
+        with metrics.span('inner') as inner:
+            clock[0] += 2.0
+            assert metrics.prompt('Continue? ') == 'yes'
+            inner.rows += 5
+        clock[0] += 0.5
+
+    summary = metrics.summary()
+    assert summary['outer']['seconds'] == pytest.approx(3.5)
+    assert summary['inner'] == {'calls': 1, 'seconds': pytest.approx(2.0), 'max_seconds': pytest.approx(2.0), 'rows': 5, 'bytes': 0}
+    assert list(summary) == ['outer', 'inner']
+
+
+def test_prompt_in_another_thread_does_not_pause_this_one(clock, monkeypatch):
+    metrics = Metrics()
+
+    def answer(text):
+        clock[0] += 10.0
+        return ''
+    monkeypatch.setattr('builtins.input', answer)
+
+    with metrics.span('main'):
+        worker = threading.Thread(target=metrics.prompt, args=('? ',))
+        worker.start()
+        worker.join()
+
+    assert metrics.summary()['main']['seconds'] == pytest.approx(10.0)
+
+
+def test_timed_records_rows_and_prometheus_totals(clock):
+    metrics_module.metrics.clear()
+
+    @metrics_module.timed('test.rows', rows=len)
+    def rows():
+        clock[0] += 0.25
+        return [1, 2, 3]
+
+    rows()
+    rows()
+
+    assert metrics_module.metrics.summary()['test.rows'] == {'calls': 2, 'seconds': 0.5, 'max_seconds': 0.25, 'rows': 6, 'bytes': 0}
+    assert 'investments_span_rows_total{span="test.rows"} 6' in metrics_module.metrics.prometheus().splitlines()
+    metrics_module.metrics.clear()
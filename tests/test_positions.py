@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import buy, sell
+
+
+@pytest.fixture(params=['mongodb', 'sqlite'])
+def db(request, tmp_path):
+    '''Each storage backend'''
+    if request.param == 'mongodb':
+        request.getfixturevalue('mongo')
+        from database import Database
+
+        return Database()
+    from sqlite_database import SQLiteDatabase
+
+    return SQLiteDatabase(str(tmp_path / 'investments.db'))
+
+
+def test_positions_are_built_for_a_history_stored_without_them(mongo):
+    from database import Database
+
+    db = Database()
+    db.stocks.insert_many([buy('Rico', 'AAA', datetime(2023, 1, 2), 10, 2.0),
+                           buy('Rico', 'AAA', datetime(2023, 2, 1), 10, 4.0)])
+    assert db.positions.count_documents({}) == 0
+
+    position = db.get_position('Rico', 'AAA')
+
+    assert position['quantity'] == 20
+    assert position['average_price'] == pytest.approx(3.0)
+    assert Database().genreport_stocks(None, 'Rico') == [{'stock': 'AAA', 'total': 60.0, 'quantity': 20}]
+
+
+def test_insert_without_transactions_updates_the_position(mongo):
+    '''The in-memory client has no sessions: both writes go without a transaction'''
+    from database import Database
+
+    db = Database()
+    db.insert_data(buy('Rico', 'AAA', datetime(2023, 1, 2), 10, 2.0))
+    db.insert_data(sell('Rico', 'AAA', datetime(2023, 1, 3), 4, 3.0))
+
+    assert db.get_position('Rico', 'AAA')['quantity'] == 6
+
+
+def test_current_positions_leave_out_future_transactions(db):
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    db.insert_data(buy('Rico', 'AAA', today - timedelta(days=30), 10, 2.0))
+    db.insert_data(buy('Rico', 'AAA', today, 5, 2.0))
+    db.insert_data(buy('Rico', 'AAA', today + timedelta(days=3), 10, 8.0))
+    db.insert_data(buy('Rico', 'BBB', today + timedelta(days=3), 1, 8.0))
+
+    position = db.get_position('Rico', 'AAA')
+    assert (position['quantity'], position['total'], position['average_price']) == (15, 30.0, 2.0)
+    assert {row['stock']: row['quantity'] for row in db.get_positions(['Rico'])} == {'AAA': 15, 'BBB': 0}
+    report = {row['stock']: row for row in db.genreport_stocks(None, 'Rico')}
+    assert report['AAA'] == {'stock': 'AAA', 'total': 30.0, 'quantity': 15}
+
+
+def test_standalone_server_writes_without_transaction(mongo, monkeypatch):
+    from pymongo.errors import OperationFailure
+
+    from database import Database
+
+    class StandaloneSession:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            return False
+
+        def with_transaction(self, write):
+            raise OperationFailure('Transaction numbers are only allowed on a replica set member or mongos', code=20)
+
+    db = Database()
+    monkeypatch.setattr(Database, '_transactions_supported', True)
+    monkeypatch.setattr(db, 'client', type('Client', (), {'start_session': lambda self: StandaloneSession()})())
+    db.insert_data(buy('Rico', 'AAA', datetime(2023, 1, 2), 10, 2.0))
+
+    assert Database._transactions_supported is False
+    assert db.stocks.count_documents({}) == 1
+    assert db.get_position('Rico', 'AAA')['quantity'] == 10
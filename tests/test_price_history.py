@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from conftest import buy, sell
+
+
+def history(first: datetime, closes: list) -> tuple:
+    '''(days, closes) of consecutive days starting at first'''
+    from price_history import to_day
+
+    return np.arange(to_day(first), to_day(first) + len(closes)), np.array(closes, dtype=float)
+
+
+@pytest.fixture
+def provider():
+    from price_history import StubHistoryProvider
+
+    return StubHistoryProvider({'AAA': history(datetime(2023, 1, 1), [10.0 + day for day in range(31)]),
+                                'BBB': history(datetime(2023, 1, 1), [5.0]*31)})
+
+
+def test_portfolio_series_values_holdings_with_carried_prices(tmp_path):
+    from price_history import PriceHistory, StubHistoryProvider
+
+    prices = PriceHistory(str(tmp_path / 'history'), provider=StubHistoryProvider())
+    prices.append('AAA', *history(datetime(2023, 1, 2), [10.0, 11.0, 12.0]))
+    prices.append('BBB', [prices.last_day('AAA')], [5.0])
+    transactions = [buy('Rico', 'AAA', datetime(2023, 1, 1), 10, 10.0),
+                    buy('Rico', 'BBB', datetime(2023, 1, 4), 2, 5.0),
+                    sell('Rico', 'AAA', datetime(2023, 1, 4), 5, 12.0),
+                    {'broker': 'Rico', 'stock': 'AAA', 'date': '', 'quantity': 3, 'total_price': 30.0},
+                    {'broker': 'Rico', 'stock': 'BBB', 'date': datetime(2023, 1, 3), 'quantity': 1}]
+
+    series = prices.portfolio_series(transactions, datetime(2023, 1, 1), datetime(2023, 1, 31))
+
+    assert [(row['date'], row['value'], row['invested']) for row in series] == \
+           [('2023-01-02', 100.0, 100.0), ('2023-01-03', 110.0, 100.0), ('2023-01-04', 70.0, 50.0)]
+    assert [row['daily_return'] for row in series] == [0.0, 10.0, 9.0909]
+    assert series[-1]['cumulative_return'] == pytest.approx(20.0)
+
+
+def test_update_stops_at_yesterday(tmp_path):
+    from price_history import PriceHistory, StubHistoryProvider, from_day
+
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    prices = PriceHistory(str(tmp_path / 'history'),
+                          provider=StubHistoryProvider({'AAA': history(today - timedelta(days=5), [1.0]*7)}))
+
+    assert prices.update(['AAA'], start=today - timedelta(days=5), end=today + timedelta(days=1)) == 5
+    assert from_day(prices.last_day('AAA')) == (today - timedelta(days=1)).strftime('%Y-%m-%d')
+
+
+def test_update_backfills_days_before_the_stored_ones(tmp_path, provider):
+    from price_history import PriceHistory
+
+    prices = PriceHistory(str(tmp_path / 'history'), provider=provider)
+    prices.update(['AAA', 'BBB'], start=datetime(2023, 1, 10), end=datetime(2023, 1, 20))
+
+    assert prices.update(['AAA', 'BBB'], start=datetime(2023, 1, 1), end=datetime(2023, 1, 20)) == 18
+    days, closes = prices.load('AAA')
+    assert days.tolist() == history(datetime(2023, 1, 1), [0]*20)[0].tolist()
+    assert closes.tolist() == [10.0 + day for day in range(20)]
+
+    calls = provider.calls
+    assert prices.update(['AAA', 'BBB'], start=datetime(2023, 1, 1), end=datetime(2023, 1, 20)) == 0
+    assert provider.calls == calls
+
+
+def test_days_without_closes_before_a_stock_history_are_not_fetched_again(tmp_path, provider):
+    from price_history import PriceHistory
+
+    prices = PriceHistory(str(tmp_path / 'history'), provider=provider)
+    prices.update(['AAA'], start=datetime(2022, 12, 1), end=datetime(2023, 1, 5))
+    calls = provider.calls
+
+    assert prices.update(['AAA'], start=datetime(2022, 12, 1), end=datetime(2023, 1, 5)) == 0
+    assert provider.calls == calls
+
+
+def test_interrupted_rewrite_is_finished(tmp_path, provider):
+    import os
+    from price_history import PriceHistory
+
+    prices = PriceHistory(str(tmp_path / 'history'), provider=provider)
+    prices.update(['AAA'], start=datetime(2023, 1, 3), end=datetime(2023, 1, 5))
+    prices.update(['AAA'], start=datetime(2023, 1, 1), end=datetime(2023, 1, 5))
+    #Stopped after renaming the closes: the new days file is still temporary
+    days_file, closes_file = prices._files('AAA')
+    stored = os.path.getsize(days_file)
+    os.replace(days_file, days_file + '.tmp')
+    with open(days_file, 'wb') as daysf:
+        daysf.write(b'\0'*(stored - 8))
+
+    days, closes = prices.load('AAA')
+
+    assert len(days) == len(closes) == 5
+    assert closes.tolist() == [10.0, 11.0, 12.0, 13.0, 14.0]
@@ -0,0 +1,104 @@
+import pytest
+
+import quotes
+from quotes import QuoteService, StubProvider
+
+
+class RecordingProvider(StubProvider):
+    '''StubProvider keeping the stocks asked in each fetch'''
+
+    def __init__(self, prices: dict = None) -> None:
+        super().__init__(prices)
+        self.requests = []
+
+    def fetch(self, stocks: list) -> dict:
+        self.requests.append(list(stocks))
+        return super().fetch(stocks)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    '''time.time and time.monotonic, advanced by hand'''
+    now = [1_700_000_000.0]
+    monkeypatch.setattr(quotes.time, 'time', lambda: now[0])
+    monkeypatch.setattr(quotes.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_repeated_stocks_are_fetched_once_in_one_batch(clock):
+    provider = RecordingProvider({'AAA': 10.0, 'BBB': 20.0})
+    service = QuoteService(provider, ttl=60)
+
+    assert service.prefetch(['AAA', 'BBB', 'AAA', 'CCC']) == {'AAA': 10.0, 'BBB': 20.0, 'CCC': None}
+    assert service.get('BBB') == 20.0
+
+    assert provider.requests == [['AAA', 'BBB', 'CCC']]
+
+
+def test_prices_are_fetched_again_after_the_ttl(clock):
+    provider = RecordingProvider({'AAA': 10.0, 'BBB': 20.0})
+    service = QuoteService(provider, ttl=60)
+    service.prefetch(['AAA'])
+
+    clock[0] += 30
+    service.prefetch(['AAA', 'BBB'])
+    clock[0] += 45
+    provider.prices['AAA'] = 11.0
+
+    assert service.prefetch(['AAA', 'BBB']) == {'AAA': 11.0, 'BBB': 20.0}
+    assert provider.requests == [['AAA'], ['BBB'], ['AAA']]
+
+
+def test_stored_prices_younger_than_max_age_are_not_fetched(clock, tmp_path):
+    from quotes import QuoteStore
+
+    store = QuoteStore(str(tmp_path / 'quotes.db'))
+    store.save({'AAA': 9.0}, updated_at=clock[0] - 100)
+    store.save({'BBB': 19.0}, updated_at=clock[0] - 1000)
+    provider = RecordingProvider({'AAA': 10.0, 'BBB': 20.0})
+
+    prices = QuoteService(provider, store=store, max_age=500).prefetch(['AAA', 'BBB'])
+
+    assert prices == {'AAA': 9.0, 'BBB': 20.0}
+    assert provider.requests == [['BBB']]
+    assert store.load(['BBB']) == {'BBB': (20.0, clock[0])}
+    store.close()
+
+
+def test_offline_service_flags_old_stored_prices_as_stale(clock, tmp_path):
+    from quotes import QuoteStore
+
+    store = QuoteStore(str(tmp_path / 'quotes.db'))
+    store.save({'AAA': 9.0}, updated_at=clock[0] - 1000)
+    provider = RecordingProvider({'AAA': 10.0})
+    service = QuoteService(provider, store=store, max_age=500, offline=True)
+
+    assert service.prefetch(['AAA', 'BBB']) == {'AAA': 9.0, 'BBB': None}
+    assert service.is_stale('AAA') and not service.is_stale('BBB')
+    assert provider.requests == []
+    store.close()
+
+
+def test_concurrent_first_calls_share_one_quote_service(monkeypatch):
+    import threading
+    import time
+
+    QuoteStore = quotes.QuoteStore
+    created = []
+
+    def store():
+        created.append(threading.get_ident())
+        #Widens the window where a second thread would create its own service
+        time.sleep(0.05)
+        return QuoteStore(':memory:')
+    monkeypatch.setattr(quotes, 'QuoteStore', store)
+    services = []
+    threads = [threading.Thread(target=lambda: services.append(quotes.get_quote_service())) for _ in range(8)]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(created) == 1
+    assert len(services) == 8 and all(service is services[0] for service in services)
@@ -0,0 +1,41 @@
+import io
+import json
+from datetime import datetime
+
+
+ROWS = [{'stock': 'AAA', 'date': datetime(2023, 1, 2), 'value': 10.5},
+        {'stock': 'BBB', 'date': datetime(2023, 1, 3, 15, 30), 'value': None}]
+
+
+def test_csv_sink_writes_dates_as_the_journal(tmp_path):
+    from journal import Journal
+    from render import SINKS
+
+    SINKS['csv'].write(ROWS, str(tmp_path / 'report.csv'))
+    with Journal(str(tmp_path / 'journal.csv'), ['stock', 'date', 'value']) as journal:
+        for row in ROWS:
+            journal.append(row)
+
+    expected = 'stock;date;value\nAAA;2023-01-02;10.5\nBBB;2023-01-03 15:30:00;\n'
+    assert (tmp_path / 'report.csv').read_text(encoding='utf-8').replace('\r\n', '\n') == expected
+    assert (tmp_path / 'journal.csv').read_text(encoding='utf-8').replace('\r\n', '\n') == expected
+
+
+def test_json_sink_writes_dates_as_text(tmp_path):
+    from render import SINKS
+
+    SINKS['json'].write(ROWS, str(tmp_path / 'report.json'))
+
+    assert json.loads((tmp_path / 'report.json').read_text(encoding='utf-8'))[0] == \
+           {'stock': 'AAA', 'date': '2023-01-02 00:00:00', 'value': 10.5}
+
+
+def test_terminal_sink_formats_each_column_kind():
+    from config import currency
+    from render import TerminalSink
+
+    stream = io.StringIO()
+    TerminalSink(stream).write([{'stock': 'AAA', 'quantity': 3, 'yield_type': 'fracoes_de_acoes', 'total_value': [10.0, 5.0]}])
+
+    assert stream.getvalue().splitlines()[2:] == ['Stock: AAA ', 'Quantity: 3 shares', 'Yield type: Fracoes de acoes',
+                                                  f'Total value: 10.0 {currency[1]}  | 5.0 %']
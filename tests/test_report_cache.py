@@ -0,0 +1,104 @@
+from datetime import datetime
+
+import pytest
+
+from report_cache import ReportCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ReportCache(str(tmp_path / 'report_cache.db'), max_entries=2, memory_entries=0, touch_batch=10)
+    yield cache
+    cache.close()
+
+
+def used_at(cache: ReportCache) -> dict:
+    return dict(cache.connection.execute('SELECT key, used_at FROM reports').fetchall())
+
+
+def test_least_recently_used_entry_is_evicted(cache):
+    cache.put(b'a', [1])
+    cache.put(b'b', [2])
+    assert cache.get(b'a') == (True, [1])
+
+    cache.put(b'c', [3])
+
+    assert cache.get(b'b') == (False, None)
+    assert cache.get(b'a') == (True, [1])
+    assert cache.stats() == {'hits': 2, 'misses': 1, 'entries': 2, 'in_memory': 0}
+
+
+def test_hits_write_their_use_times_in_batches(cache):
+    cache.put(b'a', [1])
+    stored = used_at(cache)
+
+    for _ in range(9):
+        cache.get(b'a')
+    assert used_at(cache) == stored
+
+    cache.get(b'a')
+    assert used_at(cache)[b'a'] > stored[b'a']
+
+
+def test_memory_hits_return_copies(tmp_path):
+    cache = ReportCache(str(tmp_path / 'report_cache.db'), max_entries=4, memory_entries=2)
+    cache.put(b'a', [{'stock': 'AAA'}])
+
+    cache.get(b'a')[1][0]['stock'] = 'changed'
+
+    assert cache.get(b'a') == (True, [{'stock': 'AAA'}])
+    assert cache.stats()['in_memory'] == 1
+    cache.close()
+
+
+def dividend(stock: str, month: int) -> dict:
+    return {'broker': 'Rico', 'yield_type': 'dividend', 'stock': stock, 'date': datetime(2023, month, 1), 'value': 1.0}
+
+
+def count_version_reads(db, monkeypatch) -> list:
+    '''Calls reading every collection version (the in-memory client also calls find for its own updates)'''
+    reads = []
+    find = db.versions.find
+
+    def counted_find(*args, **kwargs):
+        if args and '_id' not in args[0]:
+            reads.append(args)
+        return find(*args, **kwargs)
+    monkeypatch.setattr(db.versions, 'find', counted_find)
+    return reads
+
+
+def test_reports_see_writes_of_other_processes_at_once(mongo, monkeypatch):
+    from database import Database
+    from report_cache import get_report_cache
+
+    db = Database()
+    report = lambda: db.genreport_yield('2023-01-01', '2023-12-31', 'Rico')
+    db.insert_data(dividend('AAA', 5))
+    assert len(report()) == 1
+    assert len(report()) == 1
+    assert get_report_cache().stats()['hits'] == 1
+
+    #Another process (its own Database) writes the collection
+    Database().insert_data(dividend('BBB', 6))
+
+    assert len(report()) == 2
+
+
+def test_versions_ttl_reuses_versions_and_follows_own_writes(mongo, monkeypatch):
+    import config
+    from database import Database
+
+    monkeypatch.setitem(config.report_cache, 'versions_ttl_seconds', 60.0)
+    db = Database()
+    report = lambda: db.genreport_yield('2023-01-01', '2023-12-31', 'Rico')
+    db.insert_data(dividend('AAA', 5))
+    reads = count_version_reads(db, monkeypatch)
+
+    assert len(report()) == 1
+    assert len(report()) == 1
+    assert len(reads) == 1
+
+    db.insert_data(dividend('AAA', 6))
+    assert len(report()) == 2
+    assert len(reads) == 2
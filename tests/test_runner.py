@@ -0,0 +1,63 @@
+import os
+from datetime import datetime
+
+import pytest
+
+from conftest import buy
+
+pytest.importorskip('pandas')
+
+
+def test_expand_jobs_builds_one_statistics_job_per_portfolio():
+    from runner import expand_jobs
+
+    jobs = expand_jobs(['Rico', 'Xp'], ['Main', 'Dividend'], product_types=['stocks'], from_date='2023-01-01')
+
+    assert [(job['broker'], job['operation'], job.get('portfolio')) for job in jobs] == [
+            ('Rico', 'get_report', None), ('Rico', 'get_statistics', 'Main'), ('Rico', 'get_statistics', 'Dividend'),
+            ('Xp', 'get_report', None), ('Xp', 'get_statistics', 'Main'), ('Xp', 'get_statistics', 'Dividend')]
+    assert {(job['product_type'], job['from_date'], job['to_date']) for job in jobs} == {('stocks', '2023-01-01', None)}
+
+
+@pytest.fixture
+def reports(tmp_path):
+    from sqlite_database import SQLiteDatabase
+
+    db = SQLiteDatabase(str(tmp_path / 'investments.db'))
+    db.bulk_insert('stocks', [buy('Rico', 'AAA', datetime(2023, 1, 2), 10, 2.0)])
+    db.bulk_insert('yields', [{'broker': 'Rico', 'yield_type': 'jcp', 'stock': 'AAA', 'date': datetime(2023, 2, 2), 'value': 1.0}])
+    return db
+
+
+def test_run_jobs_writes_every_output_of_every_job(reports, tmp_path):
+    from quotes import QuoteService, StubProvider
+    from runner import expand_jobs, run_jobs
+
+    jobs = expand_jobs(['Rico'], ['Main'], from_date='2023-01-01', to_date='2023-12-31')
+    output_dir = str(tmp_path / 'reports')
+
+    results = run_jobs(jobs, output_dir, reports, QuoteService(StubProvider({'AAA': 3.0})), max_workers=2)
+
+    written = {os.path.basename(path) for _, files in results for path in files}
+    assert written == set(os.listdir(output_dir)) == {
+            'get_report_stocks_Rico_stocks_report.csv', 'get_report_stocks_Rico_sell_report.csv',
+            'get_report_stocks_Rico_sell_monthly_performance.csv', 'get_report_yields_Rico_yield_report.csv',
+            'get_statistics_stocks_Rico_Main_stocks_summary.csv', 'get_statistics_stocks_Rico_Main_stocks_per_stock.csv',
+            'get_statistics_yields_Rico_Main_yields_summary.csv', 'get_statistics_yields_Rico_Main_yields_per_stock.csv'}
+    with open(os.path.join(output_dir, 'get_statistics_stocks_Rico_Main_stocks_summary.csv'), encoding='utf-8') as csvf:
+        assert '30.0' in csvf.read()
+
+
+def test_run_jobs_adds_the_metrics_of_the_workers(reports, tmp_path):
+    from metrics import metrics
+    from quotes import QuoteService, StubProvider
+    from runner import expand_jobs, run_jobs
+
+    metrics.clear()
+    jobs = expand_jobs(['Rico'], ['Main', 'Dividend'], product_types=['stocks'], from_date='2023-01-01', to_date='2023-12-31')
+
+    run_jobs(jobs, str(tmp_path / 'reports'), reports, QuoteService(StubProvider({'AAA': 3.0})), max_workers=2)
+
+    summary = metrics.summary()
+    assert summary['statistics.generate_stocks_summary']['calls'] == 2
+    assert summary['table.write_csv']['calls'] == 7
@@ -0,0 +1,69 @@
+import logging
+import random
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip('pandas')
+
+from quotes import QuoteService, StubProvider
+
+
+@pytest.fixture
+def db(tmp_path):
+    from sqlite_database import SQLiteDatabase
+
+    return SQLiteDatabase(str(tmp_path / 'investments.db'))
+
+
+def test_yield_summary_matches_the_summary_of_the_raw_rows(db, capsys):
+    from statistics import Statistics
+
+    rnd = random.Random(7)
+    db.bulk_insert('yields', [{'broker': 'Rico', 'yield_type': rnd.choice(Statistics.YIELD_TYPES),
+                               'stock': rnd.choice(['AAA', 'BBBB', 'DDDDD', 'FFF']),
+                               'date': datetime(2023, rnd.randint(1, 12), rnd.randint(2, 28)),
+                               'value': round(rnd.uniform(0, 100), 3)} for _ in range(300)])
+
+    aggregated = db.genreport_yield_summary('2023-01-01', '2023-12-31', 'Rico')
+    raw = db.genreport_yield('2023-01-01', '2023-12-31', 'Rico')
+
+    assert aggregated['total'] == pytest.approx(sum(row['value'] for row in raw))
+    statistics = {name: Statistics(data, QuoteService(StubProvider({})), export_to='print')
+                  for name, data in (('aggregated', aggregated), ('raw', raw))}
+    summaries = {name: statistic._yields_summaries(['All', 'Dividend', 'Main'], logging.getLogger())
+                 for name, statistic in statistics.items()}
+    #Per stock totals are summed in the same order; monthly ones (summed per stock first) to the micro cent
+    for portfolio, (monthly, per_stock) in summaries['raw'].items():
+        assert summaries['aggregated'][portfolio][1] == per_stock
+        assert summaries['aggregated'][portfolio][0] == pytest.approx(monthly, abs=1e-6)
+        assert list(summaries['aggregated'][portfolio][0]) == list(monthly)
+    printed = {}
+    for name, statistic in statistics.items():
+        statistic.generate_yields_summaries()
+        printed[name] = capsys.readouterr().out
+    assert printed['aggregated'] == printed['raw']
+
+
+def test_iter_collection_runs_its_query_holding_the_lock(db):
+    from conftest import buy
+
+    class Connection:
+        '''Records whether the lock is held on each execute of the shared connection'''
+
+        def __init__(self, connection) -> None:
+            self.connection = connection
+            self.locked = []
+
+        def execute(self, *args):
+            self.locked.append(db._lock._is_owned())
+            return self.connection.execute(*args)
+
+        def __getattr__(self, name):
+            return getattr(self.connection, name)
+
+    db.bulk_insert('stocks', [buy('Rico', 'AAA', datetime(2023, 1, 2), 10, 2.0), buy('Rico', 'BBB', datetime(2023, 1, 3), 5, 1.0)])
+    db.connection = Connection(db.connection)
+
+    assert [row['stock'] for row in db.iter_collection('stocks', batch_size=1)] == ['AAA', 'BBB']
+    assert db.connection.locked == [True]
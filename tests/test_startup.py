@@ -0,0 +1,25 @@
+import os
+import re
+import subprocess
+import sys
+
+from conftest import ROOT
+
+
+def test_get_csv_starts_within_budget_without_heavy_libraries(tmp_path):
+    from config import startup
+
+    completed = subprocess.run([sys.executable, '-X', 'importtime', os.path.join(ROOT, 'main.py'),
+                                '-o', 'get_csv', '-p', 'yields', '--profile-startup'],
+                               cwd=tmp_path, capture_output=True, text=True, timeout=120)
+
+    assert completed.returncode == 0, completed.stdout + completed.stderr
+    total, heavy = re.search(r'^total\s+([\d.]+) s \| heavy libraries loaded: (.*)$', completed.stdout, re.MULTILINE).groups()
+    assert float(total) <= startup['budget_seconds']
+    #profile_startup reports which of them are in sys.modules
+    assert heavy == '[]'
+    #-X importtime writes one "import time: self | cumulative | module" line per module imported with an import statement
+    imported = {line.rsplit('|', 1)[-1].strip().split('.')[0]
+                for line in completed.stderr.splitlines() if line.startswith('import time:')}
+    assert 'config' in imported
+    assert not imported & {'yfinance', 'pandas', 'pymongo'}
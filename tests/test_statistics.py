@@ -0,0 +1,150 @@
+import calendar
+import random
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip('pandas')
+
+from config import portfolios
+from quotes import QuoteService, StubProvider
+
+YIELD_TYPES = ['dividend', 'jcp', 'rendimentos_de_clientes', 'fracoes_de_acoes']
+PRICES = {'AAA': 12.37, 'BBBB': 7.91, 'CCCCC': 31.05, 'DDDDD': 3.33, 'EEEEE': 18.6, 'FFF': 44.44}
+
+
+def selected_stocks(data: list, portfolio: str) -> list:
+    selected = portfolios[portfolio]
+    return [row['stock'] for row in data] if '*' in selected else selected
+
+
+def row_by_row_yields_summary(data: list, portfolio: str) -> tuple:
+    '''generate_yields_summary before the pandas rewrite, without its prompts'''
+    selected = selected_stocks(data, portfolio)
+    monthly_performance = {}
+    yield_per_stock = {}
+    for row in data:
+        if row['stock'] in selected:
+            month = calendar.month_name[row['date'].month]
+            monthly_performance[month] = monthly_performance.get(month, 0.0) + round(float(row['value']), 2)
+            yield_per_stock[row['stock']] = {yield_type: 0.0 for yield_type in YIELD_TYPES}
+    for row in data:
+        if row['stock'] in selected:
+            yield_per_stock[row['stock']][row['yield_type']] = yield_per_stock[row['stock']].get(row['yield_type'], 0) + row['value']
+    yields_per_stocks = [dict(stock=stock, **{yield_type: round(values.get(yield_type, 0.0), 2) for yield_type in YIELD_TYPES})
+                         for stock, values in yield_per_stock.items()]
+    monthly_performance['average_per_month'] = round(sum(monthly_performance.values())/12, 2)
+    return [monthly_performance], yields_per_stocks
+
+
+def row_by_row_stocks_summary(data: list, portfolio: str) -> tuple:
+    '''generate_stocks_summary before the pandas rewrite, without its prompts'''
+    selected = selected_stocks(data, portfolio)
+    total_invested = 0
+    current_total_value = 0
+    for row in data:
+        if row['stock'] in selected:
+            total_invested = total_invested + row['total']
+            current_total_value = current_total_value + (PRICES.get(row['stock']) or 0.0)*row['quantity']
+    summary = {'total_invested': round(total_invested, 2), 'current_total_value': round(current_total_value, 2),
+               'performance': [round(current_total_value - total_invested, 2), round(current_total_value/total_invested - 1, 2)*100]}
+    stocks_summary = []
+    for row in data:
+        if row['stock'] in selected and row['quantity'] != 0:
+            market_price = PRICES.get(row['stock']) or 0.0
+            total_current_stock_value = round(market_price*row['quantity'], 2)
+            total_invested_stock_value = round(row['total'], 2)
+            stocks_summary.append({'stock': row['stock'],
+                                   'current_stock_value': market_price,
+                                   'total_current_stock_value': total_current_stock_value,
+                                   'total_invested_stock_value': total_invested_stock_value,
+                                   'stock_weight': round(total_current_stock_value/current_total_value, 2)*100,
+                                   'stock_performance': [round(total_current_stock_value - total_invested_stock_value, 2),
+                                                         round(total_current_stock_value/total_invested_stock_value - 1, 2)*100],
+                                   'quantity': row['quantity']})
+    return [summary], stocks_summary
+
+
+@pytest.fixture
+def yields() -> list:
+    '''Values with three decimals: their totals differ in the last digit if summed in another order'''
+    rnd = random.Random(0)
+    return [{'broker': 'Rico', 'yield_type': rnd.choice(YIELD_TYPES), 'stock': rnd.choice(['AAA', 'BBBB', 'DDDDD', 'FFF']),
+             'date': datetime(2022, rnd.randint(1, 12), rnd.randint(1, 28)), 'value': round(rnd.uniform(0, 100), 3)}
+            for _ in range(200)]
+
+
+@pytest.fixture
+def stocks() -> list:
+    rnd = random.Random(1)
+    return [{'stock': stock, 'total': round(rnd.uniform(10, 1000), 3), 'quantity': quantity}
+            for stock, quantity in zip(PRICES, [10, 0, 35, 100, 7, 3])] + [{'stock': 'ZZZ', 'total': 50.0, 'quantity': 5}]
+
+
+@pytest.mark.parametrize('portfolio', ['All', 'Dividend', 'Main'])
+def test_yields_summary_matches_the_row_by_row_summary(yields, portfolio):
+    from statistics import Statistics
+
+    statistics = Statistics(yields, QuoteService(StubProvider(PRICES)), export_to='api')
+    statistics.generate_yields_summary(portfolio)
+
+    monthly_performance, yields_per_stocks = row_by_row_yields_summary(yields, portfolio)
+    assert statistics.results['yields_summary'] == monthly_performance
+    assert statistics.results['yields_per_stock'] == yields_per_stocks
+
+
+@pytest.mark.parametrize('portfolio', ['All', 'Dividend', 'Main'])
+def test_stocks_summary_matches_the_row_by_row_summary(stocks, portfolio):
+    from statistics import Statistics
+
+    statistics = Statistics(stocks, QuoteService(StubProvider(PRICES)), export_to='api')
+    statistics.generate_stocks_summary(portfolio)
+
+    summary, stocks_summary = row_by_row_stocks_summary(stocks, portfolio)
+    assert statistics.results['stocks_summary'] == summary
+    assert statistics.results['stocks_per_stock'] == stocks_summary
+
+
+def test_printed_yields_summary_matches_the_row_by_row_summary(yields, capsys):
+    from render import SINKS
+    from statistics import Statistics
+
+    Statistics(yields, QuoteService(StubProvider(PRICES)), export_to='print').generate_yields_summary('All')
+    printed = capsys.readouterr().out
+    for payload in row_by_row_yields_summary(yields, 'All'):
+        SINKS['print'].write(payload)
+        print('\n')
+
+    assert printed == capsys.readouterr().out
+
+
+def test_a_stock_of_several_portfolios_is_in_each_of_them_and_in_all():
+    import logging
+
+    from statistics import Statistics, portfolio_index
+
+    stock_portfolios, all_stocks_portfolios = portfolio_index()
+    assert stock_portfolios['AAA'] == {'Dividend', 'Main'}
+    assert all_stocks_portfolios == {'All'}
+
+    statistics = Statistics([{'stock': 'AAA'}, {'stock': 'DDDDD'}, {'stock': 'ZZZ'}], QuoteService(StubProvider(PRICES)))
+    rows = statistics._assign_portfolios(['All', 'Dividend', 'Main'], logging.getLogger())
+
+    assert list(zip(rows['stock'], rows['portfolio'])) == [('AAA', 'All'), ('AAA', 'Dividend'), ('AAA', 'Main'),
+                                                           ('DDDDD', 'All'), ('DDDDD', 'Main'), ('ZZZ', 'All')]
+
+
+def test_summaries_of_all_portfolios_match_the_row_by_row_summary_of_each(yields, stocks):
+    from statistics import Statistics
+
+    results = {}
+    Statistics(yields, QuoteService(StubProvider(PRICES)), export_to='api', results=results).generate_yields_summaries()
+    Statistics(stocks, QuoteService(StubProvider(PRICES)), export_to='api', results=results).generate_stocks_summaries()
+
+    for portfolio in ['All', 'Dividend', 'Main']:
+        monthly_performance, yields_per_stocks = row_by_row_yields_summary(yields, portfolio)
+        assert results[f'{portfolio}_yields_summary'] == monthly_performance
+        assert results[f'{portfolio}_yields_per_stock'] == yields_per_stocks
+        summary, stocks_summary = row_by_row_stocks_summary(stocks, portfolio)
+        assert results[f'{portfolio}_stocks_summary'] == summary
+        assert results[f'{portfolio}_stocks_per_stock'] == stocks_summary
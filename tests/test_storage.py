@@ -0,0 +1,40 @@
+from datetime import datetime
+
+from conftest import buy, sell
+from storage import Storage
+
+
+def stored(*rows) -> list:
+    return [(record_id, row) for record_id, row in enumerate(rows)]
+
+
+def test_sync_changes_matches_records_by_key_and_occurrence():
+    first, repeated = buy('Rico', 'AAA', datetime(2023, 1, 2), 10, 2.0), buy('Rico', 'AAA', datetime(2023, 2, 1), 1, 3.0)
+    gone = sell('Xp', 'BBB', datetime(2023, 3, 1), 1, 5.0)
+    changed = dict(repeated, price=4.0, total_price=4.0)
+
+    changes = Storage._sync_changes('stocks', stored(first, repeated, repeated, gone),
+                                    [[dict(first, quantity=10.0000001), repeated], [changed, buy('Rico', 'CCC', datetime(2023, 1, 20), 1, 1.0)]])
+
+    assert changes['summary'] == {'inserted': 1, 'updated': 1, 'deleted': 1, 'unchanged': 2}
+    assert changes['updates'] == [(2, changed)]
+    assert changes['deletes'] == [3]
+    assert [row['stock'] for row in changes['inserts']] == ['CCC']
+    assert changes['first_dates'] == {'Rico': datetime(2023, 1, 20), 'Xp': datetime(2023, 3, 1)}
+
+
+def test_sync_changes_leaves_rows_without_a_date_out_of_first_dates():
+    undated = dict(buy('Rico', 'AAA', None, 1, 1.0), date='')
+
+    changes = Storage._sync_changes('stocks', stored(dict(undated, date=None)),
+                                    [[undated, buy('Rico', 'BBB', datetime(2023, 5, 1), 1, 1.0)]])
+
+    assert changes['summary'] == {'inserted': 2, 'updated': 0, 'deleted': 1, 'unchanged': 0}
+    assert changes['first_dates'] == {'Rico': datetime(2023, 5, 1)}
+
+
+def test_remove_moves_recomputes_the_average_price():
+    positions = [{'broker': 'Rico', 'stock': 'AAA', 'quantity': 15, 'total': 40.0, 'average_price': 40/15}]
+
+    assert Storage._remove_moves(positions, {('Rico', 'AAA'): (5, 20.0)}) == \
+           [{'broker': 'Rico', 'stock': 'AAA', 'quantity': 10, 'total': 20.0, 'average_price': 2.0}]
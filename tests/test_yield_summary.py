@@ -0,0 +1,79 @@
+import logging
+import random
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip('pandas')
+
+from quotes import QuoteService, StubProvider
+
+YIELD_TYPES = ['dividend', 'jcp', 'rendimentos_de_clientes', 'fracoes_de_acoes']
+
+
+@pytest.fixture
+def yields() -> list:
+    '''Yields of two brokers, some of them out of the 2023 period'''
+    rnd = random.Random(7)
+    return [{'broker': rnd.choice(['Rico', 'Rico', 'Xp']), 'yield_type': rnd.choice(YIELD_TYPES),
+             'stock': rnd.choice(['AAA', 'BBBB', 'DDDDD', 'FFF']),
+             'date': datetime(rnd.choice([2022, 2023, 2023, 2023]), rnd.randint(1, 12), rnd.randint(2, 28)),
+             'value': round(rnd.uniform(0, 100), 3)} for _ in range(300)]
+
+
+@pytest.fixture
+def mongo_round(mongo, monkeypatch):
+    '''The in-memory MongoDB does not know $round: it is taught MongoDB's (half to even, as Python's round)'''
+    aggregate = pytest.importorskip('mongomock.aggregate')
+    if not hasattr(aggregate, '_Parser'):
+        pytest.skip('mongomock parser not found')
+    parse = aggregate._Parser.parse
+
+    def parse_round(self, expression):
+        if isinstance(expression, dict) and '$round' in expression:
+            value, digits = expression['$round']
+            return round(self.parse(value), digits)
+        return parse(self, expression)
+    monkeypatch.setattr(aggregate._Parser, 'parse', parse_round)
+    return mongo
+
+
+def summaries(data) -> dict:
+    '''Yields summaries of every portfolio, from raw rows or aggregated ones.
+    Monthly totals are summed in another order from aggregated rows: they are compared to the micro cent'''
+    from statistics import Statistics
+
+    def micro_cents(value):
+        if isinstance(value, float):
+            return round(value, 6)
+        if isinstance(value, dict):
+            return {key: micro_cents(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [micro_cents(item) for item in value]
+        return value
+    return micro_cents(Statistics(data, QuoteService(StubProvider({})))._yields_summaries(['All', 'Dividend', 'Main'], logging.getLogger()))
+
+
+def printed(data, capsys) -> str:
+    from statistics import Statistics
+
+    Statistics(data, QuoteService(StubProvider({})), export_to='print').generate_yields_summaries()
+    return capsys.readouterr().out
+
+
+def test_facet_summary_matches_the_summary_of_the_raw_rows(yields, mongo_round, capsys):
+    from database import Database
+
+    db = Database()
+    db.yields.insert_many([dict(row) for row in yields])
+
+    facets = db.genreport_yield_summary('2023-01-01', '2023-12-31', 'Rico')
+    raw = db.genreport_yield('2023-01-01', '2023-12-31', 'Rico')
+
+    period = [row for row in yields if row['broker'] == 'Rico' and row['date'].year == 2023]
+    assert len(raw) == len(period)
+    assert facets['total'] == pytest.approx(sum(row['value'] for row in period))
+    assert sum(row['value'] for row in facets['per_stock']) == pytest.approx(facets['total'])
+    #Summaries of the aggregated rows are those of the raw rows (the per stock loop the $facet replaced)
+    assert summaries(facets) == summaries(raw)
+    assert printed(facets, capsys) == printed(raw, capsys)